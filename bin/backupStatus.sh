@@ -41,6 +41,7 @@ function row() {
     local n=$4
     local c=$5
     local o=$6
+    local summary=("${@:7}")
     local space='                            '
     local tcls=''
     if [[ "${s}" == "COMPLETE" ]]; then
@@ -69,16 +70,28 @@ function row() {
         echo "${space}    <td><a class=\"btn btn-sm btn-outline-light\" role=\"button\" href=\"#\" title=\"Status not run.\">CSV</a></td>" >> ${o}
         echo "${space}    <td><a class=\"btn btn-sm btn-outline-light\" role=\"button\" href=\"#\" title=\"Status not run.\">JSON</a></td>" >> ${o}
         echo "${space}    <td><a class=\"btn btn-sm btn-outline-light\" role=\"button\" href=\"#\" title=\"Status not run.\">LOG</a></td>" >> ${o}
+        echo "${space}    <td><a class=\"btn btn-sm btn-outline-light\" role=\"button\" href=\"#\" title=\"Status not run.\">JSON</a></td>" >> ${o}
     else
-        echo "${space}    <td><a class=\"btn btn-sm btn-outline-primary\" role=\"button\" href=\"disk_files_${d}.csv\" title=\"disk_files_${d}.csv\">CSV</a></td>" >> ${o}
-        echo "${space}    <td><a class=\"btn btn-sm btn-outline-primary\" role=\"button\" href=\"hpss_files_${d}.csv\" title=\"hpss_files_${d}.csv\">CSV</a></td>" >> ${o}
-        echo "${space}    <td><a class=\"btn btn-sm btn-outline-primary\" role=\"button\" href=\"missing_files_${d}.json\" title=\"missing_files_${d}.json\">JSON</a></td>" >> ${o}
+        echo "${space}    <td>${summary[0]}</td>" >> ${o}
+        echo "${space}    <td>${summary[1]}</td>" >> ${o}
+        echo "${space}    <td>${summary[2]}</td>" >> ${o}
         echo "${space}    <td><a class=\"btn btn-sm btn-outline-primary\" role=\"button\" href=\"missing_from_hpss_${d}-${j}.log\" title=\"missing_from_hpss_${d}-${j}.log\">LOG</a></td>" >> ${o}
+        echo "${space}    <td>${summary[3]}</td>" >> ${o}
     fi
     echo "${space}    <td>${c}</td>" >> ${o}
     echo "${space}</tr>" >> ${o}
 }
 #
+# Read the counts and table cells of a section from its summary file,
+# written by summarize_backups.py, one per line.
+#
+function summary() {
+    local f=$1
+    python -c "import json, sys; s = json.load(open(sys.argv[1])); \
+print('\n'.join([str(s.get(k, 0)) for k in ('n_hpss', 'n_backups', 'n_newer')] + \
+                [s['html'].get(k, '') for k in ('disk', 'hpss', 'missing', 'changes')]))" ${f}
+}
+#
 # Get options.
 #
 cacheDir=/global/cfs/cdirs/desi/metadata/backups
@@ -129,6 +142,7 @@ COMMENTS
 for d in ${sections}; do
     c=$(grep "${d}:" <<<"${comments}" | cut -d: -f2)
     j=0
+    counts=()
     if [[ "${d}" == "external" || \
           "${d}" == "gsharing" || \
           "${d}" == "software" || \
@@ -144,17 +158,18 @@ for d in ${sections}; do
             echo "ERROR: Could not find job ID for ${d}!"
             j=0
         fi
-        hpss_files=$(wc -l ${cacheDir}/hpss_files_${d}.csv | cut -d' ' -f1)
-        missing_files=$(<${cacheDir}/missing_files_${d}.json)
+        mapfile -t counts < <(summary ${cacheDir}/summary_${d}.json)
+        hpss_files=${counts[0]}
+        missing_files=${counts[1]}
         section_log="${cacheDir}/missing_from_hpss_${d}-${j}.log"
         missing_log=$(grep -v INFO ${section_log})
-        if [[ "${hpss_files}" == "1" && "${missing_files}" == "{}" ]]; then
+        if [[ "${hpss_files}" == "0" && "${missing_files}" == "0" ]]; then
             c="Not configured for backup. ${c}"
             s='NO CONFIGURATION'
-        elif [[ "${hpss_files}" > "1" && -z "${missing_log}" && "${missing_files}" == "{}" ]]; then
+        elif [[ "${hpss_files}" -gt 0 && -z "${missing_log}" && "${missing_files}" == "0" ]]; then
             c="No missing files found. ${c}"
             s='COMPLETE'
-        elif grep -q '"newer": true' ${cacheDir}/missing_files_${d}.json; then
+        elif [[ "${counts[2]}" -gt 0 ]]; then
             c="New data found in an existing backup. Check JSON file. ${c}"
             s='NEEDS ATTENTION'
         elif grep -q 'not mapped' ${section_log}; then
@@ -175,7 +190,7 @@ for d in ${sections}; do
         fi
         n=True
     fi
-    row ${d} ${j} "${s}" ${n} "${c}" ${o}
+    row ${d} ${j} "${s}" ${n} "${c}" ${o} "${counts[@]:3}"
 done
 #
 # Finish the HTML table.
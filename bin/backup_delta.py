@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""
+Report what changed in each section since the previous backup status run.
+
+The cached listings are compared with snapshots of those seen by the
+previous run:
+
+* disk_files_SECTION.csv gives the files added to, removed from and changed
+  in size on disk;
+* hpss_files_SECTION.csv gives the files added to and removed from HPSS;
+* missing_files_SECTION.json gives the disk files that were waiting for a
+  backup and no longer are, that is, newly backed-up files.
+
+Every listing is loaded into NumPy arrays sorted by a 64-bit hash of the
+file name, and each pair of listings is merge-joined with searchsorted, so
+tens of millions of rows take seconds.  The result is a compact
+delta_SECTION.json in the cache directory, with counts, bytes and the
+largest few files of each kind, and the current listings become the
+snapshots for the next run, in the previous/ subdirectory of the cache.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+# Number of example files kept per kind of change
+MAX_EXAMPLES = 20
+
+# Constants of the name hash
+MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def name_keys(data, starts, ends):
+    """
+    64-bit hash of every name data[starts[i]:ends[i]], computed eight bytes
+    at a time for all names at once
+    """
+    words = np.ndarray((len(data) - 7,), dtype='<u8', buffer=data, strides=(1,))
+    lengths = ends - starts
+    keys = lengths.astype(np.uint64)
+    for offset in range(0, int(lengths.max(initial=0)), 8):
+        active = np.flatnonzero(lengths > offset)
+        remaining = np.minimum(lengths[active] - offset, 8).astype(np.uint64)
+        mask = np.where(remaining == 8, np.uint64(MASK64),
+                        (np.uint64(1) << (remaining * np.uint64(8))) - np.uint64(1))
+        h = (keys[active] ^ (words[starts[active] + offset] & mask)) * np.uint64(MULTIPLIER)
+        keys[active] = h ^ (h >> np.uint64(29))
+    keys *= np.uint64(MULTIPLIER)
+    return keys ^ (keys >> np.uint64(32))
+
+
+def parse_integers(data, starts, ends):
+    """Decimal integers data[starts[i]:ends[i]], one digit position at a time"""
+    values = np.zeros(len(starts), dtype=np.int64)
+    for k in range(int((ends - starts).max(initial=0))):
+        pos = starts + k
+        active = pos < ends
+        digits = data[np.minimum(pos, len(data) - 1)].astype(np.int64) - 48
+        values = np.where(active, values * 10 + digits, values)
+    return values
+
+
+class Listing:
+    """
+    File names with their sizes and mtimes, sorted by a hash of the name
+    Names stay in one byte buffer, addressed by start and end offsets, so
+    no Python object is made per file.
+    """
+
+    def __init__(self, data, starts, ends, sizes, mtimes):
+        # Eight bytes of padding let the hash read whole words at the end of the buffer
+        self.data = np.concatenate([np.frombuffer(data, dtype=np.uint8), np.zeros(8, dtype=np.uint8)])
+        keys = name_keys(self.data, starts, ends)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.starts, self.ends = starts[order], ends[order]
+        self.size = np.asarray(sizes, dtype=np.int64)[order]
+        self.mtime = np.asarray(mtimes, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def name(self, i):
+        return self.data[self.starts[i]:self.ends[i]].tobytes().decode('utf-8', 'surrogateescape')
+
+    @classmethod
+    def from_names(cls, names, sizes, mtimes):
+        lengths = np.array([len(n) for n in names], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        return cls(b''.join(names), ends - lengths, ends, sizes, mtimes)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read a Name,Size,Mtime cache file"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if b'"' in data:
+            # Quoted names may hold commas or newlines; let csv handle them
+            names, sizes, mtimes = [], [], []
+            for name, size, mtime in csv.reader(data.decode('utf-8', 'surrogateescape').splitlines(True)[1:]):
+                names.append(name.encode('utf-8', 'surrogateescape'))
+                sizes.append(int(size))
+                mtimes.append(int(mtime))
+            return cls.from_names(names, sizes, mtimes)
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == ord('\n'))
+        # Skip the header; csv writes lines ending in \r\n
+        starts, ends = newlines[:-1] + 1, newlines[1:]
+        ends = ends - (buffer[ends - 1] == ord('\r'))
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        # Sizes and mtimes follow the last two commas of each line
+        commas = np.flatnonzero(buffer == ord(','))
+        last = np.searchsorted(commas, ends) - 1
+        size_comma, mtime_comma = commas[last - 1], commas[last]
+        return cls(data, starts, size_comma, parse_integers(buffer, size_comma + 1, mtime_comma),
+                   parse_integers(buffer, mtime_comma + 1, ends))
+
+    @classmethod
+    def from_missing(cls, path):
+        """Disk files waiting for a backup, from a missing_files JSON file"""
+        with open(path) as f:
+            missing = json.load(f)
+        names = [name.encode('utf-8', 'surrogateescape') for backup in missing.values() for name in backup['files']]
+        return cls.from_names(names, np.zeros(len(names)), np.zeros(len(names)))
+
+    def save(self, path):
+        """Save the listing to a .npz file"""
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, data=self.data, keys=self.keys, starts=self.starts, ends=self.ends,
+                 size=self.size, mtime=self.mtime)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a listing written by save"""
+        listing = cls.__new__(cls)
+        with np.load(path) as data:
+            for name in ('data', 'keys', 'starts', 'ends', 'size', 'mtime'):
+                setattr(listing, name, data[name])
+        return listing
+
+    def find(self, other):
+        """Index of each of other's files in this listing, -1 where it is absent"""
+        if not len(self):
+            return np.full(len(other), -1)
+        idx = np.searchsorted(self.keys, other.keys)
+        idx[idx == len(self)] = 0
+        return np.where(self.keys[idx] == other.keys, idx, -1)
+
+
+def summarize(listing, rows, size=None):
+    """Count, total bytes and largest examples of the given rows of listing"""
+    size = listing.size[rows] if size is None else size
+    largest = rows[np.argsort(-np.abs(size), kind='stable')[:MAX_EXAMPLES]]
+    return {'n': int(len(rows)), 'bytes': int(size.sum()),
+            'examples': [listing.name(i) for i in largest]}
+
+
+def compare(previous, current):
+    """Files added, removed and changed in size between two listings"""
+    in_previous = previous.find(current)
+    in_current = current.find(previous)
+    added = np.nonzero(in_previous < 0)[0]
+    removed = np.nonzero(in_current < 0)[0]
+    both = np.nonzero(in_previous >= 0)[0]
+    changed = both[current.size[both] != previous.size[in_previous[both]]]
+    return {'added': summarize(current, added),
+            'removed': summarize(previous, removed),
+            'changed_size': summarize(current, changed, current.size[changed] - previous.size[in_previous[changed]])}
+
+
+def section_delta(cache, section):
+    """Compare the cached listings of a section with their snapshots and replace the snapshots"""
+    snapshots = os.path.join(cache, 'previous')
+    sources = {'disk': (os.path.join(cache, f'disk_files_{section}.csv'), Listing.from_csv),
+               'hpss': (os.path.join(cache, f'hpss_files_{section}.csv'), Listing.from_csv),
+               'missing': (os.path.join(cache, f'missing_files_{section}.json'), Listing.from_missing)}
+    current, previous = {}, {}
+    for kind, (path, read) in sources.items():
+        if os.path.exists(path):
+            current[kind] = read(path)
+        snapshot = os.path.join(snapshots, f'{kind}_files_{section}.npz')
+        if os.path.exists(snapshot):
+            previous[kind] = Listing.load(snapshot)
+    delta = {'section': section, 'date': int(time.time()), 'previous': None}
+    updated = os.path.join(snapshots, f'updated_{section}.json')
+    if os.path.exists(updated):
+        with open(updated) as f:
+            delta['previous'] = json.load(f)['date']
+    for kind in ('disk', 'hpss'):
+        if kind in current:
+            delta[f'n_{kind}'] = len(current[kind])
+            if kind in previous:
+                delta[kind] = compare(previous[kind], current[kind])
+    if 'missing' in previous and 'missing' in current and 'disk' in current:
+        # Files that were waiting for a backup, are still on disk and no longer wait
+        was_missing = previous['missing']
+        still_missing = current['missing'].find(was_missing) >= 0
+        on_disk = current['disk'].find(was_missing)
+        backed_up = np.nonzero(~still_missing & (on_disk >= 0))[0]
+        delta['backed_up'] = summarize(current['disk'], on_disk[backed_up])
+
+    os.makedirs(snapshots, exist_ok=True)
+    for kind, listing in current.items():
+        listing.save(os.path.join(snapshots, f'{kind}_files_{section}.npz'))
+    with open(updated, 'w') as f:
+        json.dump({'date': delta['date']}, f)
+    tmp = os.path.join(cache, f'delta_{section}.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(delta, f, indent=2)
+    os.replace(tmp, os.path.join(cache, f'delta_{section}.json'))
+    return delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report what changed in each section since the previous run.')
+    parser.add_argument('-c', '--cache-dir', dest='cache', metavar='DIR',
+                        default=os.path.join(os.environ['HOME'], 'cache'),
+                        help='Read cache files from DIR (Default: %(default)s).')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information.')
+    parser.add_argument('sections', metavar='SECTION', nargs='+', help='Compare these sections.')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S')
+    for section in options.sections:
+        start = time.time()
+        delta = section_delta(options.cache, section)
+        changes = ', '.join(f"{delta[kind][change]['n']} {change} on {kind}"
+                            for kind in ('disk', 'hpss') if kind in delta
+                            for change in ('added', 'removed', 'changed_size'))
+        if 'backed_up' in delta:
+            changes += f", {delta['backed_up']['n']} newly backed up"
+        logging.info("%s: %s (%.1f s).", section, changes or 'no previous listings', time.time() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
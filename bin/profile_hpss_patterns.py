@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""
+Lint the regular expressions of a backup configuration and profile their cost.
+
+``missing_from_hpss`` tests every file of a directory against every
+pattern configured for that directory, so a slow pattern costs its time
+once per file, millions of times a night.  This script
+
+1. lints every pattern: nested unbounded repeats that can match the same
+   text in many ways (catastrophic backtracking) are errors; several
+   unbounded ``.*`` in one pattern, patterns that do not start with their
+   directory name, and alternatives that could be factored are reported
+   with a suggested tighter form;
+2. unless --lint-only is given, times every pattern on a random sample of
+   the paths in disk_files_SECTION.csv, the way ``missing_from_hpss``
+   applies it, and ranks the patterns by their estimated cost on the whole
+   listing.  The slowest single path of each pattern is reported too, as
+   a sign of backtracking on real names.
+
+The exit status is 1 if any pattern does not compile or has a lint error,
+so the lint can run in CI next to the JSON validity check.
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# Number of disk paths timed per section
+SAMPLE_SIZE = 100000
+
+# Alternations with more branches than this are reported
+MAX_BRANCHES = 8
+
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+def matches_char(op, av, char):
+    """Whether the single-character item (op, av) of a parsed pattern can match char"""
+    if op == sre_constants.ANY:
+        return char != '\n'
+    if op == sre_constants.LITERAL:
+        return ord(char) == av
+    if op == sre_constants.NOT_LITERAL:
+        return ord(char) != av
+    if op == sre_constants.IN:
+        negate = bool(av) and av[0][0] == sre_constants.NEGATE
+        found = False
+        for item_op, item_av in av[1:] if negate else av:
+            if item_op == sre_constants.LITERAL:
+                found = ord(char) == item_av
+            elif item_op == sre_constants.RANGE:
+                found = item_av[0] <= ord(char) <= item_av[1]
+            elif item_op == sre_constants.CATEGORY:
+                found = {sre_constants.CATEGORY_DIGIT: char.isdigit(),
+                         sre_constants.CATEGORY_NOT_DIGIT: not char.isdigit(),
+                         sre_constants.CATEGORY_WORD: char.isalnum() or char == '_',
+                         sre_constants.CATEGORY_NOT_WORD: not (char.isalnum() or char == '_'),
+                         sre_constants.CATEGORY_SPACE: char.isspace(),
+                         sre_constants.CATEGORY_NOT_SPACE: not char.isspace()}.get(item_av, True)
+            if found:
+                break
+        return found != negate
+    return True
+
+
+def items(parsed):
+    """Every item of a parsed pattern, depth first"""
+    for op, av in parsed:
+        yield op, av
+        if op in REPEATS:
+            yield from items(av[2])
+        elif op == sre_constants.SUBPATTERN:
+            yield from items(av[-1])
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                yield from items(branch)
+
+
+def nested_repeats(parsed):
+    """
+    Unbounded repeats inside unbounded repeats whose body has no required
+    literal the inner repeat cannot match, e.g. (a+)+ or (.*/?)*: there the
+    inner and outer repeats can split a string in exponentially many ways
+    """
+    problems = []
+    for op, av in items(parsed):
+        if op not in REPEATS or av[1] != sre_constants.MAXREPEAT:
+            continue
+        body = av[2]
+        while len(body) == 1 and body[0][0] == sre_constants.SUBPATTERN:
+            body = body[0][1][-1]
+        required = [(o, a) for o, a in body if o == sre_constants.LITERAL]
+        for inner_op, inner_av in items(body):
+            if inner_op not in REPEATS or inner_av[1] != sre_constants.MAXREPEAT or len(inner_av[2]) != 1:
+                continue
+            char_op, char_av = inner_av[2][0]
+            if not any(not matches_char(char_op, char_av, chr(a)) for o, a in required):
+                problems.append(body)
+                break
+    return problems
+
+
+def literal_prefix(parsed):
+    """The literal text every match starts with"""
+    prefix = []
+    for op, av in parsed:
+        if op != sre_constants.LITERAL:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+
+def literal_branches(av):
+    """The branches of an alternation as strings, or None if any is not a plain literal"""
+    branches = []
+    for branch in av[1]:
+        if any(op != sre_constants.LITERAL for op, _ in branch):
+            return None
+        branches.append(''.join(chr(a) for _, a in branch))
+    return branches
+
+
+def factor_branches(branches):
+    """Tighter forms of pairs of alternatives where one is the prefix or suffix of the other"""
+    suggestions = []
+    # The parser already moves a prefix common to all branches out of the alternation
+    for a in filter(None, branches):
+        for b in branches:
+            if a != b and b.endswith(a):
+                suggestions.append(f"({a}|{b}) as (?:{re.escape(b[:-len(a)])})?{re.escape(a)}")
+            elif a != b and b.startswith(a):
+                suggestions.append(f"({a}|{b}) as {re.escape(a)}(?:{re.escape(b[len(a):])})?")
+    return suggestions
+
+
+def lint_pattern(pattern, key):
+    """(severity, message) of everything questionable in a pattern configured for directory key"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        return [('error', f"does not compile: {e}")]
+    problems = []
+    for body in nested_repeats(parsed):
+        problems.append(('error', "nested unbounded repeats can backtrack catastrophically; make the inner "
+                                  "repeat exclude the character that ends each outer repetition, e.g. [^/]+/"))
+    any_star = sum(1 for op, av in items(parsed) if op in REPEATS and av[1] == sre_constants.MAXREPEAT
+                   and len(av[2]) == 1 and av[2][0][0] == sre_constants.ANY)
+    if any_star > 1:
+        problems.append(('warning', f"{any_star} unbounded .* each retry the rest of the path; "
+                                    f"use [^/]* for those within one path component"))
+    if key != '__top__' and not literal_prefix(parsed).startswith(key + '/'):
+        problems.append(('hint', f"start with the literal directory {re.escape(key)}/ so that other "
+                                 f"paths fail on the first characters"))
+    for op, av in items(parsed):
+        if op != sre_constants.BRANCH:
+            continue
+        if len(av[1]) > MAX_BRANCHES:
+            problems.append(('hint', f"{len(av[1])} alternatives are tried one after the other"))
+        branches = literal_branches(av)
+        for suggestion in factor_branches(branches) if branches else []:
+            problems.append(('hint', f"write {suggestion}"))
+    return problems
+
+
+def lint(config):
+    """Lint every pattern of a configuration; returns [(section, key, pattern, severity, message)]"""
+    results = []
+    for section, entries in config.items():
+        if section == '__config__':
+            continue
+        for key, patterns in entries.items():
+            if key == '__exclude__':
+                continue
+            for pattern in patterns:
+                for severity, message in lint_pattern(pattern, key):
+                    results.append((section, key, pattern, severity, message))
+    return results
+
+
+def sample_paths(csv_file, size, seed=1):
+    """A random sample of the names of a disk_files CSV, and the number of names in it"""
+    rng = random.Random(seed)
+    sample, n = [], 0
+    with open(csv_file, newline='') as t:
+        for row in csv.DictReader(t):
+            n += 1
+            if len(sample) < size:
+                sample.append(row['Name'])
+            else:
+                k = rng.randrange(n)
+                if k < size:
+                    sample[k] = row['Name']
+    return sample, n
+
+
+def profile_section(entries, paths, n_total):
+    """
+    Time every pattern of a section on paths as missing_from_hpss applies them
+    Returns one dict per pattern with its calls, matches, time and the cost
+    extrapolated to the n_total paths of the listing.
+    """
+    excluded = frozenset(entries.get('__exclude__', ()))
+    by_key = {}
+    for path in paths:
+        if path in excluded:
+            continue
+        key = path.split('/')[0] if '/' in path else '__top__'
+        by_key.setdefault(key, []).append(path)
+    scale = n_total / len(paths) if paths else 0
+    results = []
+    clock = time.perf_counter
+    for key, patterns in entries.items():
+        if key == '__exclude__' or not isinstance(patterns, dict):
+            continue
+        names = by_key.get(key, [])
+        for pattern, target in patterns.items():
+            regex = re.compile(pattern)
+            total, worst, worst_path, matches = 0.0, 0.0, None, 0
+            for name in names:
+                t0 = clock()
+                m = regex.match(name)
+                if m is not None and target not in ('EXCLUDE', 'AUTOMATED'):
+                    regex.sub(target, name)
+                dt = clock() - t0
+                total += dt
+                matches += m is not None
+                if dt > worst:
+                    worst, worst_path = dt, name
+            results.append({'key': key, 'pattern': pattern, 'calls': len(names), 'matches': matches,
+                            'seconds': total, 'us_per_call': 1e6 * total / len(names) if names else 0.0,
+                            'worst_us': 1e6 * worst, 'worst_path': worst_path,
+                            'estimated_seconds': total * scale})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lint and profile the regular expressions of a backup configuration.')
+    parser.add_argument('-c', '--cache-dir', dest='cache', metavar='DIR',
+                        default=os.path.join(os.environ.get('HOME', '.'), 'cache'),
+                        help='Read disk_files_SECTION.csv from DIR (Default: %(default)s).')
+    parser.add_argument('-l', '--lint-only', dest='lint_only', action='store_true',
+                        help='Only lint the patterns, without timing them.')
+    parser.add_argument('-n', '--sample', type=int, default=SAMPLE_SIZE, metavar='N',
+                        help='Time the patterns on N random paths per section (Default: %(default)s).')
+    parser.add_argument('-t', '--top', type=int, default=20, metavar='N',
+                        help='List the N most expensive patterns (Default: %(default)s).')
+    parser.add_argument('-j', '--json', metavar='FILE', help='Also write the full results to FILE.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Also print hints.')
+    parser.add_argument('config', metavar='FILE', help='Read configuration from FILE.')
+    parser.add_argument('sections', metavar='SECTION', nargs='*', help='Profile these sections (Default: all).')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S')
+    with open(options.config) as fp:
+        config = json.load(fp)
+
+    problems = lint(config)
+    log = {'error': logging.error, 'warning': logging.warning, 'hint': logging.debug}
+    for section, key, pattern, severity, message in problems:
+        log[severity]("%s/%s: %s: %s", section, key, pattern, message)
+    n_errors = sum(1 for p in problems if p[3] == 'error')
+    logging.info("%d errors, %d warnings, %d hints.", n_errors, sum(1 for p in problems if p[3] == 'warning'),
+                 sum(1 for p in problems if p[3] == 'hint'))
+    report = {'lint': [dict(zip(('section', 'key', 'pattern', 'severity', 'message'), p)) for p in problems],
+              'profile': []}
+
+    if not options.lint_only:
+        for section in options.sections or [s for s in config if s != '__config__']:
+            csv_file = os.path.join(options.cache, f'disk_files_{section}.csv')
+            if not os.path.exists(csv_file):
+                logging.warning("%s does not exist, skipping %s.", csv_file, section)
+                continue
+            paths, n_total = sample_paths(csv_file, options.sample)
+            for result in profile_section(config[section], paths, n_total):
+                result['section'] = section
+                report['profile'].append(result)
+        report['profile'].sort(key=lambda r: -r['estimated_seconds'])
+        print(f"{'est. s':>9} {'us/call':>8} {'worst us':>9} {'matches':>8}  pattern")
+        for r in report['profile'][:options.top]:
+            print(f"{r['estimated_seconds']:9.2f} {r['us_per_call']:8.2f} {r['worst_us']:9.1f} "
+                  f"{r['matches']:8d}  {r['section']}: {r['pattern']}")
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if n_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""
+Refresh the cached HPSS listing of one section incrementally.
+
+``missing_from_hpss --overwrite-hpss`` re-lists the whole HPSS tree of a
+section, two hsi calls per directory, although most of it has not changed
+in years.  This script keeps the modification time of every HPSS directory
+of the last listing in hpss_dirs_SECTION.json, next to hpss_files_SECTION.csv,
+and on each run
+
+1. lists every known directory with ``hsi ls -d``, many paths per call;
+2. re-lists only the directories whose modification time changed, and walks
+   the new subdirectories found there;
+3. drops the files of directories that disappeared;
+4. writes the updated CSV to a temporary file and renames it into place.
+
+missing_from_hpss can then run without --overwrite-hpss.  A directory's
+modification time changes when entries are added, removed or renamed in it,
+not when a file is rewritten in place, so a full listing is still made when
+the cached one is older than --full-after days.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+
+from hpsspy import HpssOSError
+from hpsspy.util import HpssFile, hsi
+from hpsspy.os._os import linere
+
+# Number of paths given to one hsi ls call
+BATCH = 200
+
+
+def hsi_ls(paths, options=''):
+    """
+    List many HPSS paths, BATCH paths per hsi call
+    Returns the HpssFile entries; with options 'd' there is one entry per
+    existing path, otherwise the entries of each directory, whose hpss_path
+    is the directory.  Paths that do not exist are logged and left out.
+    """
+    entries = []
+    for start in range(0, len(paths), BATCH):
+        batch = paths[start:start + BATCH]
+        out = hsi('ls', '-D' + options, *batch)
+        lspath = batch[0]  # a single directory is not always echoed back
+        found, errors = 0, []
+        for line in out.split('\n'):
+            if not line:
+                continue
+            m = linere.match(line)
+            if m is not None:
+                entries.append(HpssFile(lspath, *m.groups()))
+                found += 1
+            elif line.startswith('*'):
+                errors.append(line)
+            elif line.endswith(':'):
+                lspath = line.strip(': ')
+            else:
+                raise HpssOSError(f"Could not match line!\n{line}")
+        if errors and not found:
+            # Nothing listed at all: hsi itself failed, not just a few vanished paths
+            raise HpssOSError('\n'.join(errors))
+        for line in errors:
+            logging.warning(line)
+    return entries
+
+
+def relative(path, hpss_root):
+    """Path relative to hpss_root, '' for hpss_root itself"""
+    return '' if path == hpss_root else path[len(hpss_root) + 1:]
+
+
+def list_directories(dirs, hpss_root, files, dir_mtimes):
+    """
+    List dirs (relative to hpss_root) and walk every subdirectory not yet in
+    dir_mtimes, replacing their entries in files and dir_mtimes
+    Returns {listed directory: set of its subdirectories}.
+    """
+    subdirs = {}
+    while dirs:
+        listing = {f"{hpss_root}/{d}".rstrip('/'): [] for d in dirs}
+        for f in hsi_ls(list(listing)):
+            listing.setdefault(f.hpss_path.rstrip('/'), []).append(f)
+        dirs = []
+        for path, entries in listing.items():
+            rel = relative(path, hpss_root)
+            files[rel], subdirs[rel] = [], set()
+            for f in entries:
+                if f.isdir:
+                    # Like hpsspy.os.walk, links to directories are not followed
+                    if f.islink:
+                        continue
+                    child = f"{rel}/{f.name}" if rel else f.name
+                    subdirs[rel].add(child)
+                    if child not in dir_mtimes:
+                        dirs.append(child)
+                    dir_mtimes[child] = f.st_mtime
+                elif not f.name.endswith('.idx'):
+                    name = f"{rel}/{f.name}" if rel else f.name
+                    files[rel].append((name, f.st_size, f.st_mtime))
+            logging.debug("Listed HPSS directory %s.", path)
+    return subdirs
+
+
+def full_listing(hpss_root):
+    """List the whole tree below hpss_root; returns the files per directory and the directory mtimes"""
+    root = hsi_ls([hpss_root], 'd')
+    if not root:
+        raise HpssOSError(f"{hpss_root} does not exist.")
+    files, dir_mtimes = {}, {'': root[0].st_mtime}
+    list_directories([''], hpss_root, files, dir_mtimes)
+    return files, dir_mtimes
+
+
+def incremental_listing(hpss_root, files, dir_mtimes):
+    """Re-list the directories whose modification time changed since the cached listing"""
+    paths = {f"{hpss_root}/{d}".rstrip('/'): d for d in dir_mtimes}
+    current = {paths[f.path.rstrip('/')]: f.st_mtime for f in hsi_ls(list(paths), 'd')
+               if f.path.rstrip('/') in paths}
+    if '' not in current:
+        raise HpssOSError(f"{hpss_root} does not exist.")
+    changed = set()
+    for d, mtime in dir_mtimes.items():
+        if d not in current:
+            # Removing a directory changes the mtime of its parent, which lists it away
+            changed.add(os.path.dirname(d))
+        elif current[d] != mtime:
+            changed.add(d)
+    changed = sorted(d for d in changed if d in current)
+    logging.info("%d of %d HPSS directories changed.", len(changed), len(dir_mtimes))
+    dir_mtimes.update(current)
+    subdirs = list_directories(changed, hpss_root, files, dir_mtimes)
+    # Parents sort before their children, so removals cascade in one pass
+    removed = set()
+    for d in sorted(dir_mtimes):
+        parent = os.path.dirname(d)
+        if d and (parent in removed or (parent in subdirs and d not in subdirs[parent])):
+            removed.add(d)
+    for d in removed:
+        del dir_mtimes[d]
+        files.pop(d, None)
+    logging.info("%d HPSS directories removed.", len(removed))
+
+
+def read_cache(csv_file, dirs_file):
+    """Files per directory from the CSV cache, and the sidecar with the directory mtimes"""
+    with open(dirs_file) as fp:
+        sidecar = json.load(fp)
+    files = {}
+    with open(csv_file, newline='') as t:
+        for row in csv.DictReader(t):
+            files.setdefault(os.path.dirname(row['Name']), []).append((row['Name'], int(row['Size']),
+                                                                      int(row['Mtime'])))
+    return files, sidecar
+
+
+def write_cache(csv_file, dirs_file, files, dir_mtimes, updated):
+    """Write the CSV cache and its sidecar, each through a temporary file renamed into place"""
+    tmp = csv_file + '.tmp'
+    with open(tmp, 'w', newline='') as t:
+        w = csv.writer(t)
+        w.writerow(['Name', 'Size', 'Mtime'])
+        for d in sorted(files):
+            w.writerows(sorted(files[d]))
+    os.replace(tmp, csv_file)
+    tmp = dirs_file + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump({'updated': updated, 'dirs': dir_mtimes}, fp)
+    os.replace(tmp, dirs_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the cached HPSS listing of a section incrementally.')
+    parser.add_argument('-c', '--cache-dir', dest='cache', metavar='DIR',
+                        default=os.path.join(os.environ['HOME'], 'cache'),
+                        help='Read and write cache files in DIR (Default: %(default)s).')
+    parser.add_argument('-f', '--full-after', dest='full_after', type=float, metavar='DAYS', default=30.0,
+                        help='Make a full listing if the cached one is older than DAYS days (Default: %(default)s).')
+    parser.add_argument('-F', '--full', action='store_true', help='Always make a full listing.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information.')
+    parser.add_argument('config', metavar='FILE', help='Read configuration from FILE.')
+    parser.add_argument('release', metavar='SECTION', help='Refresh the listing of SECTION.')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S')
+
+    with open(options.config) as fp:
+        hpss_root = os.path.join(json.load(fp)['__config__']['hpss_root'], options.release)
+    csv_file = os.path.join(options.cache, f'hpss_files_{options.release}.csv')
+    dirs_file = os.path.join(options.cache, f'hpss_dirs_{options.release}.json')
+    start = int(time.time())
+    try:
+        files, sidecar = read_cache(csv_file, dirs_file)
+        dir_mtimes = sidecar['dirs']
+        full = options.full or start - sidecar['updated'] > options.full_after * 86400
+    except (OSError, ValueError, KeyError):
+        logging.info("No usable HPSS cache for %s.", options.release)
+        full = True
+    try:
+        if full:
+            logging.info("Listing all of %s.", hpss_root)
+            files, dir_mtimes = full_listing(hpss_root)
+            sidecar = {'updated': start}
+        else:
+            incremental_listing(hpss_root, files, dir_mtimes)
+    except HpssOSError as e:
+        logging.critical("HPSS listing failed, cache left unchanged: %s", e)
+        return 1
+    # The age of the cache is that of its last full listing
+    write_cache(csv_file, dirs_file, files, dir_mtimes, sidecar['updated'])
+    logging.info("Wrote %d files in %d directories to %s.", sum(len(f) for f in files.values()),
+                 len(dir_mtimes), csv_file)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
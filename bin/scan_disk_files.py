@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""
+Scan the disk trees of many sections at once and write every disk_files_SECTION.csv.
+
+Each ``missing_from_hpss`` job walks the physical disks of its own section
+with a serial os.walk, and a section directory that is a link into another
+physical disk gets walked once for each path that leads to it.  This script
+resolves the disk roots of all the sections given, walks each distinct
+directory tree once with a pool of threads, and streams the rows of every
+directory into the CSV files of all the sections that contain it.  The
+files hold the same rows as those written by ``missing_from_hpss``, so the
+section jobs reuse them instead of scanning again.
+
+Each CSV is written to a temporary file and renamed into place.  If a
+section could not be scanned completely, its old CSV is removed instead,
+so that its ``missing_from_hpss`` job falls back to scanning it itself.
+"""
+import os
+import sys
+import csv
+import json
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from hpsspy.scan import physical_disks
+
+
+def list_directory(path):
+    """
+    Subdirectories and (name, size, mtime) of the files of one directory
+    Like os.walk, unreadable directories are skipped and links are neither
+    followed nor listed; a file that cannot be stat'ed raises OSError.
+    """
+    subdirs, files = [], []
+    try:
+        it = os.scandir(path)
+    except OSError as e:
+        logging.warning("Skipping %s: %s", path, e)
+        return subdirs, files
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif not entry.is_symlink():
+                s = entry.stat(follow_symlinks=False)
+                files.append((entry.name, s.st_size, int(s.st_mtime)))
+    return subdirs, files
+
+
+def scan_sections(config, sections, cache, num_workers=16):
+    """
+    Walk the disk roots of sections and write their disk_files_SECTION.csv in cache
+    Returns the sections that could not be scanned completely.
+    """
+    # Walk every distinct tree once, writing to all the sections it belongs to
+    trees, n_roots = {}, 0
+    for section in sections:
+        for disk_root in physical_disks(os.path.join(config['root'], section), config):
+            if os.path.isdir(disk_root):
+                trees.setdefault(os.path.realpath(disk_root), set()).add(section)
+                n_roots += 1
+            else:
+                logging.debug("%s does not exist.", disk_root)
+    logging.info("Scanning %d disk trees for %d disk roots of %d sections.", len(trees), n_roots, len(sections))
+
+    outputs, writers = {}, {}
+    for section in sections:
+        outputs[section] = open(os.path.join(cache, f'disk_files_{section}.csv.tmp'), 'w', newline='')
+        writers[section] = csv.writer(outputs[section])
+        writers[section].writerow(['Name', 'Size', 'Mtime'])
+    failed = set()
+    n_dirs = 0
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = {executor.submit(list_directory, tree): (tree, '') for tree in trees}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tree, rel = pending.pop(future)
+                path = os.path.join(tree, rel) if rel else tree
+                try:
+                    subdirs, files = future.result()
+                except OSError as e:
+                    logging.error("Error scanning %s: %s", path, e)
+                    failed |= trees[tree]
+                    continue
+                n_dirs += 1
+                logging.debug("Scanned disk directory %s.", path)
+                rows = [(os.path.join(rel, name) if rel else name, size, mtime) for name, size, mtime in files]
+                for section in trees[tree]:
+                    writers[section].writerows(rows)
+                for name in subdirs:
+                    child = os.path.join(rel, name) if rel else name
+                    pending[executor.submit(list_directory, os.path.join(tree, child))] = (tree, child)
+    logging.info("Scanned %d directories.", n_dirs)
+
+    for section, output in outputs.items():
+        output.close()
+        csv_file = os.path.join(cache, f'disk_files_{section}.csv')
+        if section in failed:
+            logging.error("Removing %s; missing_from_hpss will scan %s itself.", csv_file, section)
+            os.remove(output.name)
+            if os.path.exists(csv_file):
+                os.remove(csv_file)
+        else:
+            os.replace(output.name, csv_file)
+    return sorted(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan the disk trees of many sections and write their disk cache files.')
+    parser.add_argument('-c', '--cache-dir', dest='cache', metavar='DIR',
+                        default=os.path.join(os.environ['HOME'], 'cache'),
+                        help='Write cache files to DIR (Default: %(default)s).')
+    parser.add_argument('-w', '--workers', type=int, default=16, metavar='N',
+                        help='Scan N directories at once (Default: %(default)s).')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information.')
+    parser.add_argument('config', metavar='FILE', help='Read configuration from FILE.')
+    parser.add_argument('sections', metavar='SECTION', nargs='+', help='Scan these sections.')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S')
+    with open(options.config) as fp:
+        config = json.load(fp)['__config__']
+    failed = scan_sections(config, options.sections, options.cache, options.workers)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
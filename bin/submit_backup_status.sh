@@ -33,8 +33,53 @@ job_id_map=''
 verbose=''
 ${verbMode} && verbose='-v'
 ${testMode} && job_id=0
+sections='cmx cosmosim datachallenge engineering metadata mocks protodesi public science spectro survey sv target'
 cd ${job_dir}
-for section in cmx cosmosim datachallenge engineering metadata mocks protodesi public science spectro survey sv target; do
+#
+# Submit disk scan job.  It writes the disk cache files of all sections in one
+# pass, and the section jobs wait for it and reuse those files.
+#
+job_name=scan_disk_files
+job=$(cat <<BATCHJOB
+#!/bin/bash
+#SBATCH --account=desi
+#SBATCH --qos=workflow
+#SBATCH --constraint=cron
+#SBATCH --licenses=SCRATCH,cfs
+#SBATCH --nodes=1
+#SBATCH --mem=5GB
+#SBATCH --time=1-00:00:00
+#SBATCH --time-min=12:00:00
+#SBATCH --job-name=${job_name}
+#SBATCH --output=${job_dir}/%x-%j.log
+#SBATCH --open-mode=append
+#SBATCH --mail-type=fail
+#SBATCH --mail-user=bweaver@nersc.gov
+source /global/common/software/desi/desi_environment.sh ${software}
+module load desiBackup/main
+cache=\${DESI_ROOT}/metadata/backups
+scan_disk_files.py ${verbose} --cache-dir=\${cache} \${DESIBACKUP}/etc/desi.json ${sections}
+cp -a ${job_dir}/${job_name}-\${SLURM_JOB_ID}.log \${cache}
+BATCHJOB
+)
+${verbMode} && echo "${job}"
+${verbMode} && echo rm -f ${job_name}.sh
+${testMode} || rm -f ${job_name}.sh
+${verbMode} && echo "\${job} > ${job_name}.sh"
+${testMode} || echo "${job}" > ${job_name}.sh
+${verbMode} && echo chmod +x ${job_name}.sh
+${testMode} || chmod +x ${job_name}.sh
+${verbMode} && echo "scan_id=\$(sbatch --parsable ${job_name}.sh)"
+if ${testMode}; then
+    scan_id=${job_id}
+else
+    scan_id=$(sbatch --parsable ${job_name}.sh)
+fi
+#
+# Submit section jobs.  They run even if the scan failed; a section whose
+# disk cache file is missing is scanned by its own job.
+#
+for section in ${sections}; do
     job_name=missing_from_hpss_${section}
     job=$(cat <<BATCHJOB
 #!/bin/bash
@@ -54,7 +99,12 @@ for section in cmx cosmosim datachallenge engineering metadata mocks protodesi p
 source /global/common/software/desi/desi_environment.sh ${software}
 module load desiBackup/main
 cache=\${DESI_ROOT}/metadata/backups
-missing_from_hpss ${verbose} --cache-dir=\${cache} --overwrite-hpss \${DESIBACKUP}/etc/desi.json ${section}
+#
+# Refresh the HPSS listing incrementally; make a full listing if that fails.
+#
+overwrite=''
+refresh_hpss_cache.py ${verbose} --cache-dir=\${cache} \${DESIBACKUP}/etc/desi.json ${section} || overwrite='--overwrite-hpss'
+missing_from_hpss ${verbose} --cache-dir=\${cache} \${overwrite} \${DESIBACKUP}/etc/desi.json ${section}
 cp -a ${job_dir}/${job_name}-\${SLURM_JOB_ID}.log \${cache}
 BATCHJOB
 )
@@ -65,11 +115,11 @@ BATCHJOB
     ${testMode} || echo "${job}" > ${job_name}.sh
     ${verbMode} && echo chmod +x ${job_name}.sh
     ${testMode} || chmod +x ${job_name}.sh
-    ${verbMode} && echo "job_id=\$(sbatch --parsable ${job_name}.sh)"
+    ${verbMode} && echo "job_id=\$(sbatch --parsable --dependency=afterany:${scan_id} ${job_name}.sh)"
     if ${testMode}; then
         job_id=$(( job_id + 10 ))
     else
-        job_id=$(sbatch --parsable ${job_name}.sh)
+        job_id=$(sbatch --parsable --dependency=afterany:${scan_id} ${job_name}.sh)
     fi
     if [[ -z "${dependency}" ]]; then
         dependency="--dependency=afterok:${job_id}"
@@ -100,6 +150,8 @@ job=$(cat <<BATCHJOB
 source /global/common/software/desi/desi_environment.sh ${software}
 module load desiBackup/main
 cache=\${DESI_ROOT}/metadata/backups
+backup_delta.py ${verbose} --cache-dir=\${cache} ${sections}
+summarize_backups.py ${verbose} --cache-dir=\${cache} ${sections}
 backupStatus.sh ${verbose} -c \${cache} ${job_id_map}
 BATCHJOB
 )
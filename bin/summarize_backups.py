@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""
+Summarize the backup status cache files of each section for the status page.
+
+For every section this writes summary_SECTION.json, with the number and
+size of the files on disk and on HPSS, the potential backups and the
+directories with the most data waiting for a backup, the changes since the
+previous run from delta_SECTION.json, and ready-made HTML for the status
+table.  It also writes gzip-compressed copies of disk_files_SECTION.csv,
+hpss_files_SECTION.csv and missing_files_SECTION.json, which the status
+page links to instead of the raw files.
+"""
+import os
+import sys
+import gzip
+import html
+import json
+import shutil
+import logging
+import argparse
+
+import numpy as np
+
+from backup_delta import Listing
+
+# Number of directories listed with the most data waiting for a backup
+TOP_DIRECTORIES = 10
+
+
+def human_size(nbytes):
+    """Size in bytes as a short string with a binary prefix"""
+    size = float(nbytes)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(size) < 1024 or unit == 'TiB':
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+
+
+def compress(path):
+    """Write path.gz unless it is already newer than path; returns the name of the copy"""
+    target = path + '.gz'
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+        tmp = target + '.tmp'
+        with open(path, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 22)
+        os.replace(tmp, target)
+        logging.debug("Compressed %s to %s.", path, human_size(os.path.getsize(target)))
+    return os.path.basename(target)
+
+
+def button(href, label):
+    """Link styled like the other buttons of the status table"""
+    return (f'<a class="btn btn-sm btn-outline-primary" role="button" href="{href}" '
+            f'title="{href}">{label}</a>')
+
+
+def top_directories(missing, disk):
+    """Directories with the most bytes waiting for a backup, as (directory, files, bytes)"""
+    names = [name.encode('utf-8', 'surrogateescape') for backup in missing.values() for name in backup['files']]
+    if not names:
+        return []
+    waiting = Listing.from_names(names, np.zeros(len(names)), np.zeros(len(names)))
+    sizes = np.zeros(len(waiting), dtype=np.int64)
+    if disk is not None:
+        on_disk = disk.find(waiting)
+        sizes[on_disk >= 0] = disk.size[on_disk[on_disk >= 0]]
+    totals = {}
+    for i in range(len(waiting)):
+        d = os.path.dirname(waiting.name(i)) or '.'
+        n, b = totals.get(d, (0, 0))
+        totals[d] = (n + 1, b + int(sizes[i]))
+    top = sorted(totals.items(), key=lambda item: (-item[1][1], item[0]))[:TOP_DIRECTORIES]
+    return [[d, n, b] for d, (n, b) in top]
+
+
+def summarize_section(cache, section):
+    """Write summary_SECTION.json and the compressed copies of the cache files of section"""
+    summary = {'section': section, 'html': {}}
+    disk = None
+    for kind in ('disk', 'hpss'):
+        path = os.path.join(cache, f'{kind}_files_{section}.csv')
+        if os.path.exists(path):
+            listing = Listing.from_csv(path)
+            if kind == 'disk':
+                disk = listing
+            summary[f'n_{kind}'], summary[f'{kind}_bytes'] = len(listing), int(listing.size.sum())
+            summary['html'][kind] = (f"{summary[f'n_{kind}']:,d} files, {human_size(summary[f'{kind}_bytes'])} "
+                                     f"{button(compress(path), 'CSV')}")
+    path = os.path.join(cache, f'missing_files_{section}.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            missing = json.load(f)
+        summary['n_backups'] = len(missing)
+        summary['n_newer'] = sum(backup['newer'] for backup in missing.values())
+        summary['n_missing'] = sum(len(backup['files']) for backup in missing.values())
+        summary['missing_bytes'] = sum(backup['size'] for backup in missing.values())
+        summary['top_directories'] = top_directories(missing, disk)
+        text = (f"{summary['n_backups']:,d} backups, {summary['n_missing']:,d} files, "
+                f"{human_size(summary['missing_bytes'])} {button(compress(path), 'JSON')}")
+        if summary['top_directories']:
+            items = ''.join(f"<li><code>{html.escape(d)}/</code> {n:,d} files, {human_size(b)}</li>"
+                            for d, n, b in summary['top_directories'])
+            text += f"<details><summary>Top directories</summary><ul>{items}</ul></details>"
+        summary['html']['missing'] = text
+    path = os.path.join(cache, f'delta_{section}.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            delta = json.load(f)
+        summary['changes'] = {f'{kind}_{change}': delta[kind][change]['n']
+                              for kind in ('disk', 'hpss') if kind in delta for change in delta[kind]}
+        if 'backed_up' in delta:
+            summary['changes']['backed_up'] = delta['backed_up']['n']
+        changes = summary['changes']
+        text = (f"+{changes['disk_added']:,d} &minus;{changes['disk_removed']:,d} on disk, "
+                f"{changes.get('backed_up', 0):,d} backed up" if 'disk_added' in changes else 'First run')
+        summary['html']['changes'] = f"{text} {button(os.path.basename(path), 'JSON')}"
+
+    tmp = os.path.join(cache, f'summary_{section}.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, os.path.join(cache, f'summary_{section}.json'))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the backup status cache files of each section.')
+    parser.add_argument('-c', '--cache-dir', dest='cache', metavar='DIR',
+                        default=os.path.join(os.environ['HOME'], 'cache'),
+                        help='Read and write cache files in DIR (Default: %(default)s).')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information.')
+    parser.add_argument('sections', metavar='SECTION', nargs='+', help='Summarize these sections.')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S')
+    for section in options.sections:
+        summary = summarize_section(options.cache, section)
+        logging.info("%s: %s files on disk, %s on HPSS, %s potential backups.", section,
+                     summary.get('n_disk', 0), summary.get('n_hpss', 0), summary.get('n_backups', 0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 """Previous imports remain the same, adding new ones"""
 import os
+import sys
 import subprocess
 import argparse
 import datetime
+import io
 import json
+import queue
+import threading
 from pathlib import Path
 import logging
 from typing import Dict, List, Tuple, Optional
@@ -12,7 +16,29 @@ from concurrent.futures import ThreadPoolExecutor
 import re
 import glob
 import math
+import heapq
+import hashlib
+import gzip
+import shutil
+import zlib
+import statistics
+import numpy as np
 import String_shorter as sshort
+from file_table import FileTable, save_chunks, load_chunks, scan_directories
+import index_journal
+import verify_archive
+import job_array
+import shard_scan
+from phase_profile import PhaseProfiler
+from membership import Membership
+
+# Bytes hashed at each end of a file when screening duplicate candidates
+PARTIAL_HASH_BYTES = 64 * 1024
+HASH_BLOCK_BYTES = 4 * 1024 * 1024
+# Compressibility is estimated from a few blocks of a few files of each directory
+SAMPLE_FILES_PER_DIR = 8
+SAMPLE_BLOCKS_PER_FILE = 4
+SAMPLE_BLOCK_BYTES = 64 * 1024
 
 class HSIException(Exception):
     """Custom exception for HSI-related errors"""
@@ -166,13 +192,50 @@ class TapeOperations:
             return None
 
 class DataArchiver:
-    def __init__(self, root_dir: str, archive_root: str, chunk_size: int = 20480, create_archive: bool = False):
+    def __init__(self, root_dir: str, archive_root: str, chunk_size: int = 20480, create_archive: bool = False,
+                 resume: bool = False, htar_streams: int = 1, sub_archive_size: Optional[int] = None,
+                 max_bandwidth: Optional[float] = None, stream_bandwidth: Optional[float] = None,
+                 wall_time: float = 24, safety_margin: float = 0.75, max_members: int = 1000000,
+                 bundle_small_files: bool = False, small_file_size: float = 1, bundle_min_files: int = 1000,
+                 wiki_docs: bool = False, deduplicate: bool = False, dedup_min_size: float = 1,
+                 compress: bool = False, compress_min_ratio: float = 1.5,
+                 profile: bool = False, profile_phase: Optional[str] = None,
+                 stream: bool = False, queue_size: int = 1024,
+                 job_array: bool = False, max_running: int = 8,
+                 scan_tasks: int = 0, shard_depth: int = 2, scan_launcher: str = 'local'):
         """
         Initialize the archiver
         root_dir: Source directory containing data to archive
         archive_root: Target directory on tape system
         chunk_size: Maximum size in GB for each archive chunk (default 20480 GB = 20 TB)
         create_archive: If True, submit archive jobs; if False, dry run only
+        resume: If True, continue from the checkpointed plan of a previous run
+        htar_streams: Number of sub-archives each chunk job writes concurrently
+        sub_archive_size: Target size in GB of each sub-archive (default chunk_size / htar_streams)
+        max_bandwidth: Aggregate bandwidth cap of a chunk job in MB/s (default no cap)
+        stream_bandwidth: Sustained rate of a single htar stream in MB/s (default: measured by
+                          earlier chunk jobs, else 400)
+        wall_time: Wall-time limit of a chunk job in hours (default 24)
+        safety_margin: Fraction of the wall time a chunk is planned to fill (default 0.75)
+        max_members: Maximum number of members in one htar archive (default 1000000)
+        bundle_small_files: If True, pack directories full of small files into tar bundles before htar
+        small_file_size: Files below this size in MB count as small (default 1)
+        bundle_min_files: Minimum number of small files for a directory to be bundled (default 1000)
+        wiki_docs: If True, also write the documentation in Trac wiki format
+        deduplicate: If True, archive files with identical content once and index the copies as references
+        dedup_min_size: Files below this size in MB are not checked for duplicates (default 1)
+        compress: If True, stage gzip-compressed copies of the files of compressible directories
+        compress_min_ratio: Minimum estimated compression ratio of a directory to compress it (default 1.5)
+        profile: If True, record the cost of each phase of run in docs/profile_<timestamp>.json
+        profile_phase: Name of a phase to run under cProfile when profiling
+        stream: If True, chunk and submit while the scan is still running (see run_streaming)
+        queue_size: Maximum number of scanned directories waiting to be chunked when streaming (default 1024)
+        job_array: If True, submit all chunk jobs as one Slurm job array
+        max_running: Maximum number of chunk jobs of the array running at once (default 8)
+        scan_tasks: If set, scan in this many tasks, each walking its share of the top directories
+        shard_depth: Depth of the directories dealt out to the scan tasks (default 2)
+        scan_launcher: 'srun' runs the scan tasks across the nodes of the Slurm allocation,
+                       'local' as a local process pool (default)
         """
         self.root_dir_str = root_dir
         self.root_dir = Path(self.root_dir_str)
@@ -184,7 +247,28 @@ class DataArchiver:
         self.max_htar_size = 67 * 1024 * 1024 * 1024  # 68 GB in bytes
         self.max_htar_prefix = 154 #maximum size of prefix in htar
         self.max_htar_fname = 99  # maximum size of filename in htar
+        # Large member counts make htar index files huge and slow down htar -tvf
+        self.max_members = max_members
+        self.bundle_small = bundle_small_files
+        self.small_file_bytes = int(small_file_size * 1024 * 1024)
+        self.bundle_min_files = bundle_min_files
+        self.wiki_docs = wiki_docs
+        self.deduplicate = deduplicate
+        self.dedup_min_bytes = max(1, int(dedup_min_size * 1024 * 1024))
+        self.compress = compress
+        self.compress_min_ratio = compress_min_ratio
+        # Estimated compression ratio of each directory ID, set while chunking
+        self.dir_ratios = {}
         self.create_archive = create_archive
+        self.resume = resume
+        self.profiler = PhaseProfiler(profile, profile_phase)
+        self.stream = stream
+        self.queue_size = queue_size
+        self.job_array = job_array
+        self.max_running = max_running
+        self.scan_tasks = scan_tasks
+        self.shard_depth = shard_depth
+        self.scan_launcher = scan_launcher
         self.manifest = {}
         self.setup_logging()
 
@@ -196,6 +280,69 @@ class DataArchiver:
         #any file split its information will be stored here
         self.split_file=f'{self.doc_dir}/split_file.json'
         self.large_path_file=f'{self.doc_dir}/large_path_file.json'
+        self.bundle_file=f'{self.doc_dir}/bundle_file.json'
+        self.duplicate_file=f'{self.doc_dir}/duplicate_file.json'
+        self.compressed_file=f'{self.doc_dir}/compressed_file.json'
+        # Compressed copies are staged here, outside the scan
+        self.compressed_dir = self.root_dir / "compressed_files"
+        # Names of shortened paths, kept so that reruns give every file the same name
+        self.short_name_registry=f'{self.doc_dir}/short_names.json'
+        # The registry, read at the first shortened path of a run and written with the plan records
+        self.short_names: Optional[sshort.NameRegistry] = None
+        # Checkpointed plan, so that an interrupted run can be resumed
+        self.plan_file = self.doc_dir / "archive_plan.json"
+        self.scan_file = self.doc_dir / "archive_scan.json"
+        self.table_file = self.doc_dir / "archive_table.npz"
+        self.chunks_file = self.doc_dir / "archive_chunks.npz"
+        self.plan = {}
+        # Columnar table of the scanned files; chunks are arrays of row IDs into it
+        self.file_table = None
+        # Records of shortened and split files, keyed by original path
+        self.large_path_records = index_journal.load_json_records(self.large_path_file, 'path')
+        self.split_records = index_journal.load_json_records(self.split_file, 'original_file')
+        self.bundle_records = index_journal.load_json_records(self.bundle_file, 'bundle')
+        self.duplicate_records = index_journal.load_json_records(self.duplicate_file, 'path')
+        self.compressed_records = index_journal.load_json_records(self.compressed_file, 'path')
+        self.timestamp = datetime.datetime.now().strftime("%Y%m%d")
+
+        # Each chunk is written as several sub-archives by concurrent htar streams
+        self.htar_streams = max(1, htar_streams)
+        # Sustained rate of one htar stream: configured, else measured by earlier chunk jobs
+        self.throughput_log = self.doc_dir / "throughput_log.txt"
+        if stream_bandwidth is None:
+            stream_bandwidth = self.measured_stream_bandwidth() or 400
+        self.stream_bandwidth = stream_bandwidth
+        # htar cannot be throttled, so the bandwidth cap limits how many streams run at once
+        self.htar_concurrency = self.htar_streams
+        if max_bandwidth is not None:
+            self.htar_concurrency = max(1, min(self.htar_streams, int(max_bandwidth // stream_bandwidth)))
+
+        # Size chunks so that a job moves its data well within the wall-time limit
+        self.wall_time_s = wall_time * 3600
+        if not 0 < safety_margin <= 1:
+            raise ValueError(f"safety_margin must be in (0, 1], not {safety_margin}")
+        self.safety_margin = safety_margin
+        self.requested_chunk_bytes = self.chunk_size_bytes
+        job_rate = self.stream_bandwidth * 1024 * 1024 * self.htar_concurrency
+        max_chunk_bytes = int(job_rate * self.wall_time_s * self.safety_margin)
+        if max_chunk_bytes < self.chunk_size_bytes:
+            logging.info(f"At {job_rate / 1024**2:.0f} MB/s a {wall_time:g} h job moves at most "
+                         f"{max_chunk_bytes / 1024**3:.0f} GB with a {self.safety_margin:.0%} margin; "
+                         f"reducing chunk size from {self.chunk_size_bytes / 1024**3:.0f} GB")
+            self.chunk_size_bytes = max_chunk_bytes
+        if sub_archive_size is not None:
+            self.sub_archive_bytes = sub_archive_size * 1024 * 1024 * 1024
+        elif self.htar_streams > 1:
+            self.sub_archive_bytes = math.ceil(self.chunk_size_bytes / self.htar_streams)
+        else:
+            self.sub_archive_bytes = None
+        # Chunks written as sub-archives may hold max_members in each of them
+        self.max_chunk_members = self.max_members * (self.htar_streams if self.sub_archive_bytes else 1)
+        self.chunk_parts = {}
+        # Chunk jobs record the members they verified here; compaction folds them into the index
+        self.index_journal = self.doc_dir / index_journal.JOURNAL_NAME
+        self.journal_cmd = f"{sys.executable} {Path(__file__).resolve().parent / 'index_journal.py'}"
+
         # Initialize tape operations
         self.tape_ops = TapeOperations()
         
@@ -258,57 +405,33 @@ class DataArchiver:
             logging.error(f"Error listing directory {directory}: {e}")
             return []
 
-    def parallel_scan_large_directory(self, num_workers: int = 8) -> Dict[str, int]:
-        """Scan directory structure in parallel"""
-        # Get complete directory tree first
-        dir_sizes = self.get_directory_tree()
-        logging.info(f"Found {len(dir_sizes)} directories")
-
-        # Sort directories by size
-        sorted_dirs = sorted(dir_sizes.items(), key=lambda x: x[1], reverse=True)
-
-        # For very large directories, process them in parallel
-        # Consider directories larger than 1% of chunk size as "large"
-        if(False):
-            size_threshold = self.chunk_size_bytes * 0.01
-            large_dirs = [(path, size) for path, size in sorted_dirs
-                     if size > size_threshold]
+    def scan_excludes(self) -> List[str]:
+        """
+        Directories below root_dir that the scan skips: the docs directory is
+        uploaded on its own (index_journal.sync), and compressed copies,
+        shortened copies, split pieces and bundles are written by the archiver
+        itself, while a streaming scan runs or by earlier runs
+        """
+        return [str(self.doc_dir), str(self.compressed_dir)] + [
+            str(self.root_dir / d) for d in ('small_file_bundles', 'large_path_files', 'split_files')]
 
-            small_dirs = [(path, size) for path, size in sorted_dirs
-                     if size <= size_threshold]
+    def parallel_scan_large_directory(self, num_workers: int = 8) -> FileTable:
+        """
+        Scan directory structure in parallel
+        Every directory is listed once, by num_workers threads, into a
+        columnar FileTable instead of a dict of absolute paths
+        """
+        exclude = self.scan_excludes()
+        if self.scan_tasks:
+            # Partial tables go to the docs directory, which every node sees and the scan skips
+            file_table = shard_scan.sharded_scan(self.root_dir_str, self.doc_dir / "scan_shards", self.scan_tasks,
+                                                 self.shard_depth, exclude, num_workers, self.scan_launcher)
         else:
-            large_dirs=[]
-            small_dirs=sorted_dirs
-
-        logging.info(f"Processing {len(large_dirs)} large directories in parallel")
-        logging.info(f"Will process {len(small_dirs)} smaller directories sequentially")
-
-        file_sizes = {}
-
-        # Process large directories in parallel
-        with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            future_to_dir = {
-                executor.submit(self.get_files_in_directory, dir_path, size_threshold): dir_path
-                for dir_path, _ in large_dirs
-            }
-
-            for future in future_to_dir:
-                dir_path = future_to_dir[future]
-                try:
-                    for file_path, size in future.result():
-                        file_sizes[file_path] = size
-                except Exception as e:
-                    logging.error(f"Error processing directory {dir_path}: {e}")
-
-        # Process smaller directories sequentially
-        for dir_path, _ in small_dirs:
-            try:
-                for file_path, size in self.get_files_in_directory(dir_path):
-                    file_sizes[file_path] = size
-            except Exception as e:
-                logging.error(f"Error processing directory {dir_path}: {e}")
-
-        return file_sizes
+            file_table = FileTable.scan(self.root_dir_str, num_workers, exclude=exclude)
+        logging.info(f"Found {len(file_table)} files in {len(file_table.dir_names)} directories "
+                     f"({file_table.nbytes() / 1024**2:.0f} MB file table)")
+        self.file_table = file_table
+        return file_table
 
     def setup_logging(self):
         logging.basicConfig(
@@ -342,13 +465,101 @@ class DataArchiver:
             logging.error(f"Error running du command: {e}")
             raise
 
-    def Shorten_path(self,file_path:str,large_path_dir='large_path_files'):
+    @staticmethod
+    def append_json_record(file_path: str, records: Dict[str, Dict], key: str, record: Dict):
+        """Append a record to a records file, unless the same record is already there"""
+        if records.get(record[key]) == record:
+            return
+        records[record[key]] = record
+        with open(file_path, 'a') as f:
+            json.dump(record, f, indent=2)
+
+    @staticmethod
+    def write_json_records(file_path: str, records: Dict[str, Dict]):
+        """Rewrite a records file without duplicates, in the format search_archive.py reads"""
+        tmp = f"{file_path}.tmp"
+        with open(tmp, 'w') as f:
+            for record in records.values():
+                json.dump(record, f, indent=2)
+        os.replace(tmp, file_path)
+
+    @staticmethod
+    def write_json_atomic(path, obj, indent: Optional[int] = None):
+        """Write JSON to a temporary file and rename it, so a crash never leaves a partial file"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(obj, f, indent=indent)
+        os.replace(tmp, path)
+
+    def load_checkpoint(self) -> bool:
+        """
+        Load the checkpointed plan of a previous run
+        Returns True if a plan made with the same settings was found
+        """
+        if not self.plan_file.exists():
+            logging.info(f"No checkpoint found at {self.plan_file}, starting from scratch")
+            return False
+        with open(self.plan_file, 'r') as f:
+            plan = json.load(f)
+        if plan.get('settings') != self.checkpoint_settings():
+            logging.warning(f"Checkpoint {self.plan_file} was made with different settings, starting from scratch")
+            return False
+        self.plan = plan
+        # Keep archive names identical to the interrupted run
+        self.timestamp = plan['timestamp']
+        return True
+
+    def start_checkpoint(self):
+        """Start a new plan, discarding the checkpoint of any previous run"""
+        for path in (self.scan_file, self.table_file, self.chunks_file):
+            if path.exists():
+                path.unlink()
+        self.plan = {
+            'settings': self.checkpoint_settings(),
+            'timestamp': self.timestamp,
+            'stages': [],
+            'scripts': [],
+            'jobs': {},
+        }
+        self.save_checkpoint()
+
+    def checkpoint_settings(self) -> Dict:
+        """Settings that must not change between a run and its resumption"""
+        return {
+            # Scans are checkpointed as a FileTable (archive_table.npz) since version 2
+            'plan_version': 2,
+            'root_dir': self.root_dir_str,
+            'archive_root': self.archive_root_str,
+            'chunk_size_bytes': self.requested_chunk_bytes,
+            'htar_streams': self.htar_streams,
+            'sub_archive_bytes': self.sub_archive_bytes,
+            'max_members': self.max_members,
+            'bundle_small_files': self.bundle_small,
+            'small_file_bytes': self.small_file_bytes,
+            'bundle_min_files': self.bundle_min_files,
+            'deduplicate': self.deduplicate,
+            'dedup_min_bytes': self.dedup_min_bytes,
+            'compress': self.compress,
+            'compress_min_ratio': self.compress_min_ratio,
+        }
+
+    def save_checkpoint(self, stage: Optional[str] = None):
+        """Write the plan, marking stage as complete"""
+        if stage is not None and stage not in self.plan['stages']:
+            self.plan['stages'].append(stage)
+        self.write_json_atomic(self.plan_file, self.plan, indent=2)
+
+    def stage_done(self, stage: str) -> bool:
+        return stage in self.plan.get('stages', [])
+
+    def Shorten_path(self,file_path:str,large_path_dir='large_path_files',short_fname:Optional[str]=None):
         '''Takes the full path and split it in 
         root_dir + rest_dir + file_name
         create a directory called large_path_files
         It creates a new path as 
         root_dir/large_path_files/file_name.code(res_dir)
         copy the file to new location and returns the path
+        short_fname: name given by String_shorter.shorten_many, computed here if not given
         '''
          
         rel_path=file_path[len(self.root_dir_str):]
@@ -366,7 +577,8 @@ class DataArchiver:
             #large_dir = f"{self.root_dir}/{large_path_dir}/" 
             large_dir = self.root_dir / large_path_dir
             large_dir.mkdir(exist_ok=True)
-            short_fname=sshort.string_to_short_code(rel_path, max_length=64,preserve_extension=True)
+            if short_fname is None:
+                short_fname=sshort.string_to_short_code(rel_path, max_length=64,preserve_extension=True)
             new_path=f"{short_prefix}{short_fname}"
 
             need_short=True
@@ -374,8 +586,11 @@ class DataArchiver:
             new_path=None
 
 
-        #copy file to new location
-        if(need_short):
+        #copy file to new location, unless a resumed run already did it
+        if(need_short and self.resume and self.large_path_records.get(file_path, {}).get('short_path') == new_path
+           and os.path.isfile(new_path) and os.path.getsize(new_path) == os.path.getsize(file_path)):
+            logging.debug(f"Already copied: {file_path} -> {new_path}")
+        elif(need_short):
             cmd='cp %s %s'%(file_path,new_path)
             result = subprocess.run(cmd, shell=True, check=True,
                                  capture_output=True, text=True)
@@ -395,6 +610,14 @@ class DataArchiver:
         if file_size <= self.max_htar_size:
             return [file_path]
 
+        # A resumed run reuses the chunks of a complete earlier split
+        record = self.split_records.get(str(file_path))
+        if (self.resume and record and record['original_size'] == file_size
+                and all(os.path.isfile(f) for f in record['split_files'])
+                and sum(os.path.getsize(f) for f in record['split_files']) == file_size):
+            logging.info(f"Reusing {len(record['split_files'])} existing chunks of {file_path}")
+            return record['split_files']
+
         # Calculate number of chunks needed
         num_chunks = math.ceil(file_size / self.max_htar_size)
         chunk_size = math.ceil(file_size / num_chunks)
@@ -416,14 +639,13 @@ class DataArchiver:
             
             # Create manifest for reconstruction
             #manifest_path = split_dir / f"{base_name}.manifest"
-            with open(self.split_file, 'a') as f:
-                json.dump({
-                    'original_file': str(file_path),
-                    'original_size': file_size,
-                    'chunk_size': chunk_size,
-                    'num_chunks': num_chunks,
-                    'split_files': split_files
-                }, f, indent=2)
+            self.append_json_record(self.split_file, self.split_records, 'original_file', {
+                'original_file': str(file_path),
+                'original_size': file_size,
+                'chunk_size': chunk_size,
+                'num_chunks': num_chunks,
+                'split_files': split_files
+            })
             
             logging.info(f"Split {file_path} into {len(split_files)} chunks")
             return split_files
@@ -432,74 +654,384 @@ class DataArchiver:
             logging.error(f"Error splitting file {file_path}: {e}")
             return [file_path]
 
-    def group_files_into_chunks(self, file_sizes: Dict[str, int]) -> List[List[str]]:
-        """Group files into chunks respecting max chunk size, splitting large files if needed"""
+    @staticmethod
+    def file_digest(path: str, size: int, partial: bool = False) -> Optional[str]:
+        """
+        BLAKE2b digest of a file, or only of its first and last PARTIAL_HASH_BYTES if partial
+        Files of up to 2 * PARTIAL_HASH_BYTES are always hashed whole.
+        Returns None if the file can't be read.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        try:
+            with open(path, 'rb') as f:
+                if partial and size > 2 * PARTIAL_HASH_BYTES:
+                    h.update(f.read(PARTIAL_HASH_BYTES))
+                    f.seek(size - PARTIAL_HASH_BYTES)
+                    h.update(f.read(PARTIAL_HASH_BYTES))
+                else:
+                    for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+                        h.update(block)
+        except OSError as e:
+            logging.warning(f"Couldn't read {path} to check for duplicates: {e}")
+            return None
+        return h.hexdigest()
+
+    def deduplicate_files(self, ids: np.ndarray, num_workers: int = 8) -> np.ndarray:
+        """
+        Drop files whose content is already archived under another path
+        Candidates are narrowed down in three passes, each only over the files
+        that still share a key with another file: equal size (from the file
+        table, no I/O), equal partial hash, equal full hash.  Of each group of
+        identical files the first path in sort order is archived; the others
+        are recorded in duplicate_file.json and indexed as references to it.
+        Files smaller than dedup_min_bytes, files that will be bundled and files
+        that must be split are left alone.
+        Returns the updated array of file table IDs
+        """
+        table = self.file_table
+        sizes = table.size[ids]
+        min_size = max(self.dedup_min_bytes, self.small_file_bytes if self.bundle_small else 0)
+        candidates = ids[(sizes >= min_size) & (sizes <= self.max_htar_size)]
+        shared, counts = np.unique(table.size[candidates], return_counts=True)
+        candidates = candidates[np.isin(table.size[candidates], shared[counts > 1])]
+        if len(candidates) == 0:
+            return ids
+
+        def group_by_digest(group_ids: List[int], partial: bool) -> Dict[Tuple[int, str], List[int]]:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                digests = executor.map(lambda i: self.file_digest(table.path(i), int(table.size[i]), partial),
+                                       group_ids)
+                groups = {}
+                for file_id, digest in zip(group_ids, digests):
+                    if digest is not None:
+                        groups.setdefault((int(table.size[file_id]), digest), []).append(file_id)
+            return {key: group for key, group in groups.items() if len(group) > 1}
+
+        logging.info(f"Checking {len(candidates)} files of {len(shared[counts > 1])} shared sizes for duplicates")
+        partial_groups = group_by_digest(candidates.tolist(), partial=True)
+        # Small files were hashed whole already; only the larger ones need a full pass
+        identical = {key: group for key, group in partial_groups.items() if key[0] <= 2 * PARTIAL_HASH_BYTES}
+        identical.update(group_by_digest([i for (size, _), group in partial_groups.items()
+                                          if size > 2 * PARTIAL_HASH_BYTES for i in group], partial=False))
+
+        duplicates, saved = [], 0
+        for (size, digest), group in sorted(identical.items()):
+            (original, _), *copies = sorted((table.path(i), i) for i in group)
+            for path, file_id in copies:
+                self.append_json_record(self.duplicate_file, self.duplicate_records, 'path', {
+                    'path': path,
+                    'original': original,
+                    'size': size,
+                    'blake2b': digest
+                })
+                duplicates.append(file_id)
+            saved += size * len(copies)
+        if not duplicates:
+            return ids
+        logging.info(f"Found {len(duplicates)} duplicate files in {len(identical)} groups, "
+                     f"saving {saved / 1024**3:.2f} GB of tape")
+        return ids[~np.isin(ids, duplicates)]
+
+    def estimate_compressibility(self, ids: np.ndarray, num_workers: int = 8) -> Dict[int, float]:
+        """
+        Estimate the gzip compression ratio (original / compressed size) of each directory
+        Up to SAMPLE_FILES_PER_DIR files of each directory, spread over its
+        listing, are sampled at SAMPLE_BLOCKS_PER_FILE offsets; the blocks are
+        compressed in parallel.  Only the sampled blocks are read.
+        Returns {directory ID: ratio}
+        """
+        table = self.file_table
+        ids = ids[table.size[ids] > 0]
+        dir_ids = table.dir_id[ids]
+        order = np.argsort(dir_ids, kind='stable')
+        uniq, first, counts = np.unique(dir_ids[order], return_index=True, return_counts=True)
+        samples = []
+        for dir_id, start, count in zip(uniq.tolist(), first.tolist(), counts.tolist()):
+            picks = np.linspace(start, start + count - 1, min(count, SAMPLE_FILES_PER_DIR)).astype(np.int64)
+            samples.extend((dir_id, int(i)) for i in ids[order[np.unique(picks)]])
+
+        def sample_file(file_id: int) -> Tuple[int, int]:
+            size = int(table.size[file_id])
+            raw = packed = 0
+            try:
+                with open(table.path(file_id), 'rb') as f:
+                    offsets = {size * k // SAMPLE_BLOCKS_PER_FILE for k in range(SAMPLE_BLOCKS_PER_FILE)}
+                    for offset in sorted(offsets):
+                        f.seek(offset)
+                        block = f.read(SAMPLE_BLOCK_BYTES)
+                        raw += len(block)
+                        packed += len(zlib.compress(block, 6))
+            except OSError as e:
+                logging.warning(f"Couldn't sample {table.path(file_id)}: {e}")
+            return raw, packed
+
+        raw, packed = {}, {}
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for (dir_id, _), (r, p) in zip(samples, executor.map(sample_file, [i for _, i in samples])):
+                raw[dir_id] = raw.get(dir_id, 0) + r
+                packed[dir_id] = packed.get(dir_id, 0) + p
+        ratios = {dir_id: raw[dir_id] / packed[dir_id] for dir_id in raw if packed[dir_id]}
+        compressible = sum(ratio >= self.compress_min_ratio for ratio in ratios.values())
+        logging.info(f"Sampled {len(samples)} files of {len(ratios)} directories: "
+                     f"{compressible} compress by at least {self.compress_min_ratio:g}x")
+        self.write_json_atomic(self.doc_dir / "compressibility.json",
+                               {table.dir_rel_path(d): round(r, 3) for d, r in sorted(ratios.items())}, indent=2)
+        return ratios
+
+    def compress_files(self, ids: np.ndarray, num_workers: int = 8) -> np.ndarray:
+        """
+        Replace the files of compressible directories by gzip-compressed copies
+        Copies are written to root_dir/compressed_files/<path>.gz and recorded in
+        compressed_file.json; files that will be bundled are left to the bundles.
+        Returns the updated array of file table IDs
+        """
+        table = self.file_table
+        previous, self.compressed_records = self.compressed_records, {}
+        compressible = [d for d, ratio in self.dir_ratios.items() if ratio >= self.compress_min_ratio]
+        selected = ids[np.isin(table.dir_id[ids], compressible) & (table.size[ids] > 0)]
+        if self.bundle_small:
+            selected = selected[table.size[selected] >= self.small_file_bytes]
+        if len(selected) == 0:
+            return ids
+
+        def compress(file_id: int) -> Dict:
+            path = table.path(file_id)
+            staged = f"{self.compressed_dir}/{table.rel_path(file_id)}.gz"
+            record = previous.get(path)
+            if (self.resume and record and record['compressed_path'] == staged
+                    and record['size'] == int(table.size[file_id]) and os.path.isfile(staged)
+                    and os.path.getsize(staged) == record['compressed_size']):
+                return record
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            with open(path, 'rb') as src, gzip.GzipFile(staged, 'wb', compresslevel=6, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, HASH_BLOCK_BYTES)
+            return {
+                'path': path,
+                'compressed_path': staged,
+                'compression': 'gzip',
+                'size': int(table.size[file_id]),
+                'compressed_size': os.path.getsize(staged)
+            }
+
+        staged = []
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for record in executor.map(compress, selected.tolist()):
+                self.append_json_record(self.compressed_file, self.compressed_records, 'path', record)
+                staged.append(table.add_path(record['compressed_path'], record['compressed_size']))
+        saved = sum(r['size'] - r['compressed_size'] for r in self.compressed_records.values())
+        logging.info(f"Staged compressed copies of {len(staged)} files, saving {saved / 1024**3:.2f} GB of tape")
+        keep = ids[~np.isin(ids, selected)]
+        return np.concatenate([keep, np.array(staged, dtype=keep.dtype)])
+
+    def bundle_small_files(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Pack directories full of small files into intermediate tar bundles
+        Files smaller than small_file_bytes are grouped by directory; each directory
+        with at least bundle_min_files of them is packed into tar files under
+        root_dir/small_file_bundles, which replace those files in the plan.
+        Bundle membership is recorded in bundle_file.json.
+        Returns the updated array of file table IDs
+        """
+        table = self.file_table
+        small = ids[table.size[ids] < self.small_file_bytes]
+        counts = np.bincount(table.dir_id[small], minlength=len(table.dir_names))
+        bundled_dirs = np.nonzero(counts >= self.bundle_min_files)[0]
+        if len(bundled_dirs) == 0:
+            return ids
+        small = small[np.isin(table.dir_id[small], bundled_dirs)]
+        small = small[np.argsort(table.dir_id[small], kind='stable')]
+        by_dir = np.split(small, np.cumsum(counts[bundled_dirs])[:-1])
+
+        bundled, bundles = [], []
+        bundle_dir = self.root_dir / "small_file_bundles"
+        bundle_dir.mkdir(exist_ok=True)
+        for dir_id, members in sorted(zip(bundled_dirs.tolist(), by_dir),
+                                      key=lambda x: table.dir_path(x[0])):
+            rel_dir = table.dir_rel_path(dir_id)
+            code = sshort.string_to_short_code(rel_dir, max_length=32, preserve_extension=False)
+
+            # Each bundle stays within the htar member size and member count
+            groups, current, current_size = [], [], 0
+            for name, size in sorted((table.name(i), int(table.size[i])) for i in members):
+                if current and (current_size + size > self.max_htar_size
+                                or len(current) >= self.max_members):
+                    groups.append(current)
+                    current, current_size = [], 0
+                current.append([name if dir_id == 0 else f"{rel_dir}/{name}", size])
+                current_size += size
+            groups.append(current)
+
+            for n, group in enumerate(groups, 1):
+                # Bundles of compressible directories are gzipped; tar -xf undoes it on restore
+                gzipped = self.compress and self.dir_ratios.get(dir_id, 0) >= self.compress_min_ratio
+                bundle = f"{bundle_dir}/{code}_{n:03d}.tar" + ('.gz' if gzipped else '')
+                record = {
+                    'bundle': bundle,
+                    'directory': rel_dir,
+                    'num_files': len(group),
+                    'files': group
+                }
+                if gzipped:
+                    record['compression'] = 'gzip'
+                if self.resume and self.bundle_records.get(bundle) == record and os.path.isfile(bundle):
+                    logging.debug(f"Already bundled: {bundle}")
+                else:
+                    list_file = f"{bundle}.list"
+                    with open(list_file, 'w') as f:
+                        for rel_path, _ in record['files']:
+                            f.write(f"{rel_path}\n")
+                    subprocess.run(['tar', '-czf' if gzipped else '-cf', bundle, '-C', self.root_dir_str,
+                                    '-T', list_file],
+                                   check=True, capture_output=True, text=True)
+                    os.remove(list_file)
+                self.append_json_record(self.bundle_file, self.bundle_records, 'bundle', record)
+                bundles.append(table.add_path(bundle, os.path.getsize(bundle)))
+            bundled.append(members)
+            logging.info(f"Bundled {len(members)} small files of {rel_dir} into {len(groups)} tar files")
+
+        keep = ids[~np.isin(ids, np.concatenate(bundled))]
+        return np.concatenate([keep, np.array(bundles, dtype=keep.dtype)])
+
+    def group_files_into_chunks(self, file_table: FileTable, ids: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        """
+        Group files into chunks respecting max chunk size and member count,
+        splitting large files and bundling small files if needed
+        file_table: Scanned files; shortened copies, split pieces and bundles are appended to it
+        ids: Rows of file_table to archive (default all)
+        Returns one array of file table IDs per chunk
+        """
+        self.file_table = file_table
+        if ids is None:
+            ids = np.arange(len(file_table), dtype=np.int64)
         chunks = []
         current_chunk = []
         current_size = 0
 
+        # Duplicates found by an earlier run are found again; stale ones must not be indexed
+        self.duplicate_records = {}
+        if self.deduplicate:
+            ids = self.deduplicate_files(ids)
+        if self.compress:
+            self.dir_ratios = self.estimate_compressibility(ids)
+            ids = self.compress_files(ids)
+        else:
+            self.compressed_records = {}
+        if self.bundle_small:
+            ids = self.bundle_small_files(ids)
+
         # Sort files by size in descending order for better packing
-        sorted_files = sorted(file_sizes.items(), key=lambda x: x[1], reverse=True)
-
-        for file_path_orig, size in sorted_files:
-            #handle file path larger than htar limit
-            short_dic,need_short=self.Shorten_path(file_path_orig)
-            if(need_short):
-                file_path=short_dic['short_path']
-                with open(self.large_path_file, 'a') as f:
-                    json.dump(short_dic, f, indent=2)
-            else:
-                file_path=file_path_orig
-            # Handle files larger than HTAR limit
-            if size > self.max_htar_size:
-                # If there are files in current chunk, add it to chunks
-                #if current_chunk:
-                #    chunks.append(current_chunk)
-                #    current_chunk = []
-                #    current_size = 0
-                
-                # Split the large file
-                split_files = self.split_large_file(file_path)
-                
-                # Add each split file to appropriate chunks
-                for split_file in split_files:
-                    split_size = Path(split_file).stat().st_size
-                    if current_size + split_size > self.chunk_size_bytes:
-                        if current_chunk:
-                            chunks.append(current_chunk)
-                        current_chunk = [split_file]
-                        current_size = split_size
-                    else:
-                        current_chunk.append(split_file)
-                        current_size += split_size
-                continue
+        order = ids[np.argsort(-file_table.size[ids], kind='stable')]
+        long_path, short_names = self.short_path_names(order)
 
-            # Regular file handling
-            if current_size + size > self.chunk_size_bytes:
+        def add_file(file_id: int, size: int):
+            nonlocal current_chunk, current_size
+            if current_size + size > self.chunk_size_bytes or len(current_chunk) >= self.max_chunk_members:
                 if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = [file_path]
+                    chunks.append(np.array(current_chunk, dtype=np.int64))
+                current_chunk = [file_id]
                 current_size = size
             else:
-                current_chunk.append(file_path)
+                current_chunk.append(file_id)
                 current_size += size
 
+        # Walk the sorted files in blocks, so only one block at a time is held as Python ints
+        block = 1 << 20
+        for start in range(0, len(order), block):
+            block_ids = order[start:start + block]
+            for file_id, size, check_path in zip(block_ids.tolist(), file_table.size[block_ids].tolist(),
+                                                 long_path[start:start + block].tolist()):
+                for member, member_size in self.planned_members(file_id, size, check_path,
+                                                                short_names.get(file_id)):
+                    add_file(member, member_size)
+
         if current_chunk:
-            chunks.append(current_chunk)
+            chunks.append(np.array(current_chunk, dtype=np.int64))
 
+        self.write_plan_records()
         return chunks
 
-    def check_existing_archives(self) -> Dict[str, str]:
+    def short_path_names(self, ids: np.ndarray) -> Tuple[np.ndarray, Dict[int, str]]:
+        """
+        Mask of the files among ids whose paths may exceed the htar limits, and
+        the short names of those files, computed in one batch, unique and
+        stable across reruns
+        """
+        table = self.file_table
+        # Only paths that may exceed the htar limits go through Shorten_path
+        long_path = table.long_path_mask(self.max_htar_prefix, self.max_htar_fname, ids)
+        long_ids = ids[long_path].tolist()
+        if not long_ids:
+            return long_path, {}
+        if self.short_names is None:
+            self.short_names = sshort.NameRegistry(self.short_name_registry)
+        rel_paths = [table.path(i)[len(self.root_dir_str):] for i in long_ids]
+        return long_path, dict(zip(long_ids, sshort.shorten_many(rel_paths, max_length=64, preserve_extension=True,
+                                                                 registry=self.short_names)))
+
+    def planned_members(self, file_id: int, size: int, check_path: bool,
+                        short_name: Optional[str] = None) -> List[Tuple[int, int]]:
+        """
+        File table IDs and sizes of the htar members that archive one file
+        A path beyond the htar limits is archived as a shortened copy, and a
+        file beyond the htar member size as split pieces; both are appended
+        to the file table.
+        """
+        table = self.file_table
+        #handle file path larger than htar limit
+        if check_path:
+            short_dic, need_short = self.Shorten_path(table.path(file_id), short_fname=short_name)
+            if need_short:
+                self.append_json_record(self.large_path_file, self.large_path_records, 'path', short_dic)
+                file_id = table.add_path(short_dic['short_path'], size)
+        if size <= self.max_htar_size:
+            return [(file_id, size)]
+        # Split the large file; each piece goes to the appropriate chunk
+        members = []
+        file_path = table.path(file_id)
+        for split_file in self.split_large_file(file_path):
+            if split_file == file_path:
+                members.append((file_id, size))
+            else:
+                split_size = Path(split_file).stat().st_size
+                members.append((table.add_path(split_file, split_size), split_size))
+        return members
+
+    def write_plan_records(self):
+        """
+        Rewrite the record files of the plan, dropping duplicates left behind
+        by interrupted or repeated runs, and save the names given to shortened
+        paths if there are new ones
         """
-        Check for existing archives and return mapping of archived files
-        Returns: Dict[file_path: archive_path]
+        if self.short_names is not None:
+            self.short_names.save()
+        if self.large_path_records:
+            self.write_json_records(self.large_path_file, self.large_path_records)
+        if self.split_records:
+            self.write_json_records(self.split_file, self.split_records)
+        if self.bundle_records:
+            self.write_json_records(self.bundle_file, self.bundle_records)
+        if self.duplicate_records or os.path.exists(self.duplicate_file):
+            self.write_json_records(self.duplicate_file, self.duplicate_records)
+        if self.compressed_records or os.path.exists(self.compressed_file):
+            self.write_json_records(self.compressed_file, self.compressed_records)
+
+    def check_existing_archives(self) -> Membership:
         """
-        existing_files = {}
+        Membership of the files already on tape, by path relative to the root
+        The filter kept next to the verified index in docs/file_index/ is
+        used when it exists, and its hits are confirmed against the index;
+        otherwise one is built from the manifest on tape, whose paths are kept
+        by chunk to confirm hits.
+        """
+        existing = Membership.load(self.doc_dir / index_journal.SHARD_DIR)
+        if existing is not None:
+            return existing
         manifest_path = self.archive_root / "archive_manifest.txt"
         
         # Check manifest on tape
+        by_chunk = {}
         if not self.tape_ops.verify_tape_file(str(manifest_path)):
-            return existing_files
+            return Membership.build([])
 
         # Get manifest from tape
         try:
@@ -511,8 +1043,10 @@ class DataArchiver:
                     archive_path, files = line.strip().split(':', 1)
                     # Verify archive exists on tape
                     if self.tape_ops.verify_tape_file(archive_path):
-                        for file_path in files.split(','):
-                            existing_files[file_path] = archive_path
+                        match = re.search(r'chunk_(\d+)', os.path.basename(archive_path))
+                        chunk = int(match.group(1)) if match else 0
+                        by_chunk.setdefault(chunk, set()).update(
+                            os.path.relpath(file_path, self.root_dir_str) for file_path in files.split(','))
                     else:
                         logging.warning(f"Listed archive not found on tape: {archive_path}")
             
@@ -522,45 +1056,115 @@ class DataArchiver:
             if os.path.exists(temp_manifest):
                 os.remove(temp_manifest)
 
-        return existing_files
+        return Membership.build(((path, chunk) for chunk, paths in by_chunk.items() for path in paths),
+                                chunk_paths=lambda chunk: by_chunk.get(chunk, ()))
 
-    def verify_archive_contents(self, archive_path: str, expected_files: List[str]) -> bool:
-        """Verify archive contents match expected files"""
-        try:
-            # First verify archive exists on tape
-            if not self.tape_ops.verify_tape_file(archive_path):
-                logging.error(f"Archive not found on tape: {archive_path}")
-                return False
-                
-            result = subprocess.run(['htar', '-tvf', archive_path], 
-                                 capture_output=True, text=True, check=True)
-            archived_files = set(line.split()[-1] for line in result.stdout.splitlines()[1:])
-            expected_files_set = set(expected_files)
-            return archived_files == expected_files_set
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error verifying archive {archive_path}: {e}")
+    def verify_archive_contents(self, archive_path: str, expected_files: Dict[str, int]) -> bool:
+        """
+        Verify archive contents match expected files
+        expected_files maps member paths relative to root_dir to their sizes.
+        """
+        # First verify archive exists on tape
+        if not self.tape_ops.verify_tape_file(archive_path):
+            logging.error(f"Archive not found on tape: {archive_path}")
             return False
+        report = verify_archive.verify_archive(archive_path, expected_files, self.root_dir_str)
+        if report['status'] != 'pass':
+            logging.error(f"Archive {archive_path} does not match the plan: {report['n_missing']} missing, "
+                          f"{report['n_unexpected']} unexpected, {report['n_size_mismatch']} wrong size"
+                          + (f" ({report['error']})" if report['error'] else ''))
+        return report['status'] == 'pass'
 
 
-    def create_slurm_script(self, chunk_id: int, files: List[str]) -> str:
-        """Create a Slurm script for archiving a chunk of files"""
-        timestamp = datetime.datetime.now().strftime("%Y%m%d")
+    def measured_stream_bandwidth(self) -> Optional[float]:
+        """
+        Median rate of one htar stream in MB/s, as recorded by completed chunk jobs
+        Each line of the throughput log is: chunk_id bytes seconds streams
+        Returns None if nothing was recorded yet
+        """
+        if not self.throughput_log.exists():
+            return None
+        rates = []
+        with open(self.throughput_log, 'r') as f:
+            for line in f:
+                try:
+                    _, nbytes, seconds, streams = line.split()
+                    if int(seconds) > 0:
+                        rates.append(int(nbytes) / int(seconds) / int(streams) / 1024**2)
+                except ValueError:
+                    logging.warning(f"Couldn't parse throughput record: {line.strip()}")
+        if not rates:
+            return None
+        rate = statistics.median(rates)
+        logging.info(f"Measured htar throughput: {rate:.0f} MB/s per stream over {len(rates)} jobs")
+        return rate
+
+    def job_time_limit(self, total_size: int, n_parts: int) -> str:
+        """
+        Slurm --time for a chunk from its expected transfer time, padded by the
+        safety margin plus 30 minutes for hsi and verification, capped at the wall time
+        """
+        rate = self.stream_bandwidth * 1024 * 1024 * min(self.htar_concurrency, n_parts)
+        seconds = total_size / rate / self.safety_margin + 1800
+        seconds = min(math.ceil(seconds / 60) * 60, self.wall_time_s)
+        days, rest = divmod(int(seconds), 86400)
+        hours, rest = divmod(rest, 3600)
+        time_str = f"{hours:02d}:{rest // 60:02d}:00"
+        return f"{days}-{time_str}" if days else time_str
+
+    def split_chunk(self, chunk_id: int, files: np.ndarray) -> List[np.ndarray]:
+        """
+        Split the members of a chunk into sub-archives, one per htar stream
+        There are at least htar_streams sub-archives, more if needed to keep
+        each near sub_archive_bytes and below max_members; files are balanced
+        by size, largest first into the lightest sub-archive that is not full.
+        Returns a single part when chunks are written as one archive.
+        """
+        if chunk_id in self.chunk_parts:
+            return self.chunk_parts[chunk_id]
+        if self.sub_archive_bytes is None or len(files) <= 1:
+            parts = [np.asarray(files)]
+        else:
+            sizes = self.file_table.size[files]
+            total_size = int(sizes.sum())
+            n_parts = max(self.htar_streams, math.ceil(total_size / self.sub_archive_bytes),
+                          math.ceil(len(files) / self.max_members))
+            n_parts = min(n_parts, len(files))
+            parts = [[] for _ in range(n_parts)]
+            loads = [(0, k) for k in range(n_parts)]
+            order = np.argsort(-sizes, kind='stable')
+            for f, size in zip(files[order].tolist(), sizes[order].tolist()):
+                load, k = heapq.heappop(loads)
+                parts[k].append(f)
+                # Full sub-archives leave the heap for good
+                if len(parts[k]) < self.max_members:
+                    heapq.heappush(loads, (load + size, k))
+            parts = [np.array(part, dtype=np.int64) for part in parts]
+        self.chunk_parts[chunk_id] = parts
+        return parts
+
+    def sub_archive_name(self, chunk_id: int, part: int, n_parts: int, timestamp: str) -> str:
+        """Name of sub-archive part (1-based) of a chunk; chunks in one part keep the plain chunk name"""
+        if n_parts == 1:
+            return f"archive_chunk_{chunk_id}_{timestamp}.tar"
+        return f"archive_chunk_{chunk_id}_{timestamp}_part{part:03d}.tar"
+
+    def create_slurm_script(self, chunk_id: int, files: np.ndarray) -> str:
+        """Create a Slurm script for archiving a chunk of files, given as file table IDs"""
+        timestamp = self.timestamp
         archive_name = f"archive_chunk_{chunk_id}_{timestamp}.tar"
         archive_path = self.archive_root / archive_name
 
         # Calculate estimated size for job requirements
-        total_size = sum(Path(f).stat().st_size for f in files)
+        total_size = int(self.file_table.size[files].sum())
         mem_required = 45  # Keep the fixed memory requirement
 
-        # Identify split files in this chunk
-        split_files = [f for f in files if '.split' in str(f)]
-        
         # Create file list file outside of the script
         chunk_files = f"{self.doc_dir}/chunk_{chunk_id}_files.txt"
         manifest_files = f"{self.root_dir}/chunk_{chunk_id}_manifests.txt"
         
         with open(chunk_files, 'w') as f:
-            for file_path in files:
+            for file_path in self.file_table.paths(files):
                 f.write(f"{file_path}\n")
         
         # Create list of split file manifests
@@ -571,29 +1175,10 @@ class DataArchiver:
         #        if manifest_path.exists():
         #            f.write(f"{manifest_path}\n")
 
-        script_content = f"""#!/bin/bash
-#SBATCH --job-name=archive_chunk_{chunk_id}
-#SBATCH --time=24:00:00
-#SBATCH --qos=xfer
-#SBATCH --constraint=cron
-#SBATCH --mem={mem_required}G
-#SBATCH --output=archive_chunk_{chunk_id}_%j.out
-#SBATCH --error=archive_chunk_{chunk_id}_%j.err
-
-cd {self.root_dir}
-
-# File list is pre-created: {chunk_files}
-if [ ! -f "{chunk_files}" ]; then
-    echo "Error: File list not found: {chunk_files}"
-    exit 1
-fi
-
-# Verify archive directory exists on tape
-if ! hsi ls -l {self.archive_root}; then
-    hsi mkdir -p {self.archive_root}
-fi
-
-# Check if archive already exists
+        parts = self.split_chunk(chunk_id, files)
+        job_time = self.job_time_limit(total_size, len(parts))
+        if len(parts) == 1:
+            archive_block = f"""# Check if archive already exists
 if hsi ls -l {archive_path} > /dev/null 2>&1; then
     echo "Archive already exists: {archive_path}"
     exit 1
@@ -609,16 +1194,98 @@ if [ -f "{manifest_files}" ] && [ -s "{manifest_files}" ]; then
     done < "{manifest_files}"
 fi
 
-# Verify archive
-if ! htar -tvf {archive_path}; then
+# Verify archive and record its members in the index journal
+if ! htar -tvf {archive_path} > chunk_{chunk_id}.tvf; then
     echo "Archive verification failed"
     exit 1
 fi
+{self.journal_cmd} record {self.index_journal} {self.root_dir} {archive_path} chunk_{chunk_id}.tvf --chunk {chunk_id}
+rm -f chunk_{chunk_id}.tvf
 
 # Create temporary manifest entry
 manifest_entry="{archive_path}:"
 manifest_entry+=$(cat {chunk_files} | tr '\\n' ',' | sed 's/,$//')
 echo $manifest_entry > chunk_{chunk_id}_manifest.txt
+"""
+        else:
+            # One file list per sub-archive, listed with its archive path for xargs
+            part_lines = []
+            for k, part in enumerate(parts, 1):
+                part_files = f"{self.doc_dir}/chunk_{chunk_id}_part{k:03d}_files.txt"
+                with open(part_files, 'w') as f:
+                    for file_path in self.file_table.paths(part):
+                        f.write(f"{file_path}\n")
+                part_path = self.archive_root / self.sub_archive_name(chunk_id, k, len(parts), timestamp)
+                part_lines.append(f"{part_path} {part_files}")
+            part_table = "\n".join(part_lines)
+            archive_block = f"""# Sub-archives and their file lists, one htar stream each
+cat > chunk_{chunk_id}_parts.txt <<'PARTS'
+{part_table}
+PARTS
+
+# Create and verify every sub-archive, running at most {self.htar_concurrency} htar streams at once;
+# a rerun of the chunk keeps the sub-archives an earlier run recorded in the index journal
+archive_part() {{
+    if hsi ls -l "$1" > /dev/null 2>&1; then
+        if {self.journal_cmd} recorded {self.doc_dir} "$1" --chunk {chunk_id}; then
+            echo "Archive already recorded: $1"
+            return 0
+        fi
+        echo "Archive already exists: $1"
+        return 1
+    fi
+    htar -cvf "$1" -L "$2" || return 1
+    listing="$(basename "$1").tvf"
+    if ! htar -tvf "$1" > "$listing"; then
+        echo "Archive verification failed: $1"
+        return 1
+    fi
+    {self.journal_cmd} record {self.index_journal} {self.root_dir} "$1" "$listing" --chunk {chunk_id}
+    rm -f "$listing"
+}}
+export -f archive_part
+if ! xargs -P {self.htar_concurrency} -n 2 bash -c 'archive_part "$0" "$1"' < chunk_{chunk_id}_parts.txt; then
+    echo "Creating {len(parts)} sub-archives failed"
+    exit 1
+fi
+
+# Create temporary manifest entries, one per sub-archive
+: > chunk_{chunk_id}_manifest.txt
+while read -r part_archive part_files; do
+    echo "${{part_archive}}:$(cat ${{part_files}} | tr '\\n' ',' | sed 's/,$//')" >> chunk_{chunk_id}_manifest.txt
+done < chunk_{chunk_id}_parts.txt
+rm chunk_{chunk_id}_parts.txt
+"""
+
+        script_content = f"""#!/bin/bash
+#SBATCH --job-name=archive_chunk_{chunk_id}
+#SBATCH --time={job_time}
+#SBATCH --qos=xfer
+#SBATCH --constraint=cron
+#SBATCH --mem={mem_required}G
+#SBATCH --output=archive_chunk_{chunk_id}_%j.out
+#SBATCH --error=archive_chunk_{chunk_id}_%j.err
+
+cd {self.root_dir}
+
+# File list is pre-created: {chunk_files}
+if [ ! -f "{chunk_files}" ]; then
+    echo "Error: File list not found: {chunk_files}"
+    exit 1
+fi
+
+# Verify archive directory exists on tape
+if ! hsi ls -l {self.archive_root}; then
+    hsi mkdir -p {self.archive_root}
+fi
+
+start_time=$(date +%s)
+{archive_block}
+# Record the achieved throughput, used to size future chunks
+echo "{chunk_id} {total_size} $(( $(date +%s) - start_time )) {min(self.htar_concurrency, len(parts))}" >> {self.throughput_log}
+
+# Fold the verified members into the searchable index and upload the changed shards
+{self.journal_cmd} compact {self.doc_dir} --remote {self.archive_root}/docs
 
 # Update manifest on tape
 if ! hsi ls -l {self.archive_root}/archive_manifest.txt > /dev/null 2>&1; then
@@ -636,7 +1303,7 @@ fi
 # Note: we keep the file list and split files for potential reuse/verification
 echo "Archive complete. File list saved as: {chunk_files}"
 echo "Remove {chunk_files} and split files manually after verifying the archive"
-rm chunk_{chunk_id}_manifest.txt manifest_files
+rm -f chunk_{chunk_id}_manifest.txt {manifest_files}
 """
 
         script_path = f"archive_chunk_{chunk_id}.sh"
@@ -645,60 +1312,146 @@ rm chunk_{chunk_id}_manifest.txt manifest_files
 
         return script_path
 
-    def generate_documentation(self, chunks: List[List[str]], dir_sizes: Dict[str, int]) -> str:
+    def create_array_script(self, slurm_scripts: List[str]) -> str:
         """
-        Generate markdown documentation for the archive
-        Returns the documentation content as a string
+        Create a Slurm job array script whose task N runs the script of chunk N
+        All tasks share one time limit, the longest of the chunk scripts.
+        """
+        job_time = max((job_array.script_time_limit(s) for s in slurm_scripts), key=job_array.time_seconds)
+        scripts_dir = Path.cwd()
+        script_content = f"""#!/bin/bash
+#SBATCH --job-name=archive_chunks_{self.timestamp}
+#SBATCH --time={job_time}
+#SBATCH --qos=xfer
+#SBATCH --constraint=cron
+#SBATCH --mem=45G
+#SBATCH --output={scripts_dir}/archive_chunk_%a_%A.out
+#SBATCH --error={scripts_dir}/archive_chunk_%a_%A.err
+
+# Task N archives chunk N with its own script and file list
+chunk_script="{scripts_dir}/archive_chunk_${{SLURM_ARRAY_TASK_ID}}.sh"
+if [ -z "${{SLURM_ARRAY_TASK_ID}}" ] || [ ! -f "${{chunk_script}}" ]; then
+    echo "Error: no chunk script for array task ${{SLURM_ARRAY_TASK_ID}}"
+    exit 1
+fi
+exec bash "${{chunk_script}}"
+"""
+        script_path = f"archive_chunks_{self.timestamp}.sh"
+        with open(script_path, 'w') as f:
+            f.write(script_content)
+        return script_path
+
+    def submit_array(self, slurm_scripts: List[str]):
+        """
+        Submit the chunk scripts not yet submitted as tasks of the array script,
+        at most max_running at once, and checkpoint the ID of every task
+        """
+        tasks = [i for i, script in enumerate(slurm_scripts, 1) if script not in self.plan['jobs']]
+        if not tasks:
+            logging.info(f"All {len(slurm_scripts)} chunk jobs already submitted")
+            return
+        try:
+            job_id = job_array.submit_array(self.plan['array_script'], tasks, self.max_running)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Failed to submit job array {self.plan['array_script']}: {e.stderr}")
+            return
+        for i in tasks:
+            self.plan['jobs'][slurm_scripts[i - 1]] = f"{job_id}_{i}"
+        self.plan['max_running'] = self.max_running
+        self.save_checkpoint()
+        logging.info(f"Submitted job array {job_id} with tasks {job_array.task_ranges(tasks)}, "
+                     f"at most {self.max_running} running at once")
+
+    def summarize_archive(self, chunks: List[np.ndarray], dir_sizes: Dict[str, int], sample: int = 5) -> Dict:
+        """
+        Build the summary model both documentation formats are rendered from
+        One pass over the chunks: sizes and directories come from the file
+        table, and only `sample` names per directory and chunk are decoded.
         """
-        #timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        timestamp = datetime.datetime.now().strftime("%Y%m%d")
-        doc = f"""# Data Archive Documentation
+        timestamp = self.timestamp
+        total_size = sum(dir_sizes.values()) or 1
+        top_dirs = heapq.nlargest(20, dir_sizes.items(), key=lambda x: x[1])
+        summary = {
+            'root_dir': str(self.root_dir),
+            'archive_root': str(self.archive_root),
+            'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'mode': 'Active' if self.create_archive else 'Dry Run',
+            'timestamp': timestamp,
+            'n_directories': len(dir_sizes),
+            'n_duplicates': len(self.duplicate_records),
+            'duplicate_bytes': sum(record['size'] for record in self.duplicate_records.values()),
+            'n_compressed': len(self.compressed_records),
+            'compressed_bytes': sum(record['size'] for record in self.compressed_records.values()),
+            'compressed_size': sum(record['compressed_size'] for record in self.compressed_records.values()),
+            'top_directories': [(str(Path(path).relative_to(self.root_dir)), size, size / total_size)
+                                for path, size in top_dirs],
+            'chunks': [],
+        }
+
+        table = self.file_table
+        for i, chunk in enumerate(chunks, 1):
+            n_parts = len(self.split_chunk(i, chunk))
+            # Group the chunk by directory with one sort of its directory IDs
+            dir_ids = table.dir_id[chunk]
+            order = np.argsort(dir_ids, kind='stable')
+            uniq, first, counts = np.unique(dir_ids[order], return_index=True, return_counts=True)
+            directories = []
+            for dir_id, start, count in zip(uniq.tolist(), first.tolist(), counts.tolist()):
+                names = sorted(table.name(f) for f in chunk[order[start:start + min(count, sample)]].tolist())
+                directories.append((table.dir_rel_path(dir_id), count, names))
+            directories.sort()
+            summary['chunks'].append({
+                'id': i,
+                'archive': f"archive_chunk_{i}_{timestamp}.tar",
+                'n_parts': n_parts,
+                'first_part': self.sub_archive_name(i, 1, n_parts, timestamp),
+                'last_part': self.sub_archive_name(i, n_parts, n_parts, timestamp),
+                'size': int(table.size[chunk].sum()),
+                'files': len(chunk),
+                'directories': directories,
+            })
+        return summary
+
+    def render_markdown(self, summary: Dict, f):
+        """Stream the markdown documentation of a summary to the open file f"""
+        f.write(f"""# Data Archive Documentation
 
 ## Archive Overview
-- Original Data Location: {self.root_dir}
-- Archive Location: {self.archive_root}
-- Total Chunks: {len(chunks)}
-- Archive Date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-- Archive Mode: {'Active' if self.create_archive else 'Dry Run'}
+- Original Data Location: {summary['root_dir']}
+- Archive Location: {summary['archive_root']}
+- Total Chunks: {len(summary['chunks'])}
+- Duplicate Files (archived once): {summary['n_duplicates']} ({summary['duplicate_bytes'] / 1024**3:.2f} GB not written again)
+- Compressed Files: {summary['n_compressed']} ({summary['compressed_bytes'] / 1024**3:.2f} GB stored as {summary['compressed_size'] / 1024**3:.2f} GB)
+- Archive Date: {summary['date']}
+- Archive Mode: {summary['mode']}
 
 ## Directory Structure
-Total directories found: {len(dir_sizes)}
+Total directories found: {summary['n_directories']}
 
 ### Largest Directories (Top 20)
 | Directory | Size (TB) | % of Total |
 |-----------|-----------|------------|
-"""
-        total_size = sum(dir_sizes.values())
-        sorted_dirs = sorted(dir_sizes.items(), key=lambda x: x[1], reverse=True)
-        for path, size in sorted_dirs[:20]:
-            relative_path = str(Path(path).relative_to(self.root_dir))
-            doc += f"| {relative_path} | {size / (1024**4):.2f} | {(size/total_size)*100:.1f}% |\n"
-
-        doc += "\n## Archive Chunks\n"
-        for i, chunk in enumerate(chunks, 1):
-            total_chunk_size = sum(Path(f).stat().st_size for f in chunk)
-            doc += f"\n### Chunk {i}\n"
-            doc += f"- Archive Name: archive_chunk_{i}_{timestamp}.tar\n"
-            doc += f"- Size: {total_chunk_size / (1024**4):.2f} TB\n"
-            doc += f"- Files: {len(chunk)}\n"
-
-            # Group files by directory for better organization
-            files_by_dir = {}
-            for f in chunk:
-                dir_path = str(Path(f).parent.relative_to(self.root_dir))
-                if dir_path not in files_by_dir:
-                    files_by_dir[dir_path] = []
-                files_by_dir[dir_path].append(Path(f).name)
-
-            doc += "- Content Summary:\n"
-            for dir_path, files in sorted(files_by_dir.items()):
-                doc += f"  - {dir_path}/\n"
-                for f in sorted(files)[:5]:  # Show first 5 files per directory
-                    doc += f"    - {f}\n"
-                if len(files) > 5:
-                    doc += f"    - ... ({len(files)-5} more files)\n"
-
-        doc += """
+""")
+        for relative_path, size, fraction in summary['top_directories']:
+            f.write(f"| {relative_path} | {size / (1024**4):.2f} | {fraction*100:.1f}% |\n")
+
+        f.write("\n## Archive Chunks\n")
+        for chunk in summary['chunks']:
+            f.write(f"\n### Chunk {chunk['id']}\n")
+            f.write(f"- Archive Name: {chunk['archive']}\n")
+            if chunk['n_parts'] > 1:
+                f.write(f"- Sub-archives: {chunk['n_parts']} ({chunk['first_part']} ... {chunk['last_part']})\n")
+            f.write(f"- Size: {chunk['size'] / (1024**4):.2f} TB\n")
+            f.write(f"- Files: {chunk['files']}\n")
+            f.write("- Content Summary:\n")
+            for dir_path, count, names in chunk['directories']:
+                f.write(f"  - {dir_path}/\n")
+                for name in names:  # Show first 5 files per directory
+                    f.write(f"    - {name}\n")
+                if count > len(names):
+                    f.write(f"    - ... ({count - len(names)} more files)\n")
+
+        f.write("""
 ## Retrieval Instructions
 
 ### Finding Your Files
@@ -732,103 +1485,114 @@ Total directories found: {len(dir_sizes)}
 - Archives are stored on the NERSC tape system
 - Retrieval times may vary depending on tape availability
 - All sizes are in binary units (1 GB = 1024^3 bytes)
-"""
-        return doc, timestamp
-    def generate_wiki_documentation(self, chunks: List[List[str]], dir_sizes: Dict[str, int]) -> str:
-        """
-        Generate track wiki format documentation for the archive
-        Returns the documentation content as a string
-        """
-        timestamp = datetime.datetime.now().strftime("%Y%m%d")
-        doc = f"""= Data Archive Documentation =
+""")
+
+    def render_wiki(self, summary: Dict, f):
+        """Stream the Trac wiki documentation of a summary to the open file f"""
+        f.write(f"""= Data Archive Documentation =
 
 == Archive Overview ==
- * Original Data Location: {self.root_dir}
- * Archive Location: {self.archive_root}
- * Total Chunks: {len(chunks)}
- * Archive Date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
- * Archive Mode: {'Active' if self.create_archive else 'Dry Run'}
+ * Original Data Location: {summary['root_dir']}
+ * Archive Location: {summary['archive_root']}
+ * Total Chunks: {len(summary['chunks'])}
+ * Duplicate Files (archived once): {summary['n_duplicates']} ({summary['duplicate_bytes'] / 1024**3:.2f} GB not written again)
+ * Compressed Files: {summary['n_compressed']} ({summary['compressed_bytes'] / 1024**3:.2f} GB stored as {summary['compressed_size'] / 1024**3:.2f} GB)
+ * Archive Date: {summary['date']}
+ * Archive Mode: {summary['mode']}
 
 == Directory Structure ==
-Total directories found: {len(dir_sizes)}
+Total directories found: {summary['n_directories']}
 
 === Largest Directories (Top 20) ===
-"""
+""")
         # Track Wiki table format
-        doc += "|| Directory || Size (TB) || % of Total ||\n"
-
-        total_size = sum(dir_sizes.values())
-        sorted_dirs = sorted(dir_sizes.items(), key=lambda x: x[1], reverse=True)
-        for path, size in sorted_dirs[:20]:
-            relative_path = str(Path(path).relative_to(self.root_dir))
-            doc += f"|| {relative_path} || {size / (1024**4):.2f} || {(size/total_size)*100:.1f}% ||\n"
-
-        doc += "\n== Archive Chunks ==\n"
-        for i, chunk in enumerate(chunks, 1):
-            total_chunk_size = sum(Path(f).stat().st_size for f in chunk)
-            doc += f"\n=== Chunk {i} ===\n"
-            doc += f" * Archive Name: archive_chunk_{i}_{timestamp}.tar\n"
-            doc += f" * Size: {total_chunk_size / (1024**4):.2f} TB\n"
-            doc += f" * Files: {len(chunk)}\n"
-
-            # Group files by directory for better organization
-            files_by_dir = {}
-            for f in chunk:
-                dir_path = str(Path(f).parent.relative_to(self.root_dir))
-                if dir_path not in files_by_dir:
-                    files_by_dir[dir_path] = []
-                files_by_dir[dir_path].append(Path(f).name)
-
-            doc += " * Content Summary:\n"
-            for dir_path, files in sorted(files_by_dir.items()):
-                doc += f"   * {dir_path}/\n"
-                for f in sorted(files)[:5]:  # Show first 5 files per directory
-                    doc += f"     * {f}\n"
-                if len(files) > 5:
-                    doc += f"     * ... ({len(files)-5} more files)\n"
-
-        doc += """
+        f.write("|| Directory || Size (TB) || % of Total ||\n")
+        for relative_path, size, fraction in summary['top_directories']:
+            f.write(f"|| {relative_path} || {size / (1024**4):.2f} || {fraction*100:.1f}% ||\n")
+
+        f.write("\n== Archive Chunks ==\n")
+        for chunk in summary['chunks']:
+            f.write(f"\n=== Chunk {chunk['id']} ===\n")
+            f.write(f" * Archive Name: {chunk['archive']}\n")
+            if chunk['n_parts'] > 1:
+                f.write(f" * Sub-archives: {chunk['n_parts']} ({chunk['first_part']} ... {chunk['last_part']})\n")
+            f.write(f" * Size: {chunk['size'] / (1024**4):.2f} TB\n")
+            f.write(f" * Files: {chunk['files']}\n")
+            f.write(" * Content Summary:\n")
+            for dir_path, count, names in chunk['directories']:
+                f.write(f"   * {dir_path}/\n")
+                for name in names:  # Show first 5 files per directory
+                    f.write(f"     * {name}\n")
+                if count > len(names):
+                    f.write(f"     * ... ({count - len(names)} more files)\n")
+
+        f.write(f"""
 == Retrieval Instructions ==
 === Finding Your Files ===
 1. Search the manifest file for your file:
-{{{
+{{{{{{
 grep "path/to/your/file" archive_manifest.txt
-}}}
+}}}}}}
 
 2. Or use the provided search script:
-{{{
+{{{{{{
 ./search_archive.py "filename_pattern"
-}}}
+}}}}}}
 
 === Retrieving Files ===
 1. From a known archive:
-{{{
+{{{{{{
 htar -xvf /path/to/archive.tar path/to/desired/file
-}}}
+}}}}}}
 
 2. Extracting entire chunks:
-{{{
+{{{{{{
 htar -xvf /path/to/archive.tar
-}}}
+}}}}}}
 
 3. Interactive browsing:
-{{{
+{{{{{{
 htar -tvf /path/to/archive.tar | less
-}}}
+}}}}}}
 
 == Archive Manifest ==
 The complete mapping of files to archives is maintained in:
- * Main manifest: {self.archive_root}/archive_manifest.txt
- * This documentation: {self.archive_root}/docs/archive_{timestamp}.txt
- * Search index: {self.archive_root}/docs/file_index.json
+ * Main manifest: {summary['archive_root']}/archive_manifest.txt
+ * This documentation: {summary['archive_root']}/docs/archive_{summary['timestamp']}.txt
+ * Search index: {summary['archive_root']}/docs/file_index.json
 
 == Important Notes ==
  * Archives are stored on the NERSC tape system
  * Retrieval times may vary depending on tape availability
  * All sizes are in binary units (1 TB = 1024⁴ bytes)
  * Check archive_documentation.txt for the most recent archive status
-"""
-        return doc, timestamp
+""")
+
+    def render_documentation(self, summary: Dict, doc_path: Path, wiki_path: Optional[Path] = None):
+        """Write the markdown documentation, and the wiki documentation if wiki_path is given"""
+        with open(doc_path, 'w') as f:
+            self.render_markdown(summary, f)
+        if wiki_path is not None:
+            with open(wiki_path, 'w') as f:
+                self.render_wiki(summary, f)
+
+    def generate_documentation(self, chunks: List[np.ndarray], dir_sizes: Dict[str, int]) -> Tuple[str, str]:
+        """
+        Generate markdown documentation for the archive
+        Returns the documentation content and the timestamp of the run
+        """
+        doc = io.StringIO()
+        self.render_markdown(self.summarize_archive(chunks, dir_sizes), doc)
+        return doc.getvalue(), self.timestamp
+
+    def generate_wiki_documentation(self, chunks: List[np.ndarray], dir_sizes: Dict[str, int]) -> Tuple[str, str]:
+        """
+        Generate track wiki format documentation for the archive
+        Returns the documentation content and the timestamp of the run
+        """
+        doc = io.StringIO()
+        self.render_wiki(self.summarize_archive(chunks, dir_sizes), doc)
+        return doc.getvalue(), self.timestamp
 
     def create_search_script(self) -> str:
         """Create a script to search through the archives"""
@@ -875,41 +1639,90 @@ if __name__ == '__main__':
     main()
 """
         return script_content
-    def create_file_index(self, chunks: List[List[str]], timestamp: str) -> Dict[str, Dict]:
-        """Create a searchable index of all archived files"""
-        index = {}
+    def iter_file_index(self, chunks: List[np.ndarray], timestamp: str):
+        """Yield (relative path, archive info) for every archived file, without holding the index"""
+        table = self.file_table
+        duplicates = (index_journal.records_by_member(self.duplicate_records, 'original', self.large_path_records)
+                      if self.duplicate_records else {})
+        compressed = (index_journal.records_by_member(self.compressed_records, 'compressed_path', self.large_path_records)
+                      if self.compressed_records else {})
         for i, chunk in enumerate(chunks, 1):
-            archive_name = f"archive_chunk_{i}_{timestamp}.tar"
-            archive_path = str(self.archive_root / archive_name)
-            
-            for file_path in chunk:
-                rel_path = str(Path(file_path).relative_to(self.root_dir))
-                index[rel_path] = {
-                    'archive': archive_path,
-                    'size': Path(file_path).stat().st_size,
-                    'date': timestamp,
-                    'chunk': i
-                }
-        
-        return index
-
-
-    def write_documentation(self, doc_content: str, wikidoc_content: str, timestamp: str, chunks: List[List[str]]):
+            # Each member is indexed under the sub-archive that holds it
+            parts = self.split_chunk(i, chunk)
+            for k, part in enumerate(parts, 1):
+                archive_name = self.sub_archive_name(i, k, len(parts), timestamp)
+                archive_path = str(self.archive_root / archive_name)
+
+                for file_id, size in zip(part.tolist(), table.size[part].tolist()):
+                    rel_path = table.rel_path(file_id)
+                    info = {
+                        'archive': archive_path,
+                        'size': size,
+                        'date': timestamp,
+                        'chunk': i
+                    }
+                    if len(parts) > 1:
+                        info['part'] = k
+                    yield rel_path, info
+                    # Files packed into a small-file bundle are indexed individually too
+                    bundle = self.bundle_records.get(table.path(file_id)) if self.bundle_records else None
+                    if bundle is not None:
+                        for member, member_size in bundle['files']:
+                            yield member, dict(info, size=member_size, bundle=rel_path)
+                    if not (duplicates or compressed):
+                        continue
+                    path = table.path(file_id)
+                    # Compressed copies are indexed under the original path too, decompressed on restore
+                    originals = [(path, rel_path, info)]
+                    for record in compressed.get(path, []):
+                        original = os.path.relpath(record['path'], self.root_dir_str)
+                        original_info = dict(info, size=record['size'], compressed=rel_path,
+                                             compression=record['compression'])
+                        yield original, original_info
+                        originals.append((record['path'], original, original_info))
+                    # Identical copies are restored from the file that was archived
+                    for original_path, original, original_info in originals:
+                        for record in duplicates.get(original_path, []):
+                            yield (os.path.relpath(record['path'], self.root_dir_str),
+                                   dict(original_info, size=record['size'], duplicate_of=original))
+
+    def create_file_index(self, chunks: List[np.ndarray], timestamp: str) -> Dict[str, Dict]:
+        """Create a searchable index of all archived files"""
+        return dict(self.iter_file_index(chunks, timestamp))
+
+    def write_file_index(self, chunks: List[np.ndarray], timestamp: str, index_path: Path):
+        """Stream the file index to index_path, one entry per line"""
+        tmp = f"{index_path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write('{')
+            sep = '\n'
+            for rel_path, info in self.iter_file_index(chunks, timestamp):
+                f.write(f"{sep}  {json.dumps(rel_path)}: {json.dumps(info)}")
+                sep = ',\n'
+            f.write('\n}\n')
+        os.replace(tmp, index_path)
+
+    def files_by_directory(self, chunk: np.ndarray) -> Dict[str, List[str]]:
+        """File names of a chunk grouped by directory relative to root_dir"""
+        table = self.file_table
+        files_by_dir = {}
+        for dir_id, file_id in zip(table.dir_id[chunk].tolist(), chunk.tolist()):
+            files_by_dir.setdefault(dir_id, []).append(file_id)
+        return {table.dir_rel_path(d): [table.name(i) for i in ids] for d, ids in files_by_dir.items()}
+
+
+    def write_documentation(self, summary: Dict):
         """Write all documentation files"""
         # Create documentation directory
         #if not self.tape_ops.check_path_exists(doc_dir):
         #    if not self.tape_ops.create_directory(doc_dir):
         #        raise HSIException(f"Failed to create archive directory: {doc_dir}")
 
-        # Write main documentation
+        # Write main documentation, and the wiki version only when requested
+        timestamp = summary['timestamp']
         doc_path = self.doc_dir / f"archive_{timestamp}.md"
-        with open(doc_path, 'w') as f:
-            f.write(doc_content)
-
-        # Write main documentation
-        #wikidoc_path =self.doc_dir / f"archive_{timestamp}.wiki"
-        #with open(wikidoc_path, 'w') as f:
-        #    f.write(wikidoc_content)
+        wikidoc_path = self.doc_dir / f"archive_{timestamp}.wiki" if self.wiki_docs else None
+        self.render_documentation(summary, doc_path, wikidoc_path)
 
         # Create a symlink to latest documentation
         latest_link = self.doc_dir / "latest.md"
@@ -917,12 +1730,6 @@ if __name__ == '__main__':
             latest_link.unlink()
         latest_link.symlink_to(doc_path.name)
 
-        # Create file index
-        index = self.create_file_index(chunks, timestamp)
-        index_path = self.doc_dir / "file_index.json"
-        with open(index_path, 'w') as f:
-            json.dump(index, f, indent=2)
-
         # Create search script
         #search_script = self.doc_dir / "search_archive.py"
         #with open(search_script, 'w') as f:
@@ -933,58 +1740,338 @@ if __name__ == '__main__':
 
 
 
+    def run_streaming(self, num_workers: int = 8):
+        """
+        Plan and submit while the scan is still running
+        A scanner thread lists directories into a queue of at most queue_size
+        directories, so the scan waits when planning falls behind.  This
+        thread adds each directory to the file table and packs its files into
+        chunks in arrival order; each chunk gets its Slurm script, and its job
+        is submitted, as soon as the next file does not fit.  Without a size
+        sort the packing is next-fit, so chunks come out less full than with
+        run_phases.  Deduplication and compression need the whole tree and
+        are not available here.
+        """
+        profiler = self.profiler
+        logging.info(f"Starting streaming archive process for {self.root_dir}")
+        logging.info(f"Mode: {'Archive' if self.create_archive else 'Dry run'}")
+        self.start_checkpoint()
+        self.plan['stream'] = True
+        self.save_checkpoint()
+
+        with profiler.phase('manifest') as counts:
+            existing_archives = self.check_existing_archives()
+            counts['files'] = len(existing_archives)
+        if existing_archives:
+            logging.info(f"Found {len(existing_archives)} files already archived")
+
+        # Jobs are submitted from the first full chunk on, so the tape directory must exist first
+        with profiler.phase('tape_directory'):
+            success = self.tape_ops.create_archive_directory(self.archive_root_str)
+        if success:
+            print("Archive directory structure created successfully")
+        else:
+            print("Failed to create archive directory structure")
+
+        table = FileTable(self.root_dir_str)
+        self.file_table = table
+        self.duplicate_records = {}
+        self.compressed_records = {}
+        exclude = self.scan_excludes()
+        directories = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    directories.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan():
+            try:
+                for listing in scan_directories(self.root_dir_str, num_workers, exclude):
+                    if not put(listing):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        chunks, current_chunk, current_size = [], [], 0
+        slurm_scripts = []
+
+        def seal_chunk():
+            chunk = np.array(current_chunk, dtype=np.int64)
+            chunks.append(chunk)
+            script_path = self.create_slurm_script(len(chunks), chunk)
+            slurm_scripts.append(script_path)
+            self.plan['scripts'] = slurm_scripts
+            logging.info(f"Created Slurm script and file list: {script_path}")
+            if self.create_archive:
+                self.submit_job(script_path)
+            else:
+                self.save_checkpoint()
+
+        def add_file(file_id: int, size: int):
+            nonlocal current_chunk, current_size
+            if current_size + size > self.chunk_size_bytes or len(current_chunk) >= self.max_chunk_members:
+                if current_chunk:
+                    seal_chunk()
+                current_chunk = [file_id]
+                current_size = size
+            else:
+                current_chunk.append(file_id)
+                current_size += size
+
+        scanner = threading.Thread(target=scan, name='scanner', daemon=True)
+        scanned, n_skipped, max_queued = [], 0, 0
+        with profiler.phase('streaming') as counts:
+            scanner.start()
+            try:
+                while True:
+                    max_queued = max(max_queued, directories.qsize())
+                    item = directories.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    path, names, sizes, mtimes = item
+                    dir_id = table.directory_id(path)
+                    if not names:
+                        continue
+                    start = len(table)
+                    table.add_files(dir_id, names, sizes, mtimes)
+                    ids = np.arange(start, len(table), dtype=np.int64)
+                    scanned.append(ids)
+                    if existing_archives:
+                        archived = existing_archives.confirm_many(table.rel_path(i) for i in ids)
+                        n_skipped += int(archived.sum())
+                        ids = ids[~archived]
+                    # A directory arrives whole, so it can be bundled on its own
+                    if self.bundle_small and np.count_nonzero(
+                            table.size[ids] < self.small_file_bytes) >= self.bundle_min_files:
+                        ids = self.bundle_small_files(ids)
+                    long_path, short_names = self.short_path_names(ids)
+                    for file_id, size, check_path in zip(ids.tolist(), table.size[ids].tolist(),
+                                                         long_path.tolist()):
+                        for member, member_size in self.planned_members(file_id, size, check_path,
+                                                                        short_names.get(file_id)):
+                            add_file(member, member_size)
+                if current_chunk:
+                    seal_chunk()
+            finally:
+                stop.set()
+                scanner.join()
+            scanned = np.concatenate(scanned) if scanned else np.zeros(0, dtype=np.int64)
+            counts.update(files=len(scanned), directories=len(table.dir_names), added_files=len(table) - len(scanned),
+                          chunks=len(chunks), jobs=len(self.plan['jobs']), max_queued=max_queued,
+                          bytes=int(sum(table.size[c].sum() for c in chunks)))
+        logging.info(f"Found {len(scanned)} files in {len(table.dir_names)} directories, "
+                     f"created {len(chunks)} chunks")
+        if n_skipped:
+            logging.info(f"Skipped {n_skipped} already archived files")
+
+        # The same checkpoint as run_phases, so a --resume without --stream can finish the submission
+        self.write_plan_records()
+        dir_sizes = table.recursive_directory_sizes(scanned, max_depth=10)
+        self.write_json_atomic(self.scan_file, {'dir_sizes': dir_sizes})
+        table.save(self.table_file)
+        save_chunks(self.chunks_file, chunks)
+        self.plan['scanned_files'] = len(table)
+        for stage in ('scanned', 'chunked', 'scripts'):
+            self.save_checkpoint(stage)
+        if not chunks:
+            logging.info("No new files to archive")
+            return
+
+        with profiler.phase('documentation') as counts:
+            summary = self.summarize_archive(chunks, dir_sizes)
+            doc_path = self.write_documentation(summary)
+            counts.update(chunks=len(summary['chunks']), files=sum(c['files'] for c in summary['chunks']))
+        with profiler.phase('index') as counts:
+            index_path = self.doc_dir / "file_index.json"
+            self.write_file_index(chunks, summary['timestamp'], index_path)
+            counts['bytes'] = index_path.stat().st_size
+        self.save_checkpoint('documented')
+        logging.info(f"Generated documentation: {doc_path}")
+
+        if not self.create_archive:
+            logging.info("Dry run complete. No jobs submitted.")
+            print("\nDry Run Summary:")
+            print(f"Total files found: {len(scanned)}")
+            print(f"Already archived: {n_skipped}")
+            print(f"Number of chunks: {len(chunks)}")
+            print(f"Generated scripts: {len(slurm_scripts)}")
+        elif len(self.plan['jobs']) == len(slurm_scripts):
+            self.save_checkpoint('submitted')
+        else:
+            logging.warning(f"{len(slurm_scripts) - len(self.plan['jobs'])} jobs could not be submitted; "
+                            f"run again with --resume to submit them")
+
+    def submit_job(self, script: str) -> Optional[str]:
+        """Submit a chunk script with sbatch and checkpoint its job ID; returns None if sbatch failed"""
+        if script in self.plan['jobs']:
+            logging.info(f"Already submitted job {self.plan['jobs'][script]}: {script}")
+            return self.plan['jobs'][script]
+        try:
+            result = subprocess.run(['sbatch', script],
+                             check=True,
+                             capture_output=True,
+                             text=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Failed to submit job {script}: {e.stderr}")
+            return None
+        job_id = result.stdout.strip().split()[-1]
+        self.plan['jobs'][script] = job_id
+        self.save_checkpoint()
+        logging.info(f"Submitted job {job_id}: {script}")
+        return job_id
+
     def run(self):
         """Main execution method"""
+        try:
+            if self.stream:
+                self.run_streaming()
+            else:
+                self.run_phases()
+        finally:
+            if self.profiler.enabled:
+                self.profiler.log_summary(logging.info)
+                profile_path = self.profiler.write(self.doc_dir, self.checkpoint_settings())
+                logging.info(f"Wrote phase profile: {profile_path}")
+
+    def run_phases(self):
+        """The phases of run, each timed by the profiler when profiling"""
+        profiler = self.profiler
         logging.info(f"Starting archive process for {self.root_dir}")
         logging.info(f"Mode: {'Archive' if self.create_archive else 'Dry run'}")
 
         try:
+            if self.resume and self.load_checkpoint():
+                if self.plan.get('stream') and not self.stage_done('scripts'):
+                    # Its chunks were submitted as they filled; planning again would archive them twice
+                    logging.error(f"{self.plan_file} is from an interrupted --stream run whose jobs may be "
+                                  f"running; check them with squeue before starting a new plan")
+                    return
+                logging.info(f"Resuming from {self.plan_file}, completed stages: "
+                             f"{', '.join(self.plan['stages']) or 'none'}")
+            else:
+                self.resume = False
+                self.start_checkpoint()
+
             # Check existing archives first
-            existing_archives = self.check_existing_archives()
+            with profiler.phase('manifest') as counts:
+                existing_archives = self.check_existing_archives()
+                counts['files'] = len(existing_archives)
             if existing_archives:
                 logging.info(f"Found {len(existing_archives)} files already archived")
 
-            # Get directory sizes
-            dir_sizes = self.get_directory_sizes()
-            logging.info(f"Completed initial directory scan")
-
-            # Scan files in parallel
-            file_sizes = self.parallel_scan_large_directory()
-            logging.info(f"Found {len(file_sizes)} files to process")
+            if self.stage_done('scanned'):
+                with profiler.phase('scan') as counts:
+                    with open(self.scan_file, 'r') as f:
+                        dir_sizes = json.load(f)['dir_sizes']
+                    file_table = FileTable.load(self.table_file)
+                    if not self.stage_done('chunked'):
+                        # Drop rows appended by an interrupted chunking stage
+                        file_table.truncate(self.plan['scanned_files'])
+                    self.file_table = file_table
+                    counts.update(files=self.plan['scanned_files'], from_checkpoint=1)
+                logging.info(f"Loaded scan of {self.plan['scanned_files']} files from checkpoint")
+            else:
+                # Get directory sizes; a sharded scan adds them up from its own table instead of a serial du
+                if not self.scan_tasks:
+                    with profiler.phase('directory_sizes') as counts:
+                        dir_sizes = self.get_directory_sizes()
+                        counts.update(directories=len(dir_sizes), bytes=sum(dir_sizes.values()))
+                    logging.info(f"Completed initial directory scan")
+
+                # Scan files in parallel
+                with profiler.phase('scan') as counts:
+                    file_table = self.parallel_scan_large_directory()
+                    if self.scan_tasks:
+                        dir_sizes = file_table.recursive_directory_sizes(max_depth=10)
+                        counts['tasks'] = self.scan_tasks
+                    self.write_json_atomic(self.scan_file, {'dir_sizes': dir_sizes})
+                    file_table.save(self.table_file)
+                    counts.update(files=len(file_table), bytes=int(file_table.size.sum()),
+                                  directories=len(file_table.dir_names))
+                self.plan['scanned_files'] = len(file_table)
+                self.save_checkpoint('scanned')
+            n_files = self.plan['scanned_files']
+            logging.info(f"Found {n_files} files to process")
 
             # Remove already archived files
-            new_files = {
-                path: size for path, size in file_sizes.items()
-                if path not in existing_archives
-            }
+            if existing_archives:
+                archived = existing_archives.confirm_many(file_table.rel_path(i) for i in range(n_files))
+                new_files = np.nonzero(~archived)[0]
+            else:
+                new_files = np.arange(n_files, dtype=np.int64)
 
-            if len(new_files) != len(file_sizes):
-                logging.info(f"Skipping {len(file_sizes) - len(new_files)} already archived files")
+            if len(new_files) != n_files:
+                logging.info(f"Skipping {n_files - len(new_files)} already archived files")
 
-            if not new_files:
+            if len(new_files) == 0:
                 logging.info("No new files to archive")
                 return
 
             # Group remaining files into chunks
-            chunks = self.group_files_into_chunks(new_files)
-            logging.info(f"Created {len(chunks)} chunks for new files")
+            with profiler.phase('chunking') as counts:
+                if self.stage_done('chunked'):
+                    chunks = load_chunks(self.chunks_file)
+                    counts['from_checkpoint'] = 1
+                    logging.info(f"Loaded {len(chunks)} chunks from checkpoint")
+                else:
+                    chunks = self.group_files_into_chunks(file_table, new_files)
+                    # The table now also holds shortened copies, split pieces and bundles
+                    file_table.save(self.table_file)
+                    save_chunks(self.chunks_file, chunks)
+                    self.save_checkpoint('chunked')
+                    logging.info(f"Created {len(chunks)} chunks for new files")
+                # Copies, split pieces and bundles are rows added after the scan
+                counts.update(files=len(new_files), added_files=len(file_table) - n_files, chunks=len(chunks),
+                              bytes=int(sum(file_table.size[c].sum() for c in chunks)))
 
             # Create Slurm scripts
-            slurm_scripts = []
-            for i, chunk in enumerate(chunks, 1):
-                script_path = self.create_slurm_script(i, chunk)
-                slurm_scripts.append(script_path)
-                logging.info(f"Created Slurm script and file list: {script_path}")
+            with profiler.phase('scripts') as counts:
+                if self.stage_done('scripts') and all(os.path.exists(s) for s in self.plan['scripts']):
+                    slurm_scripts = self.plan['scripts']
+                    counts['from_checkpoint'] = 1
+                    logging.info(f"Reusing {len(slurm_scripts)} Slurm scripts from checkpoint")
+                else:
+                    slurm_scripts = []
+                    for i, chunk in enumerate(chunks, 1):
+                        script_path = self.create_slurm_script(i, chunk)
+                        slurm_scripts.append(script_path)
+                        logging.info(f"Created Slurm script and file list: {script_path}")
+                    self.plan['scripts'] = slurm_scripts
+                    self.save_checkpoint('scripts')
+                if self.job_array:
+                    self.plan['array_script'] = self.create_array_script(slurm_scripts)
+                    self.save_checkpoint()
+                    logging.info(f"Created Slurm job array script: {self.plan['array_script']}")
+                counts['scripts'] = len(slurm_scripts)
 
             # Generate documentation and write all files
-            doc_content, timestamp = self.generate_documentation(chunks, dir_sizes)
-            wikidoc_content, timestamp = self.generate_wiki_documentation(chunks, dir_sizes)
-            doc_path = self.write_documentation(doc_content, wikidoc_content, timestamp, chunks)
-            logging.info(f"Generated documentation: {doc_path}")
+            if self.stage_done('documented'):
+                logging.info("Documentation already generated")
+            else:
+                with profiler.phase('documentation') as counts:
+                    summary = self.summarize_archive(chunks, dir_sizes)
+                    doc_path = self.write_documentation(summary)
+                    counts.update(chunks=len(summary['chunks']), files=sum(c['files'] for c in summary['chunks']))
+                with profiler.phase('index') as counts:
+                    index_path = self.doc_dir / "file_index.json"
+                    self.write_file_index(chunks, summary['timestamp'], index_path)
+                    counts['bytes'] = index_path.stat().st_size
+                self.save_checkpoint('documented')
+                logging.info(f"Generated documentation: {doc_path}")
 
 
             # Create a nested archive directory
-            success = self.tape_ops.create_archive_directory(self.archive_root_str)
+            with profiler.phase('tape_directory'):
+                success = self.tape_ops.create_archive_directory(self.archive_root_str)
             if success:
                 print("Archive directory structure created successfully")
             else:
@@ -992,27 +2079,28 @@ if __name__ == '__main__':
 
             # Submit Slurm jobs if create_archive is True
             if self.create_archive:
-                for script in slurm_scripts:
-                    try:
-                        result = subprocess.run(['sbatch', script],
-                                         check=True,
-                                         capture_output=True,
-                                         text=True)
-                        job_id = result.stdout.strip().split()[-1]
-                        logging.info(f"Submitted job {job_id}: {script}")
-                    except subprocess.CalledProcessError as e:
-                        logging.error(f"Failed to submit job {script}: {e.stderr}")
+                with profiler.phase('submission') as counts:
+                    if self.job_array:
+                        self.submit_array(slurm_scripts)
+                    else:
+                        for script in slurm_scripts:
+                            self.submit_job(script)
+                    counts['jobs'] = len(self.plan['jobs'])
+                if len(self.plan['jobs']) == len(slurm_scripts):
+                    self.save_checkpoint('submitted')
             else:
                 logging.info("Dry run complete. No jobs submitted.")
                 logging.info(f"To submit jobs, run again with --create-archive")
 
                 # Print summary
                 print("\nDry Run Summary:")
-                print(f"Total files found: {len(file_sizes)}")
+                print(f"Total files found: {n_files}")
                 print(f"Already archived: {len(existing_archives)}")
                 print(f"New files to archive: {len(new_files)}")
                 print(f"Number of chunks: {len(chunks)}")
                 print(f"Generated scripts: {len(slurm_scripts)}")
+                if self.job_array:
+                    print(f"Job array script: {self.plan['array_script']}")
         except Exception as e:
             logging.error(f"Error during archive process: {e}")
             raise
@@ -1028,20 +2116,125 @@ if __name__ == "__main__":
                        help="Number of parallel workers for directory scanning")
     parser.add_argument("--create-archive", action="store_true",
                        help="If set, submit archive jobs; otherwise, perform dry run only")
+    parser.add_argument("--resume", action="store_true",
+                       help="Continue from the checkpointed plan in root_dir/docs, skipping completed work")
+    parser.add_argument("--htar-streams", type=int, default=1,
+                       help="Number of sub-archives each chunk job writes concurrently (default: 1)")
+    parser.add_argument("--sub-archive-size", type=int, default=None,
+                       help="Target size of each sub-archive in GB (default: chunk size / htar streams)")
+    parser.add_argument("--max-bandwidth", type=float, default=None,
+                       help="Aggregate bandwidth cap per chunk job in MB/s; limits concurrent htar streams")
+    parser.add_argument("--stream-bandwidth", type=float, default=None,
+                       help="Sustained rate of one htar stream in MB/s, used to size chunks and job times "
+                            "(default: measured by earlier chunk jobs of this tree, else 400)")
+    parser.add_argument("--wall-time", type=float, default=24,
+                       help="Wall-time limit of a chunk job in hours (default: 24)")
+    parser.add_argument("--safety-margin", type=float, default=0.75,
+                       help="Fraction of the wall time a chunk is planned to fill (default: 0.75)")
+    parser.add_argument("--max-members", type=int, default=1000000,
+                       help="Maximum number of members in one htar archive (default: 1000000)")
+    parser.add_argument("--bundle-small-files", action="store_true",
+                       help="Pack directories full of small files into tar bundles before htar")
+    parser.add_argument("--small-file-size", type=float, default=1,
+                       help="Files below this size in MB are bundled (default: 1)")
+    parser.add_argument("--bundle-min-files", type=int, default=1000,
+                       help="Minimum number of small files for a directory to be bundled (default: 1000)")
+    parser.add_argument("--wiki-docs", action="store_true",
+                       help="Also write the archive documentation in Trac wiki format")
+    parser.add_argument("--deduplicate", action="store_true",
+                       help="Archive files with identical content once; the copies are indexed as references")
+    parser.add_argument("--dedup-min-size", type=float, default=1,
+                       help="Files below this size in MB are not checked for duplicates (default: 1)")
+    parser.add_argument("--compress", action="store_true",
+                       help="Archive gzip-compressed copies of the files of compressible directories")
+    parser.add_argument("--compress-min-ratio", type=float, default=1.5,
+                       help="Minimum estimated compression ratio for a directory to be compressed (default: 1.5)")
+    parser.add_argument("--verify", action="store_true",
+                       help="Check every archive on tape against the planned index instead of archiving")
+    parser.add_argument("--verify-workers", type=int, default=4,
+                       help="Number of archives --verify lists concurrently (default: 4)")
+    parser.add_argument("--stream", action="store_true",
+                       help="Write and submit each chunk as soon as it fills, while the scan continues")
+    parser.add_argument("--queue-size", type=int, default=1024,
+                       help="Maximum number of scanned directories waiting to be chunked with --stream (default: 1024)")
+    parser.add_argument("--job-array", action="store_true",
+                       help="Submit all chunk jobs as one Slurm job array instead of one job per chunk")
+    parser.add_argument("--max-running", type=int, default=None,
+                       help="Maximum number of chunk jobs of the job array running at once "
+                            "(default: 8, with --resubmit-failed the limit of the first submission)")
+    parser.add_argument("--resubmit-failed", action="store_true",
+                       help="Resubmit the failed tasks of the job array of root_dir instead of archiving")
+    parser.add_argument("--scan-tasks", type=int, default=0,
+                       help="Scan in this many tasks, each walking its share of the top directories "
+                            "(default: one multi-threaded scan)")
+    parser.add_argument("--shard-depth", type=int, default=2,
+                       help="Depth below root_dir of the directories dealt out to the scan tasks (default: 2)")
+    parser.add_argument("--scan-launcher", choices=['local', 'srun'], default='local',
+                       help="Run the scan tasks as local processes, or with srun across the nodes of the "
+                            "current Slurm allocation (default: local)")
+    parser.add_argument("--profile", action="store_true",
+                       help="Record wall time, CPU time, peak RSS and counts of each phase in docs/profile_<timestamp>.json")
+    parser.add_argument("--profile-phase", default=None,
+                       choices=['manifest', 'directory_sizes', 'scan', 'chunking', 'scripts', 'documentation',
+                                'index', 'tape_directory', 'submission', 'streaming'],
+                       help="Also run this phase under cProfile (implies --profile)")
     args = parser.parse_args()
+    args.profile = args.profile or args.profile_phase is not None
+    if not 0 < args.safety_margin <= 1:
+        parser.error("--safety-margin must be greater than 0 and at most 1")
+    if args.stream and (args.resume or args.deduplicate or args.compress):
+        parser.error("--stream cannot be combined with --resume, --deduplicate or --compress")
+    if args.stream and args.scan_tasks:
+        parser.error("--stream plans while a single scan runs and cannot use --scan-tasks")
+    if args.stream and args.job_array:
+        parser.error("--stream submits each chunk as it fills and cannot use --job-array")
+
+    if args.verify:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        reports = verify_archive.verify_all(Path(args.root_dir) / "docs", args.archive_root, args.verify_workers)
+        verify_archive.print_report(reports)
+        sys.exit(0 if all(r['status'] == 'pass' for r in reports) else 1)
+
+    if args.resubmit_failed:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        failed = job_array.resubmit_failed(Path(args.root_dir) / "docs",
+                                           args.max_running or 0)
+        print(f"Resubmitted tasks: {job_array.task_ranges(failed) or 'none'}")
+        sys.exit(0)
 
     archiver = DataArchiver(
         args.root_dir,
         args.archive_root,
         args.chunk_size,
-        args.create_archive
+        args.create_archive,
+        args.resume,
+        htar_streams=args.htar_streams,
+        sub_archive_size=args.sub_archive_size,
+        max_bandwidth=args.max_bandwidth,
+        stream_bandwidth=args.stream_bandwidth,
+        wall_time=args.wall_time,
+        safety_margin=args.safety_margin,
+        max_members=args.max_members,
+        bundle_small_files=args.bundle_small_files,
+        small_file_size=args.small_file_size,
+        bundle_min_files=args.bundle_min_files,
+        wiki_docs=args.wiki_docs,
+        deduplicate=args.deduplicate,
+        dedup_min_size=args.dedup_min_size,
+        compress=args.compress,
+        compress_min_ratio=args.compress_min_ratio,
+        profile=args.profile,
+        profile_phase=args.profile_phase,
+        stream=args.stream,
+        queue_size=args.queue_size,
+        job_array=args.job_array,
+        max_running=args.max_running if args.max_running is not None else 8,
+        scan_tasks=args.scan_tasks,
+        shard_depth=args.shard_depth,
+        scan_launcher=args.scan_launcher
     )
     archiver.run()
 
-    # Finally we would also like to tar the docs directory
-    comm=f'htar -cvf {archiver.archive_root}/docs.tar {archiver.root_dir}/docs'
-    result = subprocess.run(comm, shell=True, check=False,
-                                  capture_output=True, text=True) 
-    print(comm)
-    print(result.stdout)
-    print(result.stderr)
+    # Finally copy the docs directory to tape; later runs and chunk jobs only upload what changed
+    uploaded = index_journal.sync(archiver.doc_dir, f"{archiver.archive_root}/docs")
+    print(f"Uploaded {len(uploaded)} changed docs files to {archiver.archive_root}/docs")
@@ -1,6 +1,9 @@
 import hashlib
 import base64
 import re
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 
 def string_to_short_code(input_string, max_length=32, preserve_extension=True):
     """
@@ -102,3 +105,129 @@ def check_collision_probability(strings, max_length=32):
         shortened_dict[short] = s
     
     return len(collisions), collisions
+
+def load_registry(registry_file):
+    """
+    Load a registry of shortened names, a JSON dict of {input string: short name}.
+    Returns an empty dict if the file does not exist yet.
+    """
+    if not registry_file or not os.path.isfile(registry_file):
+        return {}
+    with open(registry_file, 'r') as f:
+        return json.load(f)
+
+def save_registry(registry_file, names):
+    """Write a registry of shortened names, through a temporary file so a crash never truncates it"""
+    tmp = f"{registry_file}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(names, f)
+    os.replace(tmp, registry_file)
+
+class NameRegistry:
+    """
+    A registry of shortened names held in memory, so that many shorten_many
+    calls read the registry file once and write it once, with save
+    """
+
+    def __init__(self, registry_file=None):
+        self.registry_file = registry_file
+        self.names = load_registry(registry_file)
+        self.taken = set(self.names.values())
+        self.n_saved = len(self.names)
+
+    def save(self):
+        """Write the registry file if names were added since it was read or last saved"""
+        if self.registry_file and len(self.names) > self.n_saved:
+            save_registry(self.registry_file, self.names)
+            self.n_saved = len(self.names)
+
+
+def _short_codes(strings, max_length, preserve_extension):
+    """string_to_short_code over a batch, with the per-call regex and lookups hoisted out"""
+    sha256 = hashlib.sha256
+    b64encode = base64.urlsafe_b64encode
+    codes = []
+    for s in strings:
+        if not s:
+            codes.append("")
+            continue
+        extension = ""
+        length = max_length
+        if preserve_extension and '.' in s:
+            extension = '.' + s.rsplit('.', 1)[-1]
+            length = max(max_length - len(extension), 8)
+        # urlsafe base64 only adds '-', '_' and '=' padding to the alphanumerics
+        code = b64encode(sha256(s.encode('utf-8')).digest()).translate(None, b'-_=').decode('ascii')
+        codes.append(code[:length] + extension)
+    return codes
+
+def shorten_many(paths, max_length=64, preserve_extension=True, registry=None, num_workers=8, batch_size=65536):
+    """
+    Shorten a whole list of paths at once, with names guaranteed unique.
+
+    Names are those of string_to_short_code, hashed in batches across a
+    thread pool.  Paths already in the registry keep their registered name.
+    When several new paths get the same code, the lexicographically first one
+    keeps it and the others are re-hashed with a salt ("1#path", "2#path", ...)
+    until their name is free, so the result does not depend on input order.
+
+    Args:
+        paths (list): Strings to shorten, e.g. paths relative to the archive root
+        max_length (int): Maximum length of each name, see string_to_short_code
+        preserve_extension (bool): Whether to keep the file extension
+        registry (str or NameRegistry): JSON file of names given by earlier runs,
+            updated in place, or a NameRegistry, which is updated in memory and
+            saved by the caller (default: none)
+        num_workers (int): Number of hashing threads
+        batch_size (int): Number of strings hashed per task
+
+    Returns:
+        list: The shortened name of each path, in input order
+    """
+    store = registry if isinstance(registry, NameRegistry) else NameRegistry(registry)
+    names, taken = store.names, store.taken
+    todo = [p for p in dict.fromkeys(paths) if p not in names]
+
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    codes = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for batch_codes in executor.map(_short_codes, batches, [max_length] * len(batches),
+                                        [preserve_extension] * len(batches)):
+            codes.extend(batch_codes)
+
+    # Common case: no code is shared or already taken
+    code_set = set(codes)
+    if len(code_set) == len(codes) and taken.isdisjoint(code_set):
+        names.update(zip(todo, codes))
+        taken.update(codes)
+        codes = todo = []
+
+    by_code = {}
+    for path, code in zip(todo, codes):
+        by_code.setdefault(code, []).append(path)
+
+    # First pass: the first path of every free code keeps it (codes are distinct, so order is irrelevant)
+    unresolved = []
+    for code, group in by_code.items():
+        if len(group) > 1:
+            group.sort()
+        if code in taken:
+            unresolved.extend(group)
+            continue
+        names[group[0]] = code
+        taken.add(code)
+        unresolved.extend(group[1:])
+
+    # Second pass: re-hash colliding paths with a salt until their name is free
+    for path in sorted(unresolved):
+        salt = 1
+        code = string_to_short_code(f"{salt}#{path}", max_length, preserve_extension)
+        while code in taken:
+            salt += 1
+            code = string_to_short_code(f"{salt}#{path}", max_length, preserve_extension)
+        names[path] = code
+        taken.add(code)
+
+    if store is not registry:
+        store.save()
+    return [names[p] for p in paths]
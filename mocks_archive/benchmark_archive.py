@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark the mocks archiver and search tools on synthetic directory trees.
+
+A synthetic tree of sparse files is generated with a configurable depth,
+fan-out, file name length and size distribution, and fake ``hsi``, ``htar``
+and ``sbatch`` executables are put in front of ``PATH`` so that nothing ever
+talks to HPSS or Slurm.  Each scale is run in its own process, so that the
+reported peak RSS (resident memory) belongs to that scale only.
+
+With --in-memory the same tree is built directly as a FileTable, without
+touching the file system, so that the planner, index and documentation
+memory can be measured at 50 million files and more.
+
+example: python benchmark_archive.py --scales 10000 100000 --work-dir /pscratch/sd/u/user/bench
+         python benchmark_archive.py --scales 50000000 --in-memory
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import shutil
+import logging
+import argparse
+import resource
+import multiprocessing
+from pathlib import Path
+from typing import Dict, Callable
+
+# Executables that stand in for the NERSC tools while benchmarking.
+FAKE_EXECUTABLES = {
+    'hsi': """#!/bin/bash
+# fake hsi: every path exists, every command succeeds
+case "$1" in
+    ls) echo "-rw-r----- 1 user desi 0 Jan 1 00:00 ${@: -1}" ;;
+    *) ;;
+esac
+exit 0
+""",
+    'htar': """#!/bin/bash
+# fake htar: accept everything, archive nothing
+exit 0
+""",
+    'sbatch': """#!/bin/bash
+# fake sbatch: pretend to submit the job
+echo "Submitted batch job $((RANDOM * 32768 + RANDOM))"
+""",
+}
+
+
+def install_fake_executables(bin_dir: Path) -> Path:
+    """
+    Write fake hsi/htar/sbatch executables and put them first on PATH
+
+    Args:
+        bin_dir: Directory that will hold the executables
+
+    Returns:
+        The directory the executables were written to
+    """
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, content in FAKE_EXECUTABLES.items():
+        exe = bin_dir / name
+        with open(exe, 'w') as f:
+            f.write(content)
+        exe.chmod(0o755)
+    os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    return bin_dir
+
+
+def random_name(rng: random.Random, length: int, extension: str = '.fits') -> str:
+    """Random alphanumeric file name of the given total length"""
+    stem_len = max(length - len(extension), 1)
+    return ''.join(rng.choices(string.ascii_letters + string.digits + '_', k=stem_len)) + extension
+
+
+def draw_size(rng: random.Random, distribution: str, median: int, sigma: float, max_size: int) -> int:
+    """
+    Draw one file size in bytes
+
+    Args:
+        rng: Random generator
+        distribution: One of 'lognormal', 'uniform' or 'fixed'
+        median: Median (lognormal), upper bound (uniform) or value (fixed) in bytes
+        sigma: Width of the lognormal distribution
+        max_size: Sizes are clipped to this value
+    """
+    if distribution == 'fixed':
+        size = median
+    elif distribution == 'uniform':
+        size = rng.randint(0, 2 * median)
+    else:
+        size = int(rng.lognormvariate(0, sigma) * median)
+    return min(size, max_size)
+
+
+def generate_tree(root: Path, n_files: int, depth: int = 3, fanout: int = 8,
+                  name_length: int = 40, distribution: str = 'lognormal',
+                  median_size: int = 64 * 1024**2, sigma: float = 2.0,
+                  max_size: int = 60 * 1024**3, seed: int = 42) -> Dict[str, int]:
+    """
+    Generate a synthetic directory tree made of sparse files
+
+    Files are spread round-robin over every directory of a tree with the
+    given depth and fan-out.  Sizes only exist as metadata (sparse files), so
+    a tree of many TB fits in a few MB of real disk.
+
+    Args:
+        root: Directory to create the tree in
+        n_files: Number of files to create
+        depth: Number of directory levels below root
+        fanout: Number of subdirectories per directory
+        name_length: Length of each file name, including extension
+        distribution: Size distribution, see draw_size
+        median_size: Median file size in bytes
+        sigma: Width of the lognormal size distribution
+        max_size: Maximum file size in bytes
+        seed: Random seed, the same parameters always give the same tree
+
+    Returns:
+        Summary of the generated tree (files, directories, bytes)
+    """
+    rng = random.Random(seed)
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [parent / f"d{d}_{k:03d}" for parent in level for k in range(fanout)]
+        dirs.extend(level)
+    for d in dirs:
+        d.mkdir(parents=True, exist_ok=True)
+
+    total_bytes = 0
+    for i in range(n_files):
+        size = draw_size(rng, distribution, median_size, sigma, max_size)
+        path = dirs[i % len(dirs)] / f"{i:08d}_{random_name(rng, max(name_length - 9, 6))}"
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        total_bytes += size
+
+    return {'files': n_files, 'directories': len(dirs), 'bytes': total_bytes}
+
+
+def generate_table(root: Path, n_files: int, depth: int = 3, fanout: int = 8,
+                   name_length: int = 40, distribution: str = 'lognormal',
+                   median_size: int = 64 * 1024**2, sigma: float = 2.0,
+                   max_size: int = 60 * 1024**3, seed: int = 42):
+    """
+    Build the FileTable of the tree generate_tree would create, in memory only
+
+    Takes the same arguments as generate_tree and returns (table, summary).
+    """
+    from file_table import FileTable
+    rng = random.Random(seed)
+    table = FileTable(str(root))
+    dirs = [0]
+    level = [0]
+    for d in range(depth):
+        level = [table.add_directory(parent, f"d{d}_{k:03d}") for parent in level for k in range(fanout)]
+        dirs.extend(level)
+
+    # Files go round-robin over the directories, appended one batch per directory
+    total_bytes = 0
+    batch = len(dirs) * 1024
+    for start in range(0, n_files, batch):
+        by_dir = {}
+        for i in range(start, min(start + batch, n_files)):
+            size = draw_size(rng, distribution, median_size, sigma, max_size)
+            name = f"{i:08d}_{random_name(rng, max(name_length - 9, 6))}"
+            names, sizes = by_dir.setdefault(dirs[i % len(dirs)], ([], []))
+            names.append(name)
+            sizes.append(size)
+            total_bytes += size
+        for dir_id, (names, sizes) in by_dir.items():
+            table.add_files(dir_id, names, sizes, [0] * len(names))
+
+    return table, {'files': n_files, 'directories': len(dirs), 'bytes': total_bytes}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(results: Dict[str, Dict], phase: str, func: Callable, *args, **kwargs):
+    """Run func, record its wall and CPU time and the peak RSS after it ran"""
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    value = func(*args, **kwargs)
+    results[phase] = {
+        'wall_s': time.perf_counter() - wall0,
+        'cpu_s': time.process_time() - cpu0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    logging.warning(f"{phase}: {results[phase]['wall_s']:.2f} s wall, "
+                    f"{results[phase]['cpu_s']:.2f} s cpu, {results[phase]['peak_rss_mb']:.0f} MB peak RSS")
+    return value
+
+
+def run_scale(n_files: int, args: argparse.Namespace) -> Dict[str, Dict]:
+    """
+    Generate (or reuse) the tree for one scale and time every phase on it
+
+    Runs in a child process, see main.
+    """
+    # Configure logging before DataArchiver.setup_logging, so its INFO output is muted
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(message)s')
+    work_dir = Path(args.work_dir).resolve() / f"n{n_files}"
+    tree = work_dir / 'tree'
+    install_fake_executables(work_dir / 'fakebin')
+    os.chdir(work_dir)
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from Folder2Tape_NERSC_wLargeFile import DataArchiver
+    from search_archive import search_archives
+    import String_shorter as sshort
+
+    results: Dict[str, Dict] = {}
+    marker = work_dir / 'tree.json'
+    params = {k: getattr(args, k) for k in ('depth', 'fanout', 'name_length', 'distribution',
+                                            'median_size', 'sigma', 'max_size', 'seed')}
+    if args.in_memory:
+        tree.mkdir(exist_ok=True)
+        file_table, summary = timed(results, 'generate_table', generate_table, tree, n_files, **params)
+    elif marker.exists() and json.loads(marker.read_text()).get('params') == params:
+        summary = json.loads(marker.read_text())['summary']
+        logging.warning(f"Reusing synthetic tree {tree} ({summary['files']} files)")
+    else:
+        if tree.exists():
+            shutil.rmtree(tree)
+        summary = timed(results, 'generate_tree', generate_tree, tree, n_files, **params)
+        marker.write_text(json.dumps({'params': params, 'summary': summary}))
+
+    archiver = DataArchiver(str(tree), '/nersc/projects/desi/benchmark', args.chunk_size, False)
+    if args.in_memory:
+        dir_sizes = {str(tree): summary['bytes']}
+    else:
+        dir_sizes = timed(results, 'get_directory_sizes', archiver.get_directory_sizes)
+        file_table = timed(results, 'parallel_scan_large_directory',
+                           archiver.parallel_scan_large_directory, args.num_workers)
+    chunks = timed(results, 'group_files_into_chunks', archiver.group_files_into_chunks, file_table)
+    doc_summary = timed(results, 'summarize_archive', archiver.summarize_archive, chunks, dir_sizes)
+    timed(results, 'render_documentation', archiver.render_documentation,
+          doc_summary, work_dir / 'archive.md', work_dir / 'archive.wiki')
+    timestamp = doc_summary['timestamp']
+    timed(results, 'write_file_index', archiver.write_file_index,
+          chunks, timestamp, work_dir / 'file_index.json')
+    if not args.in_memory:
+        index = timed(results, 'create_file_index', archiver.create_file_index, chunks, timestamp)
+        timed(results, 'search_archives', search_archives, args.pattern, index)
+
+    if args.shorten:
+        # Shorten every path of the tree in one batch, as the planner does for long paths
+        rel_paths = [file_table.rel_path(i) for i in range(len(file_table))]
+        timed(results, 'shorten_many', sshort.shorten_many, rel_paths, num_workers=args.num_workers)
+        del rel_paths
+
+    summary['file_table_mb'] = file_table.nbytes() / 1024**2
+    results['tree'] = summary
+    results['chunks'] = {'count': len(chunks)}
+    return results
+
+
+def _run_scale_in_child(n_files: int, args: argparse.Namespace, queue) -> None:
+    try:
+        queue.put(run_scale(n_files, args))
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mocks archiver on synthetic trees',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[10**4, 10**5],
+                        help='Number of files in each synthetic tree, e.g. 10000 ... 10000000')
+    parser.add_argument('--work-dir', default='archive_benchmark',
+                        help='Directory holding the synthetic trees and all outputs')
+    parser.add_argument('--depth', type=int, default=3, help='Directory levels below the root')
+    parser.add_argument('--fanout', type=int, default=8, help='Subdirectories per directory')
+    parser.add_argument('--name-length', type=int, default=40, help='File name length')
+    parser.add_argument('--distribution', choices=['lognormal', 'uniform', 'fixed'], default='lognormal',
+                        help='File size distribution')
+    parser.add_argument('--median-size', type=int, default=64 * 1024**2, help='Median file size in bytes')
+    parser.add_argument('--sigma', type=float, default=2.0, help='Width of the lognormal size distribution')
+    parser.add_argument('--max-size', type=int, default=60 * 1024**3, help='Maximum file size in bytes')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the tree generator')
+    parser.add_argument('--chunk-size', type=int, default=20480, help='Archiver chunk size in GB')
+    parser.add_argument('--num-workers', type=int, default=8, help='Archiver scan workers')
+    parser.add_argument('--pattern', default='d1_003/', help='Pattern timed with search_archives')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file (inside --work-dir) the results are written to')
+    parser.add_argument('--shorten', action='store_true',
+                        help='Also time String_shorter.shorten_many over every path of the tree')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Build the file table in memory instead of scanning a tree on disk')
+    parser.add_argument('--clean', action='store_true', help='Remove the synthetic trees when done')
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    all_results = {}
+    ctx = multiprocessing.get_context('fork')
+    for n_files in args.scales:
+        (work_dir / f"n{n_files}").mkdir(exist_ok=True)
+        print(f"### {n_files} files")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_scale_in_child, args=(n_files, args, queue))
+        proc.start()
+        all_results[str(n_files)] = queue.get()
+        proc.join()
+        if args.clean:
+            shutil.rmtree(work_dir / f"n{n_files}", ignore_errors=True)
+
+    with open(work_dir / args.output, 'w') as f:
+        json.dump(all_results, f, indent=2)
+
+    phases = ['generate_table', 'get_directory_sizes', 'parallel_scan_large_directory', 'group_files_into_chunks',
+              'summarize_archive', 'render_documentation', 'write_file_index', 'create_file_index', 'search_archives', 'shorten_many']
+    print(f"\n{'phase':32s}" + ''.join(f"{n:>23s}" for n in all_results))
+    for phase in phases:
+        row = f"{phase:32s}"
+        for res in all_results.values():
+            if phase in res:
+                row += f"{res[phase]['wall_s']:>11.2f}s{res[phase]['peak_rss_mb']:>8.0f}MB "
+            else:
+                row += f"{'-':>23s}"
+        print(row)
+    print(f"\nResults written to {work_dir / args.output}")
+
+
+if __name__ == '__main__':
+    main()
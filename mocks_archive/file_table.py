@@ -0,0 +1,351 @@
+"""
+Memory-compact columnar table of the files found under an archive root.
+
+A plain ``{path: size}`` dict costs a few hundred bytes per file, which at
+tens of millions of files does not fit in a 45 GB job.  Here every directory
+name is stored once, in a directory table with a parent-ID column, and each
+file only costs its directory ID, its basename in a packed byte buffer, and
+its size and mtime in NumPy arrays: about 30 bytes plus the basename.
+
+Files are addressed by integer row IDs, so chunks and sub-archives are just
+arrays of IDs into the table.  Files created while planning (shortened
+copies, split pieces, bundles) are appended as new rows.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class FileTable:
+    """
+    Columnar table of files: directory table plus file columns
+
+    Directory 0 is the root.  Directories outside the root (only used for
+    files added by absolute path) have parent -1 and their full path as name.
+    """
+
+    def __init__(self, root: str):
+        self.root = root.rstrip('/') or '/'
+        # Directory table: name component and parent ID, plus a lookup for appends
+        self.dir_names: List[str] = [self.root]
+        self.dir_parent: List[int] = [-1]
+        self._dir_lookup: Dict[Tuple[int, str], int] = {}
+        self._dir_paths: List[str] = []
+        # File columns, grown by doubling; only the first n rows are valid
+        self.n = 0
+        self._dir_id = np.zeros(1024, dtype=np.int32)
+        self._name_end = np.zeros(1024, dtype=np.int64)
+        self._size = np.zeros(1024, dtype=np.int64)
+        self._mtime = np.zeros(1024, dtype=np.int64)
+        self._names = bytearray()
+
+    def __len__(self) -> int:
+        return self.n
+
+    # ------------------------------------------------------------------
+    # Columns
+    # ------------------------------------------------------------------
+    @property
+    def dir_id(self) -> np.ndarray:
+        return self._dir_id[:self.n]
+
+    @property
+    def size(self) -> np.ndarray:
+        return self._size[:self.n]
+
+    @property
+    def mtime(self) -> np.ndarray:
+        return self._mtime[:self.n]
+
+    @property
+    def name_length(self) -> np.ndarray:
+        """Length of each basename in bytes"""
+        ends = self._name_end[:self.n]
+        return np.diff(ends, prepend=0)
+
+    def nbytes(self) -> int:
+        """Memory held by the file columns and the name buffer"""
+        return (self._dir_id.nbytes + self._name_end.nbytes + self._size.nbytes
+                + self._mtime.nbytes + len(self._names))
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+    def add_directory(self, parent: int, name: str) -> int:
+        """Add a directory below parent and return its ID"""
+        key = (parent, name)
+        dir_id = self._dir_lookup.get(key)
+        if dir_id is None:
+            dir_id = len(self.dir_names)
+            self.dir_names.append(name)
+            self.dir_parent.append(parent)
+            self._dir_lookup[key] = dir_id
+        return dir_id
+
+    def _reserve(self, extra: int):
+        needed = self.n + extra
+        if needed <= len(self._size):
+            return
+        capacity = max(needed, 2 * len(self._size))
+        for attr in ('_dir_id', '_name_end', '_size', '_mtime'):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, attr, new)
+
+    def add_files(self, dir_id: int, names: Sequence[str], sizes: Sequence[int], mtimes: Sequence[int]) -> int:
+        """
+        Append a batch of files of one directory
+        Returns the row ID of the first file of the batch
+        """
+        count = len(names)
+        self._reserve(count)
+        first = self.n
+        for k, name in enumerate(names):
+            self._names += os.fsencode(name)
+            self._name_end[first + k] = len(self._names)
+        self._dir_id[first:first + count] = dir_id
+        self._size[first:first + count] = sizes
+        self._mtime[first:first + count] = mtimes
+        self.n += count
+        return first
+
+    def add_path(self, path: str, size: int, mtime: int = 0) -> int:
+        """Append one file given by its absolute path and return its row ID"""
+        directory, name = os.path.split(path)
+        return self.add_files(self.directory_id(directory), [name], [size], [mtime])
+
+    def directory_id(self, directory: str) -> int:
+        """ID of a directory given by absolute path, adding it and its parents if needed"""
+        directory = directory.rstrip('/') or '/'
+        if directory == self.root:
+            return 0
+        if not directory.startswith(self.root + '/'):
+            return self.add_directory(-1, directory)
+        dir_id = 0
+        for component in directory[len(self.root) + 1:].split('/'):
+            if component:
+                dir_id = self.add_directory(dir_id, component)
+        return dir_id
+
+    @classmethod
+    def scan(cls, root: str, num_workers: int = 8, exclude: Sequence[str] = ()) -> 'FileTable':
+        """
+        Walk root in parallel and return the table of all regular files
+        Symbolic links are not followed and not listed, like find -type f.
+        Directories whose absolute path is in exclude are skipped.
+        """
+        table = cls(root)
+        for path, names, sizes, mtimes in scan_directories(table.root, num_workers, exclude):
+            dir_id = table.directory_id(path)
+            if names:
+                table.add_files(dir_id, names, sizes, mtimes)
+        return table
+
+    def extend(self, other: 'FileTable'):
+        """Append all files of other, a table rooted at the same directory or at one below it"""
+        dir_map = np.array([self.directory_id(other.dir_path(d)) for d in range(len(other.dir_names))],
+                           dtype=np.int32)
+        count = other.n
+        self._reserve(count)
+        first = self.n
+        offset = len(self._names)
+        self._names += other._names[:int(other._name_end[count - 1]) if count else 0]
+        self._name_end[first:first + count] = other._name_end[:count] + offset
+        self._dir_id[first:first + count] = dir_map[other.dir_id]
+        self._size[first:first + count] = other.size
+        self._mtime[first:first + count] = other.mtime
+        self.n += count
+
+    def truncate(self, n: int):
+        """Drop every file row from n on"""
+        if n < self.n:
+            self.n = n
+            del self._names[int(self._name_end[n - 1]) if n > 0 else 0:]
+
+    # ------------------------------------------------------------------
+    # Access
+    # ------------------------------------------------------------------
+    def dir_path(self, dir_id: int) -> str:
+        """Absolute path of a directory"""
+        # Parents always have smaller IDs than their children, so paths build in one pass
+        for d in range(len(self._dir_paths), len(self.dir_names)):
+            parent = self.dir_parent[d]
+            if parent < 0:
+                self._dir_paths.append(self.dir_names[d])
+            else:
+                self._dir_paths.append(f"{self._dir_paths[parent].rstrip('/')}/{self.dir_names[d]}")
+        return self._dir_paths[dir_id]
+
+    def dir_rel_path(self, dir_id: int) -> str:
+        """Directory path relative to the root ('.' for the root itself)"""
+        if dir_id == 0:
+            return '.'
+        path = self.dir_path(dir_id)
+        prefix = self.root.rstrip('/') + '/'
+        return path[len(prefix):] if path.startswith(prefix) else path
+
+    def dir_path_lengths(self) -> np.ndarray:
+        """Length in bytes of every directory path, indexed by directory ID"""
+        self.dir_path(len(self.dir_names) - 1)
+        return np.array([len(os.fsencode(p)) for p in self._dir_paths], dtype=np.int64)
+
+    def name(self, i: int) -> str:
+        start = int(self._name_end[i - 1]) if i > 0 else 0
+        return os.fsdecode(bytes(self._names[start:int(self._name_end[i])]))
+
+    def path(self, i: int) -> str:
+        """Absolute path of file i"""
+        return f"{self.dir_path(int(self._dir_id[i])).rstrip('/')}/{self.name(i)}"
+
+    def rel_path(self, i: int) -> str:
+        """Path of file i relative to the root"""
+        dir_id = int(self._dir_id[i])
+        if dir_id == 0:
+            return self.name(i)
+        return f"{self.dir_rel_path(dir_id)}/{self.name(i)}"
+
+    def paths(self, ids: Optional[Sequence[int]] = None) -> Iterator[str]:
+        """Absolute paths of the given files (all files by default), built on the fly"""
+        if ids is None:
+            ids = range(self.n)
+        for i in ids:
+            yield self.path(int(i))
+
+    def long_path_mask(self, max_prefix: int, max_name: int, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Files (all, or the given IDs) whose directory prefix (with its trailing
+        slash) or basename may exceed the htar limits; lengths are in bytes,
+        so this errs on the safe side
+        """
+        if ids is None:
+            prefix_len = self.dir_path_lengths()[self.dir_id] + 1
+            return (prefix_len >= max_prefix) | (self.name_length >= max_name)
+        # Only the directories of ids are measured, so a few rows cost little in a large table
+        dirs, inverse = np.unique(self.dir_id[ids], return_inverse=True)
+        dir_len = np.array([len(os.fsencode(self.dir_path(d))) for d in dirs.tolist()], dtype=np.int64)
+        name_len = self._name_end[ids] - np.where(ids > 0, self._name_end[ids - 1], 0)
+        return (dir_len[inverse] + 1 >= max_prefix) | (name_len >= max_name)
+
+    def recursive_directory_sizes(self, ids: Optional[np.ndarray] = None,
+                                  max_depth: Optional[int] = None) -> Dict[str, int]:
+        """
+        Total size of the given files (all by default) below every directory
+        down to max_depth, by absolute path, like du -b --max-depth
+        """
+        ids = np.arange(self.n) if ids is None else ids
+        totals = np.zeros(len(self.dir_names), dtype=np.int64)
+        np.add.at(totals, self.dir_id[ids], self.size[ids])
+        # Children have larger IDs than their parents: add them up from the leaves
+        for d in range(len(self.dir_names) - 1, 0, -1):
+            if self.dir_parent[d] >= 0:
+                totals[self.dir_parent[d]] += totals[d]
+        depth = [0] * len(self.dir_names)
+        sizes = {self.root: int(totals[0])}
+        for d in range(1, len(self.dir_names)):
+            parent = self.dir_parent[d]
+            depth[d] = depth[parent] + 1 if parent >= 0 else -1
+            if depth[d] > 0 and (max_depth is None or depth[d] <= max_depth) and depth[parent] >= 0:
+                sizes[self.dir_path(d)] = int(totals[d])
+        return sizes
+
+    def directory_sizes(self, ids: Optional[np.ndarray] = None) -> Dict[int, int]:
+        """Total size of the given files (all by default) per directory ID, not recursive"""
+        ids = np.arange(self.n) if ids is None else ids
+        totals = np.bincount(self.dir_id[ids], weights=self.size[ids], minlength=len(self.dir_names))
+        return {int(d): int(totals[d]) for d in np.nonzero(totals)[0]}
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path: str):
+        """Save the table to a .npz file"""
+        dir_names = b'\0'.join(os.fsencode(d) for d in self.dir_names)
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, root=np.array(self.root),
+                 dir_names=np.frombuffer(dir_names, dtype=np.uint8),
+                 dir_parent=np.array(self.dir_parent, dtype=np.int32),
+                 dir_id=self.dir_id, name_end=self._name_end[:self.n],
+                 size=self.size, mtime=self.mtime,
+                 names=np.frombuffer(bytes(self._names), dtype=np.uint8))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FileTable':
+        """Load a table written by save"""
+        with np.load(path) as data:
+            table = cls(str(data['root']))
+            table.dir_names = [os.fsdecode(d) for d in data['dir_names'].tobytes().split(b'\0')]
+            table.dir_parent = data['dir_parent'].tolist()
+            table._dir_lookup = {(p, n): d for d, (p, n) in
+                                 enumerate(zip(table.dir_parent, table.dir_names)) if d > 0}
+            table.n = len(data['size'])
+            table._dir_id = data['dir_id'].copy()
+            table._name_end = data['name_end'].copy()
+            table._size = data['size'].copy()
+            table._mtime = data['mtime'].copy()
+            table._names = bytearray(data['names'].tobytes())
+        return table
+
+
+def list_directory(path: str) -> Tuple[List[str], List[str], List[int], List[int]]:
+    """Subdirectories, and names, sizes and mtimes of the regular files, of one directory"""
+    subdirs, names, sizes, mtimes = [], [], [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        names.append(entry.name)
+                        sizes.append(st.st_size)
+                        mtimes.append(int(st.st_mtime))
+                except OSError as e:
+                    logging.warning(f"Couldn't stat {entry.path}: {e}")
+    except OSError as e:
+        logging.error(f"Error processing directory {path}: {e}")
+    return subdirs, names, sizes, mtimes
+
+
+def scan_directories(root: str, num_workers: int = 8,
+                     exclude: Sequence[str] = ()) -> Iterator[Tuple[str, List[str], List[int], List[int]]]:
+    """
+    Walk root in parallel, yielding (path, names, sizes, mtimes) of each directory as soon as it is listed
+    Each worker lists one directory at a time with os.scandir; a directory
+    is always yielded before its subdirectories.  Directories whose
+    absolute path is in exclude are skipped.
+    """
+    root = root.rstrip('/') or '/'
+    exclude = {path.rstrip('/') for path in exclude}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = {executor.submit(list_directory, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                subdirs, names, sizes, mtimes = future.result()
+                for name in subdirs:
+                    child = f"{path.rstrip('/')}/{name}"
+                    if child not in exclude:
+                        pending[executor.submit(list_directory, child)] = child
+                yield path, names, sizes, mtimes
+
+
+def save_chunks(path: str, chunks: List[np.ndarray]):
+    """Save a list of ID arrays to a .npz file"""
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+    ends = np.cumsum([len(c) for c in chunks], dtype=np.int64)
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, ids=ids, ends=ends)
+    os.replace(tmp, path)
+
+
+def load_chunks(path: str) -> List[np.ndarray]:
+    """Load a list of ID arrays written by save_chunks"""
+    with np.load(path) as data:
+        return np.split(data['ids'], data['ends'][:-1]) if len(data['ends']) else []
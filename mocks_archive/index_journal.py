@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Journal of the members that mocks archive chunk jobs verified on tape.
+
+Planning writes docs/file_index.json from the intended chunk plan.  Each
+chunk job then appends the ``htar -tvf`` listing of every archive it wrote
+and verified to docs/index_journal.jsonl, one JSON record per member.
+``compact`` folds the records added since the previous compaction into
+per-chunk shards of the searchable index, docs/file_index/chunk_NNNNN.json,
+and adds the new members to the membership filter next to them (see
+membership.py); ``sync`` copies to tape only the files of docs/ that changed
+since the last upload, instead of re-tarring the whole directory.
+
+example (as run by chunk jobs):
+    python index_journal.py record docs/index_journal.jsonl /global/cfs/cdirs/desicollab/mocks \\
+        /nersc/projects/desi/mocks/archive_chunk_3_20250101.tar chunk_3.tvf --chunk 3
+    python index_journal.py compact docs --remote /nersc/projects/desi/mocks/docs
+"""
+import os
+import re
+import sys
+import json
+import fcntl
+import logging
+import argparse
+import datetime
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import membership
+
+JOURNAL_NAME = 'index_journal.jsonl'
+SHARD_DIR = 'file_index'
+STATE_NAME = 'journal_state.json'
+UPLOADED_NAME = '.uploaded.json'
+
+# HTAR: -rw-r--r--  user/group      12345 2025-01-01 12:00  path/of member with spaces
+HTAR_LISTING = re.compile(r'^HTAR: (\S{10})\s+(\S+)\s+(\d+)\s+(\d{4}-\d\d-\d\d) (\d\d:\d\d)\s+(.*)$')
+PART_NAME = re.compile(r'_part(\d+)\.tar$')
+
+# Keys of the shard entries of originals restored through large_path_file.json or split_file.json
+RESTORED_FROM_RECORDS = frozenset({'short_path', 'split_files'})
+
+
+def parse_htar_listing(lines: Iterable[str]) -> Iterator[Tuple[str, int]]:
+    """
+    Yield (member name, size) for every regular file of an htar -tvf listing
+    Names may contain spaces; directories, links and HTAR status lines are skipped.
+    """
+    for line in lines:
+        match = HTAR_LISTING.match(line.rstrip('\n'))
+        if match and match.group(1).startswith('-'):
+            yield match.group(6), int(match.group(3))
+
+
+@contextmanager
+def locked(path: Path):
+    """Hold an exclusive lock on path.lock, shared by every job writing to path"""
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def relative_member(name: str, root: str) -> str:
+    """Member name relative to the archived root; htar drops the leading slash"""
+    prefix = root.strip('/') + '/'
+    name = name.lstrip('/')
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def record_archive(journal: Path, root: str, archive: str, listing: Path, chunk: int,
+                   part: Optional[int] = None, date: Optional[str] = None) -> int:
+    """
+    Append the verified members of one archive to the journal
+
+    Args:
+        journal: Journal file, normally docs/index_journal.jsonl
+        root: Directory that was archived
+        archive: Path of the archive on tape
+        listing: File holding the htar -tvf output of the archive
+        chunk: Chunk number
+        part: Sub-archive number, read from the archive name by default
+        date: Date the archive was written, YYYYMMDD, default today
+
+    Returns:
+        Number of members recorded
+    """
+    if part is None:
+        match = PART_NAME.search(archive)
+        part = int(match.group(1)) if match else None
+    date = date or datetime.datetime.now().strftime("%Y%m%d")
+    lines = []
+    with open(listing, 'r', errors='surrogateescape') as f:
+        for name, size in parse_htar_listing(f):
+            record = {'path': relative_member(name, root), 'archive': archive,
+                      'size': size, 'date': date, 'chunk': chunk}
+            if part is not None:
+                record['part'] = part
+            lines.append(json.dumps(record) + '\n')
+    # Whole records only: a crash can leave at most a partial last line, which compact skips
+    with locked(journal):
+        with open(journal, 'a') as f:
+            f.writelines(lines)
+    return len(lines)
+
+
+def write_json_atomic(path: Path, obj, indent: Optional[int] = None):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=indent)
+    os.replace(tmp, path)
+
+
+def shard_path(doc_dir: Path, chunk: int) -> Path:
+    return doc_dir / SHARD_DIR / f"chunk_{chunk:05d}.json"
+
+
+def load_json_records(file_path: str, key: str) -> Dict[str, Dict]:
+    """
+    Load a file of concatenated JSON records, like split_file.json and
+    large_path_file.json, into a dict keyed by record[key].
+    Later records replace earlier ones, so duplicate entries collapse.
+    """
+    records = {}
+    if not os.path.isfile(file_path):
+        return records
+    with open(file_path, 'r') as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            break
+        try:
+            record, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring truncated record at the end of {file_path}")
+            break
+        records[record[key]] = record
+    return records
+
+
+def records_by_member(records: Dict[str, Dict], field: str,
+                      large_path_records: Dict[str, Dict]) -> Dict[str, List[Dict]]:
+    """
+    Records of duplicate or compressed files grouped by the absolute path of
+    the archive member named in record[field], which is the shortened copy
+    for long paths
+    """
+    short_paths = {path: record['short_path'] for path, record in large_path_records.items()}
+    members = {}
+    for record in records.values():
+        members.setdefault(short_paths.get(record[field], record[field]), []).append(record)
+    return members
+
+
+def bundle_members(doc_dir: Path) -> Dict[str, List]:
+    """Members of each small-file bundle, keyed by the bundle path relative to the root"""
+    root = str(doc_dir.resolve().parent)
+    records = load_json_records(str(doc_dir / 'bundle_file.json'), 'bundle')
+    return {os.path.relpath(bundle, root): record['files'] for bundle, record in records.items()}
+
+
+def duplicate_members(doc_dir: Path) -> Dict[str, List]:
+    """Duplicates restored from each archived file, keyed by its path relative to the root"""
+    root = str(doc_dir.resolve().parent)
+    members = records_by_member(
+        load_json_records(str(doc_dir / 'duplicate_file.json'), 'path'), 'original',
+        load_json_records(str(doc_dir / 'large_path_file.json'), 'path'))
+    return {os.path.relpath(member, root): [[os.path.relpath(r['path'], root), r['size']] for r in records]
+            for member, records in members.items()}
+
+
+def compressed_members(doc_dir: Path) -> Dict[str, List]:
+    """Original files of each compressed copy, keyed by the copy's path relative to the root"""
+    root = str(doc_dir.resolve().parent)
+    members = records_by_member(
+        load_json_records(str(doc_dir / 'compressed_file.json'), 'path'), 'compressed_path',
+        load_json_records(str(doc_dir / 'large_path_file.json'), 'path'))
+    return {os.path.relpath(member, root): [[os.path.relpath(r['path'], root), r['size'], r['compression']]
+                                            for r in records]
+            for member, records in members.items()}
+
+
+def long_path_originals(doc_dir: Path) -> Dict[str, str]:
+    """Original path of each shortened copy, both relative to the root"""
+    root = str(doc_dir.resolve().parent)
+    records = load_json_records(str(doc_dir / 'large_path_file.json'), 'path')
+    return {os.path.relpath(record['short_path'], root): os.path.relpath(path, root)
+            for path, record in records.items() if record.get('short_path')}
+
+
+def split_originals(doc_dir: Path) -> Dict[str, Tuple[str, List[str], int]]:
+    """
+    The file each split piece was cut from, with all its pieces and its size,
+    keyed by the piece path relative to the root
+    """
+    root = str(doc_dir.resolve().parent)
+    records = load_json_records(str(doc_dir / 'split_file.json'), 'original_file')
+    pieces = {}
+    for original, record in records.items():
+        split = [os.path.relpath(piece, root) for piece in record['split_files']]
+        for piece in split:
+            pieces[piece] = (os.path.relpath(original, root), split, record['original_size'])
+    return pieces
+
+
+def compact(doc_dir: Path, remote: Optional[str] = None) -> List[Path]:
+    """
+    Fold the journal records added since the last compaction into the index shards
+
+    Besides the archive members themselves, the files restored from them
+    are indexed: bundled files, compressed and duplicate originals, the
+    original paths of shortened copies, and split files once every piece is
+    verified.  The last two are there for the membership filter only:
+    load_index leaves them out.  Only the shards of chunks with new records
+    are rewritten, and only those, with the membership filter, are uploaded
+    when remote is given.
+
+    Returns:
+        The shards and membership files that changed
+    """
+    doc_dir = Path(doc_dir)
+    journal = doc_dir / JOURNAL_NAME
+    state_file = doc_dir / SHARD_DIR / STATE_NAME
+    (doc_dir / SHARD_DIR).mkdir(exist_ok=True)
+    with locked(journal):
+        state = json.loads(state_file.read_text()) if state_file.exists() else {'offset': 0}
+        if not journal.exists():
+            return []
+        with open(journal, 'rb') as f:
+            f.seek(state['offset'])
+            data = f.read()
+        # Stop at the last complete line
+        data = data[:data.rfind(b'\n') + 1]
+        if not data:
+            return []
+
+        by_chunk: Dict[int, List[Dict]] = {}
+        for line in data.decode(errors='surrogateescape').splitlines():
+            record = json.loads(line)
+            by_chunk.setdefault(record['chunk'], []).append(record)
+
+        bundles = bundle_members(doc_dir) if (doc_dir / 'bundle_file.json').exists() else {}
+        duplicates = duplicate_members(doc_dir) if (doc_dir / 'duplicate_file.json').exists() else {}
+        compressed = compressed_members(doc_dir) if (doc_dir / 'compressed_file.json').exists() else {}
+        long_paths = long_path_originals(doc_dir) if (doc_dir / 'large_path_file.json').exists() else {}
+        splits = split_originals(doc_dir) if (doc_dir / 'split_file.json').exists() else {}
+
+        def restored(index: Dict[str, Dict], path: str, info: Dict):
+            """Index the files restored from the archived file path, besides path itself"""
+            originals = [(path, info)]
+            for original, original_size, compression in compressed.get(path, []):
+                index[original] = dict(info, size=original_size, compressed=path, compression=compression)
+                originals.append((original, index[original]))
+            for original, original_info in originals:
+                for copy, copy_size in duplicates.get(original, []):
+                    index[copy] = dict(original_info, size=copy_size, duplicate_of=original)
+            # A path beyond the htar limits is restored from its shortened copy
+            if path in long_paths:
+                index[long_paths[path]] = dict(info, short_path=path)
+
+        indexes: Dict[int, Dict[str, Dict]] = {}
+        # The last verified piece, and its chunk, of each split file
+        split_pieces: Dict[str, Tuple[int, str]] = {}
+        for chunk, records in sorted(by_chunk.items()):
+            shard = shard_path(doc_dir, chunk)
+            index = indexes[chunk] = json.loads(shard.read_text()) if shard.exists() else {}
+            for record in records:
+                path = record.pop('path')
+                info = dict(record, verified=True)
+                index[path] = info
+                # Files packed into a small-file bundle are indexed individually too
+                for member, member_size in bundles.get(path, []):
+                    index[member] = dict(info, size=member_size, bundle=path)
+                restored(index, path, info)
+                if path in splits:
+                    split_pieces[splits[path][0]] = (chunk, path)
+
+        # A split file is indexed, in the chunk of its last piece, once every piece is verified
+        if split_pieces:
+            earlier = membership.Membership.load(doc_dir / SHARD_DIR)
+            for original, (chunk, piece) in split_pieces.items():
+                _, pieces, original_size = splits[piece]
+                pending = [p for p in pieces if not any(p in index for index in indexes.values())]
+                if pending and (earlier is None or not earlier.confirm_many(pending).all()):
+                    continue
+                info = {k: v for k, v in indexes[chunk][piece].items() if k != 'part'}
+                info.update(size=original_size, split_files=pieces)
+                indexes[chunk][original] = info
+                restored(indexes[chunk], original, info)
+
+        changed, members = [], []
+        for chunk, index in sorted(indexes.items()):
+            shard = shard_path(doc_dir, chunk)
+            write_json_atomic(shard, index)
+            changed.append(shard)
+            members.extend((path, chunk) for path in index)
+
+        membership.update(doc_dir, members)
+        changed.extend(doc_dir / SHARD_DIR / name for name in membership.FILES)
+
+        state['offset'] += len(data)
+        write_json_atomic(state_file, state)
+        logging.info(f"Compacted {len(data.splitlines())} journal records into {len(by_chunk)} index shards")
+        if remote is not None:
+            sync(doc_dir, remote, changed)
+    return changed
+
+
+def sync(doc_dir: Path, remote: str, paths: Optional[List[Path]] = None) -> List[Path]:
+    """
+    Copy to tape the files of doc_dir that changed since they were last uploaded
+
+    Args:
+        doc_dir: Local docs directory
+        remote: Docs directory on tape
+        paths: Only consider these files (default every file of doc_dir)
+
+    Returns:
+        The files that were uploaded
+    """
+    doc_dir = Path(doc_dir)
+    uploaded_file = doc_dir / UPLOADED_NAME
+    uploaded = json.loads(uploaded_file.read_text()) if uploaded_file.exists() else {}
+    if paths is None:
+        paths = sorted(p for p in doc_dir.rglob('*') if p.is_file() and not p.is_symlink())
+    sent, made_dirs = [], set()
+    for path in paths:
+        rel = str(Path(path).relative_to(doc_dir))
+        if rel == UPLOADED_NAME or rel.endswith(('.lock', '.tmp')):
+            continue
+        st = Path(path).stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        if uploaded.get(rel) == stamp:
+            continue
+        target_dir = os.path.dirname(f"{remote.rstrip('/')}/{rel}")
+        if target_dir not in made_dirs:
+            subprocess.run(f"hsi mkdir -p {target_dir}", shell=True, capture_output=True, text=True)
+            made_dirs.add(target_dir)
+        result = subprocess.run(f"hsi put {path} : {remote.rstrip('/')}/{rel}", shell=True,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.error(f"Failed to upload {path}: {result.stderr.strip()}")
+            continue
+        uploaded[rel] = stamp
+        sent.append(Path(path))
+    if sent:
+        write_json_atomic(uploaded_file, uploaded)
+        logging.info(f"Uploaded {len(sent)} changed files of {doc_dir} to {remote}")
+    return sent
+
+
+def load_index(doc_dir: str) -> Dict[str, Dict]:
+    """
+    Searchable index of an archive: the planned file_index.json, overridden
+    by the verified entries of the compacted shards
+    The original paths of shortened copies and split files are left out:
+    they are no archive members, and are restored through the large path
+    and split records instead.
+    """
+    index = {}
+    planned = os.path.join(doc_dir, 'file_index.json')
+    if os.path.isfile(planned):
+        with open(planned, 'r') as f:
+            index = json.load(f)
+    shard_dir = Path(doc_dir) / SHARD_DIR
+    if shard_dir.is_dir():
+        for shard in sorted(shard_dir.glob('chunk_*.json')):
+            index.update((path, info) for path, info in json.loads(shard.read_text()).items()
+                         if not RESTORED_FROM_RECORDS.intersection(info))
+    return index
+
+
+
+def recorded_archives(doc_dir: Path, chunk: int) -> Set[str]:
+    """
+    Archives of a chunk with members in the journal, hence written and
+    verified by a chunk job; read from the shard of the chunk and the
+    records not compacted yet
+    """
+    doc_dir = Path(doc_dir)
+    journal = doc_dir / JOURNAL_NAME
+    archives = set()
+    if not journal.exists():
+        return archives
+    # Under the lock, so that a compaction cannot move records between the journal and the shard meanwhile
+    with locked(journal):
+        shard = shard_path(doc_dir, chunk)
+        if shard.exists():
+            archives.update(info['archive'] for info in json.loads(shard.read_text()).values())
+        state_file = doc_dir / SHARD_DIR / STATE_NAME
+        offset = json.loads(state_file.read_text())['offset'] if state_file.exists() else 0
+        with open(journal, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # Skip a partial last line left by a crash
+                if line.endswith(b'\n'):
+                    record = json.loads(line)
+                    if record['chunk'] == chunk:
+                        archives.add(record['archive'])
+    return archives
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the index journal of a mocks archive')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('record', help='Append the verified members of an archive to the journal')
+    p.add_argument('journal', help='Journal file, e.g. docs/index_journal.jsonl')
+    p.add_argument('root', help='Directory that was archived')
+    p.add_argument('archive', help='Path of the archive on tape')
+    p.add_argument('listing', help='File holding the htar -tvf output of the archive')
+    p.add_argument('--chunk', type=int, required=True, help='Chunk number')
+    p.add_argument('--part', type=int, default=None, help='Sub-archive number (default: from the archive name)')
+    p = sub.add_parser('compact', help='Fold new journal records into the index shards')
+    p.add_argument('doc_dir', help='The docs directory of the archived tree')
+    p.add_argument('--remote', default=None, help='Docs directory on tape to upload changed shards to')
+    p = sub.add_parser('recorded', help='Exit with 0 if the journal holds members of an archive, 1 otherwise')
+    p.add_argument('doc_dir', help='The docs directory of the archived tree')
+    p.add_argument('archive', help='Path of the archive on tape')
+    p.add_argument('--chunk', type=int, required=True, help='Chunk number')
+    p = sub.add_parser('sync', help='Upload the files of docs/ that changed since the last upload')
+    p.add_argument('doc_dir', help='The docs directory of the archived tree')
+    p.add_argument('remote', help='Docs directory on tape')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'record':
+        n = record_archive(Path(args.journal), args.root, args.archive, Path(args.listing),
+                           args.chunk, args.part)
+        print(f"Recorded {n} members of {args.archive}")
+        return 0 if n else 1
+    if args.command == 'recorded':
+        return 0 if args.archive in recorded_archives(Path(args.doc_dir), args.chunk) else 1
+    if args.command == 'compact':
+        compact(Path(args.doc_dir), args.remote)
+    else:
+        sync(Path(args.doc_dir), args.remote)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Submit the chunk jobs of a mocks archive as one Slurm job array, and resubmit its failed tasks.
+
+The archiver writes one script per chunk, archive_chunk_N.sh, and with
+--job-array also an array script whose task N runs archive_chunk_N.sh.
+The whole plan is then a single sbatch call and a single scheduler record,
+and ``--array=...%M`` keeps at most M chunk jobs running at once.  The job
+ID of every task (``JOBID_N``) is recorded in the checkpointed plan,
+docs/archive_plan.json, like those of separately submitted chunk jobs.
+
+resubmit_failed asks sacct for the state of the latest task of every chunk
+and submits the array again with just the indices that failed, recording
+the new task IDs in the plan.  A task that timed out or was cancelled may
+leave a partial archive on tape, and a chunk script stops at an archive
+that already exists, so the archives of failed chunks that no chunk job
+recorded in the index journal are removed with ``hsi rm`` first.  This is
+preferred to letting chunk scripts overwrite such archives: a chunk job
+never deletes data on tape, and an archive is removed only here, once its
+task has ended.  Recorded sub-archives were verified; they are kept, and
+the rerun chunk script skips them.
+
+example: python job_array.py /global/cfs/cdirs/desicollab/mocks/docs --max-running 4
+"""
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import index_journal
+
+# Archives written by a chunk script: its single archive, or the lines of its sub-archive table
+SCRIPT_ARCHIVES = re.compile(r'^htar -cvf (\S+) -L |^(\S+\.tar) \S+$', re.MULTILINE)
+
+# sacct states of tasks that ended without archiving their chunk
+FAILED_STATES = {'FAILED', 'TIMEOUT', 'NODE_FAIL', 'OUT_OF_MEMORY', 'BOOT_FAIL', 'DEADLINE', 'PREEMPTED',
+                 'CANCELLED'}
+
+
+def task_ranges(tasks: List[int]) -> str:
+    """Slurm --array index list of tasks, e.g. [1, 2, 3, 7] -> '1-3,7'"""
+    ranges = []
+    for task in sorted(set(tasks)):
+        if ranges and task == ranges[-1][1] + 1:
+            ranges[-1][1] = task
+        else:
+            ranges.append([task, task])
+    return ','.join(f"{a}-{b}" if b > a else f"{a}" for a, b in ranges)
+
+
+def time_seconds(limit: str) -> int:
+    """Seconds of a Slurm --time value in [D-]HH:MM:SS form"""
+    days, _, clock = limit.rpartition('-')
+    hours, minutes, seconds = (clock.split(':') + ['0', '0'])[:3]
+    return ((int(days or 0) * 24 + int(hours)) * 60 + int(minutes)) * 60 + int(seconds)
+
+
+def script_time_limit(script: str) -> str:
+    """The #SBATCH --time of a job script"""
+    with open(script, 'r') as f:
+        m = re.search(r'^#SBATCH --time=(\S+)', f.read(), re.MULTILINE)
+    if m is None:
+        raise ValueError(f"No --time in {script}")
+    return m.group(1)
+
+
+def script_archives(script: str) -> List[str]:
+    """Paths on tape of the archives a chunk script writes"""
+    with open(script, 'r') as f:
+        return [single or part for single, part in SCRIPT_ARCHIVES.findall(f.read())]
+
+
+def remove_partial_archives(doc_dir: Path, chunk: int, script: str, dry_run: bool = False) -> List[str]:
+    """
+    Remove from tape the archives of a failed chunk that its jobs did not record in the index journal
+    Returns the archives removed, or that would be with dry_run.
+    """
+    recorded = index_journal.recorded_archives(doc_dir, chunk)
+    removed = []
+    for archive in script_archives(script):
+        if archive in recorded:
+            continue
+        listed = subprocess.run(['hsi', 'ls', '-l', archive], capture_output=True, text=True)
+        if listed.returncode != 0 or 'not found' in listed.stderr.lower():
+            continue
+        removed.append(archive)
+        if dry_run:
+            logging.info(f"Would remove partial archive {archive}")
+            continue
+        # htar keeps the index of an archive next to it
+        subprocess.run(['hsi', 'rm', archive, f"{archive}.idx"], capture_output=True, text=True)
+        logging.info(f"Removed partial archive {archive}")
+    return removed
+
+
+def submit_array(script: str, tasks: List[int], max_running: int) -> str:
+    """Submit tasks of an array script, at most max_running at once; returns the array job ID"""
+    result = subprocess.run(['sbatch', f"--array={task_ranges(tasks)}%{max_running}", script],
+                            check=True, capture_output=True, text=True)
+    return result.stdout.strip().split()[-1]
+
+
+def task_states(task_ids: List[str]) -> Dict[str, str]:
+    """sacct state of array tasks given as JOBID_N; tasks still pending as a group are left out"""
+    jobs = sorted({task_id.split('_')[0] for task_id in task_ids})
+    if not jobs:
+        return {}
+    result = subprocess.run(['sacct', '-n', '-X', '-P', '-o', 'JobID,State', '-j', ','.join(jobs)],
+                            check=True, capture_output=True, text=True)
+    states = {}
+    for line in result.stdout.splitlines():
+        job_id, _, state = line.partition('|')
+        if state:
+            # e.g. 'CANCELLED by 12345'
+            states[job_id] = state.split()[0]
+    return states
+
+
+def failed_tasks(plan: Dict) -> List[int]:
+    """Array indices of the chunks whose latest task failed"""
+    task_ids = {i: plan['jobs'][script] for i, script in enumerate(plan['scripts'], 1) if script in plan['jobs']}
+    states = task_states([t for t in task_ids.values() if '_' in t])
+    return [i for i, task_id in task_ids.items() if states.get(task_id) in FAILED_STATES]
+
+
+def resubmit_failed(doc_dir: Path, max_running: int = 0, dry_run: bool = False) -> List[int]:
+    """
+    Submit the failed tasks of the array job of an archive again, after
+    removing the partial archives they left on tape
+    max_running: Tasks allowed to run at once (default the limit of the first submission)
+    Returns the resubmitted array indices.
+    """
+    plan_file = Path(doc_dir) / 'archive_plan.json'
+    with open(plan_file, 'r') as f:
+        plan = json.load(f)
+    if not plan.get('array_script'):
+        raise ValueError(f"{plan_file} was not submitted as a job array")
+    failed = failed_tasks(plan)
+    for i in failed:
+        remove_partial_archives(Path(doc_dir), i, plan['scripts'][i - 1], dry_run)
+    if not failed or dry_run:
+        return failed
+    job_id = submit_array(plan['array_script'], failed, max_running or plan['max_running'])
+    for i in failed:
+        plan['jobs'][plan['scripts'][i - 1]] = f"{job_id}_{i}"
+    tmp = f"{plan_file}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp, plan_file)
+    logging.info(f"Resubmitted tasks {task_ranges(failed)} as job {job_id}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resubmit the failed tasks of the job array of an archive')
+    parser.add_argument('doc_dir', help='docs directory of the archive, holding archive_plan.json')
+    parser.add_argument('--max-running', type=int, default=0,
+                        help='Tasks allowed to run at once (default: as in the first submission)')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the failed tasks and the partial archives to remove')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    failed = resubmit_failed(Path(args.doc_dir), args.max_running, args.dry_run)
+    print(f"Failed tasks: {task_ranges(failed) or 'none'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Compact, persisted answer to "is this file already on tape?".
+
+Each archived path, relative to the archived root, is reduced to a 64-bit
+hash.  The hashes are kept sorted, with the chunk that holds each file,
+and a Bloom filter is kept in front of them: most paths that were never
+archived are rejected by the filter after a few bit tests, and the others
+are looked up by binary search.  A hit can be confirmed exactly against
+the index entry of its chunk.  The arrays are saved as .npy files in
+docs/file_index/ and memory-mapped when loaded, so a lookup touches a few
+pages and costs microseconds, whatever the size of the archive.
+
+``index_journal.compact`` adds the members it indexes, so the structure
+always covers the verified index; it is built from all index shards the
+first time.
+
+example: python membership.py docs/ mws/galaxia/alpha/v0.0.6/healpix/0/0/mws_0_0.fits
+"""
+import os
+import sys
+import json
+import math
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from functools import lru_cache
+from typing import Callable, Container, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Directory of the index shards, as in index_journal
+SHARD_DIR = 'file_index'
+META_NAME = 'membership.json'
+ARRAYS = ('hashes', 'chunks', 'bloom')
+FILES = [f"membership_{name}.npy" for name in ARRAYS] + [META_NAME]
+
+# Target false-positive rate of the Bloom filter
+FALSE_POSITIVE = 0.001
+
+
+def path_hashes(paths: Iterable[str]) -> np.ndarray:
+    """64-bit hash of every path"""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(os.fsencode(p), digest_size=8).digest(), 'little')
+                        for p in paths), dtype=np.uint64)
+
+
+class Membership:
+    """
+    Sorted path hashes with the chunk of each, behind a Bloom filter
+
+    capacity is the number of paths the filter is sized for; adding more
+    rebuilds it from the hashes at twice the size.  chunk_paths, if given,
+    returns the paths of a chunk, against which confirm_many checks hits.
+    """
+
+    def __init__(self, hashes: np.ndarray, chunks: np.ndarray, bloom: Optional[np.ndarray] = None,
+                 capacity: int = 0, false_positive: float = FALSE_POSITIVE,
+                 chunk_paths: Optional[Callable[[int], Container[str]]] = None):
+        self.hashes = hashes
+        self.chunks = chunks
+        self.chunk_paths = chunk_paths
+        self.false_positive = false_positive
+        self.capacity = max(capacity, len(hashes), 1024)
+        self.bits = math.ceil(-self.capacity * math.log(false_positive) / math.log(2) ** 2)
+        self.k = max(1, round(self.bits / self.capacity * math.log(2)))
+        if bloom is None:
+            bloom = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+            self._set_bits(bloom, hashes)
+        self.bloom = bloom
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __contains__(self, path: str) -> bool:
+        return self.chunk_of(path) is not None
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        """Bit positions of each hash in the filter, one row per hash, by double hashing"""
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)
+        return (h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(self.bits)
+
+    def _set_bits(self, bloom: np.ndarray, hashes: np.ndarray):
+        # Bounded blocks keep the position matrix small for large builds
+        for start in range(0, len(hashes), 1 << 20):
+            positions = self._positions(hashes[start:start + (1 << 20)]).ravel()
+            np.bitwise_or.at(bloom, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def _in_bloom(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self._positions(hashes)
+        bits = (self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """Chunk of each hash, -1 where it is not a member"""
+        result = np.full(len(hashes), -1, dtype=np.int64)
+        candidates = np.nonzero(self._in_bloom(hashes))[0] if len(self.hashes) else []
+        if len(candidates):
+            idx = np.searchsorted(self.hashes, hashes[candidates])
+            idx[idx == len(self.hashes)] = 0
+            found = self.hashes[idx] == hashes[candidates]
+            result[candidates[found]] = self.chunks[idx[found]]
+        return result
+
+    def contains_many(self, paths: Iterable[str]) -> np.ndarray:
+        """Whether the hash of each path is a member's; a hit may be another path with the same hash"""
+        return self.lookup(path_hashes(paths)) >= 0
+
+    def confirm_many(self, paths: Iterable[str]) -> np.ndarray:
+        """
+        Whether each path is a member, every hash hit confirmed against the
+        paths of its chunk, which are read once per chunk
+        """
+        paths = list(paths)
+        chunks = self.lookup(path_hashes(paths))
+        result = np.zeros(len(paths), dtype=bool)
+        hits = np.nonzero(chunks >= 0)[0]
+        if len(hits) and self.chunk_paths is None:
+            raise ValueError("No chunk_paths to confirm membership with")
+        for chunk in np.unique(chunks[hits]).tolist():
+            members = self.chunk_paths(chunk)
+            for i in hits[chunks[hits] == chunk].tolist():
+                result[i] = paths[i] in members
+        return result
+
+    def chunk_of(self, path: str) -> Optional[int]:
+        """Chunk of a member, None if the path is not a member"""
+        chunk = int(self.lookup(path_hashes([path]))[0])
+        return chunk if chunk >= 0 else None
+
+    def add(self, entries: Iterable[Tuple[str, int]]) -> 'Membership':
+        """A new membership with (path, chunk) entries added; a path added again moves to its new chunk"""
+        entries = list(entries)
+        new = path_hashes(p for p, _ in entries)
+        hashes = np.concatenate([self.hashes, new])
+        chunks = np.concatenate([self.chunks, np.array([c for _, c in entries], dtype=np.int32)])
+        order = np.argsort(hashes, kind='stable')
+        hashes, chunks = hashes[order], chunks[order]
+        # The last entry of each path wins
+        last = np.ones(len(hashes), dtype=bool)
+        last[:-1] = hashes[1:] != hashes[:-1]
+        hashes, chunks = hashes[last], chunks[last]
+        if len(hashes) > self.capacity:
+            return Membership(hashes, chunks, capacity=2 * len(hashes), false_positive=self.false_positive,
+                              chunk_paths=self.chunk_paths)
+        bloom = np.array(self.bloom)
+        self._set_bits(bloom, new)
+        return Membership(hashes, chunks, bloom, self.capacity, self.false_positive, self.chunk_paths)
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[str, int]], false_positive: float = FALSE_POSITIVE,
+              chunk_paths: Optional[Callable[[int], Container[str]]] = None) -> 'Membership':
+        """Membership of (path, chunk) entries"""
+        empty = cls(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int32), false_positive=false_positive,
+                    chunk_paths=chunk_paths)
+        return empty.add(entries)
+
+    def save(self, directory: Path):
+        """
+        Save the arrays to directory, then their parameters and sizes
+        Each file is renamed into place; the parameters go last, so that
+        load can tell a set of files left mixed by a crash from a whole one.
+        """
+        directory = Path(directory)
+        sizes = {}
+        for name in ARRAYS:
+            tmp = directory / f"membership_{name}.npy.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, getattr(self, name))
+            sizes[name] = tmp.stat().st_size
+            os.replace(tmp, directory / f"membership_{name}.npy")
+        meta = {'members': len(self), 'capacity': self.capacity, 'false_positive': self.false_positive,
+                'bytes': sizes}
+        tmp = directory / f"{META_NAME}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, directory / META_NAME)
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional['Membership']:
+        """
+        Memory-map the membership saved in directory; hits are confirmed
+        against the index shards next to it
+        Returns None if there is none, or if its files do not belong together
+        because a save was interrupted; the next update then rebuilds it.
+        """
+        directory = Path(directory)
+        if not (directory / META_NAME).exists():
+            return None
+        with open(directory / META_NAME) as f:
+            meta = json.load(f)
+        files = {name: directory / f"membership_{name}.npy" for name in ARRAYS}
+        if any(not path.exists() or path.stat().st_size != meta.get('bytes', {}).get(name)
+               for name, path in files.items()):
+            logging.warning(f"Ignoring the incomplete membership filter in {directory}")
+            return None
+        arrays = {name: np.load(path, mmap_mode='r') for name, path in files.items()}
+        membership = cls(arrays['hashes'], arrays['chunks'], arrays['bloom'], meta['capacity'],
+                         meta['false_positive'], lru_cache(maxsize=4)(lambda chunk: shard(directory, chunk)))
+        if not (len(membership) == len(arrays['chunks']) == meta['members']
+                and len(membership.bloom) == (membership.bits + 7) // 8):
+            logging.warning(f"Ignoring the inconsistent membership filter in {directory}")
+            return None
+        return membership
+
+
+def shard(directory: Path, chunk: int) -> Dict[str, Dict]:
+    """Index entries of one chunk, from the shard in directory; empty if there is none"""
+    path = Path(directory) / f"chunk_{chunk:05d}.json"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def shard_entries(doc_dir: Path) -> Iterable[Tuple[str, int]]:
+    """(path, chunk) of every entry of the compacted index shards"""
+    for shard in sorted((Path(doc_dir) / SHARD_DIR).glob('chunk_*.json')):
+        with open(shard) as f:
+            for path, info in json.load(f).items():
+                yield path, info['chunk']
+
+
+def update(doc_dir: Path, entries: Iterable[Tuple[str, int]]) -> Membership:
+    """Add entries to the membership saved next to the index of doc_dir, building it from all shards if missing"""
+    directory = Path(doc_dir) / SHARD_DIR
+    membership = Membership.load(directory)
+    membership = Membership.build(shard_entries(doc_dir)) if membership is None else membership.add(entries)
+    membership.save(directory)
+    return membership
+
+
+def confirm(doc_dir: Path, path: str, chunk: int) -> Optional[Dict]:
+    """Index entry of path in the shard of chunk, None if the hash matched another path"""
+    return shard(Path(doc_dir) / SHARD_DIR, chunk).get(path)
+
+
+def check(doc_dir: Path, paths: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Index entry of each path that is on tape, None for the others
+    Absolute paths are taken relative to the archived root, the parent of doc_dir.
+    """
+    doc_dir = Path(doc_dir)
+    membership = Membership.load(doc_dir / SHARD_DIR)
+    root = str(doc_dir.resolve().parent)
+    results = []
+    for path in paths:
+        rel = os.path.relpath(path, root) if os.path.isabs(path) else path
+        chunk = membership.chunk_of(rel) if membership is not None else None
+        results.append((path, confirm(doc_dir, rel, chunk) if chunk is not None else None))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check whether files are already archived on tape')
+    parser.add_argument('doc_dir', help='docs directory of the archive')
+    parser.add_argument('paths', nargs='*', help='Paths to check, absolute or relative to the archived root')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the membership from all index shards')
+    args = parser.parse_args()
+    if args.rebuild:
+        membership = Membership.build(shard_entries(Path(args.doc_dir)))
+        membership.save(Path(args.doc_dir) / SHARD_DIR)
+        print(f"Indexed {len(membership)} archived files")
+    missing = 0
+    for path, info in check(Path(args.doc_dir), args.paths):
+        if info is None:
+            missing += 1
+            print(f"{path}: not archived")
+        else:
+            print(f"{path}: {info['archive']} (chunk {info['chunk']})")
+    return 1 if missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Phase-level profiling of an archiver run.
+
+A PhaseProfiler times the phases of DataArchiver.run one after the other:
+wall and CPU time, the peak RSS (resident memory) reached during the phase,
+and the item and byte counts the phase reports.  One phase can also be run
+under cProfile.  The results are written to docs/profile_<timestamp>.json,
+next to the other documentation of the run.
+
+On Linux the peak RSS of each phase is measured on its own, by resetting
+the kernel's high-water mark at the start of the phase; elsewhere the peak
+of the whole process so far is reported.
+"""
+import io
+import json
+import time
+import pstats
+import cProfile
+import datetime
+import resource
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Number of functions listed from the cProfile statistics
+PROFILE_TOP_FUNCTIONS = 30
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS of this process to its current RSS; False where the kernel does not support it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB, since the last reset where supported"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PhaseProfiler:
+    """
+    Records the cost of each phase of a run
+
+    A disabled profiler still runs the phases, it just records nothing, so
+    callers never need to check whether profiling is on.
+    """
+
+    def __init__(self, enabled: bool = False, cprofile_phase: Optional[str] = None):
+        self.enabled = enabled
+        self.cprofile_phase = cprofile_phase
+        self.phases: List[Dict] = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the enclosed block as phase name
+        Yields a dict in which the block stores its counts, e.g. files and bytes.
+        """
+        counts: Dict[str, int] = {}
+        if not self.enabled:
+            yield counts
+            return
+        per_phase_rss = reset_peak_rss()
+        profiler = cProfile.Profile() if name == self.cprofile_phase else None
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield counts
+        finally:
+            if profiler:
+                profiler.disable()
+            record = {
+                'phase': name,
+                'wall_s': time.perf_counter() - wall0,
+                'cpu_s': time.process_time() - cpu0,
+                'peak_rss_mb': peak_rss_mb(),
+                'per_phase_rss': per_phase_rss,
+            }
+            record.update(counts)
+            if profiler:
+                record['cprofile'] = self.top_functions(profiler)
+                record['_profiler'] = profiler
+            self.phases.append(record)
+
+    @staticmethod
+    def top_functions(profiler: cProfile.Profile) -> List[str]:
+        """The most expensive functions of a profile, by cumulative time"""
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        return [line for line in out.getvalue().splitlines() if line.strip()]
+
+    def write(self, doc_dir: Path, settings: Optional[Dict] = None) -> Optional[Path]:
+        """Write the recorded phases to doc_dir/profile_<timestamp>.json, and any cProfile data next to it"""
+        if not self.enabled:
+            return None
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        phases = []
+        for record in self.phases:
+            record = dict(record)
+            profiler = record.pop('_profiler', None)
+            if profiler:
+                stats_path = Path(doc_dir) / f"profile_{timestamp}_{record['phase']}.prof"
+                profiler.dump_stats(str(stats_path))
+                record['cprofile_stats'] = stats_path.name
+            phases.append(record)
+        report = {
+            'date': timestamp,
+            'total_wall_s': time.perf_counter() - self.started,
+            'settings': settings or {},
+            'phases': phases,
+        }
+        path = Path(doc_dir) / f"profile_{timestamp}.json"
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return path
+
+    def log_summary(self, log):
+        """Log one line per phase"""
+        for record in self.phases:
+            counts = ', '.join(f"{k} {v}" for k, v in record.items()
+                               if k not in ('phase', 'wall_s', 'cpu_s', 'peak_rss_mb', 'per_phase_rss',
+                                            'cprofile', '_profiler'))
+            log(f"{record['phase']}: {record['wall_s']:.2f} s wall, {record['cpu_s']:.2f} s cpu, "
+                f"{record['peak_rss_mb']:.0f} MB peak RSS" + (f" ({counts})" if counts else ''))
@@ -4,7 +4,15 @@ import json
 import re
 from pathlib import Path
 import os
-import numpy as np
+import sys
+import shlex
+import signal
+import socket
+import hashlib
+import tempfile
+import threading
+import socketserver
+import index_journal
 
 def parse_file_to_dict(file_path,ftype='large'):
     """
@@ -83,78 +91,270 @@ def search_archives(pattern: str, file_dic):
 
     return matches
 
+def load_docs(docs_dir):
+    """Load the indexes of a docs directory: the file index and the split and large path records"""
+    split_file=f"{docs_dir}/split_file.json"
+    large_path_file=f"{docs_dir}/large_path_file.json"
+    return {
+        #planned file index, overridden by the members chunk jobs verified on tape
+        'index': index_journal.load_index(docs_dir),
+        'split': parse_file_to_dict(split_file,ftype='split') if os.path.isfile(split_file) else {},
+        'large': parse_file_to_dict(large_path_file,ftype='large') if os.path.isfile(large_path_file) else {},
+    }
+
+def docs_signature(docs_dir):
+    """Modification times of the index files, to notice when a server has to reload them"""
+    names=['file_index.json','split_file.json','large_path_file.json']
+    paths=[os.path.join(docs_dir,n) for n in names]
+    shard_dir=os.path.join(docs_dir,index_journal.SHARD_DIR)
+    if os.path.isdir(shard_dir):
+        paths+=sorted(os.path.join(shard_dir,n) for n in os.listdir(shard_dir))
+    return [(p,os.stat(p).st_mtime_ns) for p in paths if os.path.isfile(p)]
+
+def find_matches(pattern, docs):
+    """
+    Search the loaded docs for pattern
+    Returns the regular, large path and split file matches; the loaded records are not modified
+    """
+    return collect_matches(lambda dic: search_archives(pattern, dic), docs)
+
+def collect_matches(select, docs, resolve=None):
+    """
+    Matches of select(dic), which returns the (path, record) pairs of dic to keep,
+    in the file index and the large path and split records; the archive members
+    holding large path and split files are found with resolve(file name)
+    (default: a search of the file index)
+    """
+    file_index_dic=docs['index']
+    split_dic=docs['split']
+    if resolve is None:
+        resolve=lambda fname: search_archives(fname, file_index_dic)
+    matches = select(file_index_dic)
+
+    #search large path file
+    match_large=[(file_path, dict(archive_info)) for file_path, archive_info in select(docs['large'])]
+    for file_path, archive_info in match_large:
+        #first check in the split file
+        tmp_match_split=search_archives(archive_info['short_path'], split_dic)
+        fname=archive_info['short_path'].split('/')[-1]
+        if( tmp_match_split): #This means this is also big file and had to be split
+            #now look at the split file
+            tmp_match= resolve(fname)
+            archive_info['archive']={'split_dic':tmp_match_split[0],'split_files':tmp_match}
+        else:
+            archive_info['archive'] = resolve(fname)
+
+    #search split file
+    match_split=[(file_path, dict(archive_info)) for file_path, archive_info in select(split_dic)]
+    for file_path, archive_info in match_split:
+        for tt,tfile in enumerate(archive_info['split_files']):
+            fname=tfile.split('/')[-1]
+            archive_info['archive%d'%tt] = resolve(fname)
+
+    return matches, match_large, match_split
+
+def read_queries(path):
+    """
+    Queries of a --from-file list, one per line; blank lines and lines starting with # are skipped.
+    A line starting with re: is a regular expression, any other line an exact path or a literal substring.
+    """
+    with open(path, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip() and not line.startswith('#')]
+
+def build_trie(literals):
+    """Character trie of the literals; the None key of a node lists the literals ending there"""
+    trie={}
+    for n,literal in enumerate(literals):
+        node=trie
+        for ch in literal:
+            node=node.setdefault(ch,{})
+        node.setdefault(None,[]).append(n)
+    return trie
+
+def trie_regex(node):
+    """Regular expression matching the strings of a trie, with common prefixes shared"""
+    branches=[re.escape(ch)+trie_regex(child) for ch,child in sorted((k,v) for k,v in node.items() if k is not None)]
+    if not branches:
+        return ''
+    if len(branches)==1 and None not in node:
+        return branches[0]
+    return '(?:'+'|'.join(branches)+')'+('?' if None in node else '')
+
+def find_bulk_matches(queries, docs):
+    """
+    Search the loaded docs for many queries (see read_queries) in one pass
+    Exact paths are dictionary lookups; all literal substrings are matched at
+    once by a single trie-shaped regular expression, then attributed to their
+    queries by walking the trie from each position it matched; the regular
+    expressions are combined into one as well.
+    Returns the regular, large path and split file matches and the queries that matched nothing
+    """
+    dics=[docs['index'], docs['large'], docs['split']]
+    exact, literals, patterns = [], [], []
+    for n,query in enumerate(queries):
+        if query.startswith('re:'):
+            patterns.append((n, re.compile(query[3:])))
+        elif any(query in dic for dic in dics):
+            exact.append(n)
+        else:
+            literals.append(n)
+    found=set(exact)
+    trie=build_trie([queries[n] for n in literals])
+    #zero-width, so that finditer reports every position where some literal starts
+    literal_re=re.compile('(?=%s)'%trie_regex(trie)) if literals else None
+    pattern_re=re.compile('|'.join('(?:%s)'%regex.pattern for _,regex in patterns)) if patterns else None
+
+    def literals_in(path):
+        hits=set()
+        for m in literal_re.finditer(path):
+            node,i=trie,m.start()
+            while i<len(path) and path[i] in node:
+                node=node[path[i]]
+                i+=1
+                hits.update(literals[k] for k in node.get(None, ()))
+        return hits
+
+    exact_paths={queries[n] for n in exact}
+    def select(dic):
+        selected=[(path, dic[path]) for path in exact_paths if path in dic]
+        if literal_re is None and pattern_re is None:
+            return selected
+        for path, archive_info in dic.items():
+            hit=False
+            if literal_re is not None and literal_re.search(path):
+                found.update(literals_in(path))
+                hit=True
+            if pattern_re is not None and pattern_re.search(path):
+                found.update(n for n,regex in patterns if regex.search(path))
+                hit=True
+            if hit and path not in exact_paths:
+                selected.append((path, archive_info))
+        return selected
+
+    #large path and split files are resolved by file name with one lookup table
+    by_name={}
+    def resolve(fname):
+        if not by_name:
+            for path, archive_info in docs['index'].items():
+                by_name.setdefault(path.split('/')[-1],[]).append((path, archive_info))
+        return by_name.get(fname, [])
+
+    matches, match_large, match_split=collect_matches(select, docs, resolve)
+    unmatched=[query for n,query in enumerate(queries) if n not in found]
+    return matches, match_large, match_split, unmatched
+
+def default_socket(docs_dir):
+    """Socket of the search server of a docs directory, one per user"""
+    key=hashlib.sha256(os.path.abspath(docs_dir).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"search_archive_{os.getuid()}_{key}.sock")
+
+def serve(docs_dir, socket_path):
+    """
+    Load the docs once and answer queries on a Unix socket until interrupted
+    Each request is one JSON line {"pattern": ...} or {"queries": [...]},
+    answered by one JSON line with the three match lists. The docs are reloaded when their files change.
+    """
+    state={'docs': load_docs(docs_dir), 'signature': docs_signature(docs_dir)}
+    lock=threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                request=json.loads(line)
+                with lock:
+                    signature=docs_signature(docs_dir)
+                    if signature!=state['signature']:
+                        print(f"Reloading {docs_dir}")
+                        state['docs'], state['signature']=load_docs(docs_dir), signature
+                    docs=state['docs']
+                try:
+                    if 'queries' in request:
+                        matches, match_large, match_split, unmatched=find_bulk_matches(request['queries'], docs)
+                    else:
+                        matches, match_large, match_split=find_matches(request['pattern'], docs)
+                        unmatched=[]
+                    reply={'matches': matches, 'match_large': match_large, 'match_split': match_split,
+                           'unmatched': unmatched}
+                except re.error as e:
+                    reply={'error': f"Invalid pattern {request.get('pattern', '')!r}: {e}"}
+                self.wfile.write((json.dumps(reply)+'\n').encode())
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    #exit cleanly on kill as well, removing the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        os.chmod(socket_path, 0o600)
+        print(f"Serving {docs_dir} on {socket_path}, {len(state['docs']['index'])} files indexed")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+def query_server(socket_path, pattern=None, queries=None):
+    """
+    Ask a running search server for pattern, or for the list of queries of a bulk search
+    Returns None if there is none; a bulk search also returns the queries that matched nothing
+    """
+    request={'pattern': pattern} if queries is None else {'queries': queries}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall((json.dumps(request)+'\n').encode())
+            with sock.makefile('rb') as f:
+                reply=json.loads(f.readline())
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if 'error' in reply:
+        raise re.error(reply['error'])
+    if queries is not None:
+        return reply['matches'], reply['match_large'], reply['match_split'], reply['unmatched']
+    return reply['matches'], reply['match_large'], reply['match_split']
+
 def main():
     parser = argparse.ArgumentParser(description='''Search archived files:
-        you should first extract the docs.tar with htar -xvf {archive_dir}/docs.tar and then give the path to this directory as --docs_dir
+        you should first copy the docs directory with hsi get -R {archive_dir}/docs and then give the path to this directory as --docs_dir
         example: python search_archive.py "ic_dens_N576_AbacusSummit_base_c000_ph000_" --docs_dir docs/ 
         To find all files in a directory:
-        example: python search_archive.py "CutSky/LRG/z0.800/" --docs_dir docs/ ''',
+        example: python search_archive.py "CutSky/LRG/z0.800/" --docs_dir docs/ 
+        To answer many searches quickly, keep the indexes loaded in a server (searches use it automatically):
+        example: python search_archive.py --serve --docs_dir docs/ &
+        To restore a list of files in one go (exact paths or substrings, one per line; prefix regular expressions with re:):
+        example: python search_archive.py --from-file wanted_files.txt --docs_dir docs/''',
                                      formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('pattern', help='File pattern to search for, If you want to find all files within a folder then please use relative path, that is path from the main directory archived to find all files otherwise only a subset of files might be detcted.')
+    parser.add_argument('pattern', nargs='?', help='File pattern to search for, If you want to find all files within a folder then please use relative path, that is path from the main directory archived to find all files otherwise only a subset of files might be detcted.')
     parser.add_argument('--docs_dir', default='docs/',help='Give the path to the docs directory extracted from archive')
+    parser.add_argument('--serve', action='store_true',help='Load the docs once and answer searches on a Unix socket')
+    parser.add_argument('--socket', default=None,help='Unix socket of the search server (default: one per user and docs directory in the temporary directory)')
+    parser.add_argument('--from-file', default=None,help='Search for every path or pattern listed in this file and write one extraction script grouped by archive')
     
     args = parser.parse_args()
+    socket_path = args.socket or default_socket(args.docs_dir)
+    if args.serve:
+        serve(args.docs_dir, socket_path)
+        return
+    if args.from_file is not None:
+        bulk_search(args.from_file, args.docs_dir, socket_path)
+        return
+    if args.pattern is None:
+        parser.error('the pattern is required unless --serve or --from-file is given')
     
-    #search file index
-    file_index=f"{args.docs_dir}/file_index.json"
-    with open(file_index, 'r') as f:
-        file_index_dic = json.load(f)
-    matches = search_archives(args.pattern, file_index_dic)
-    
-    #only load the split file
-    split_file=f"{args.docs_dir}/split_file.json"
-    if(os.path.isfile(split_file)):
-        split_dic=parse_file_to_dict(split_file,ftype='split')
-    else:
-        split_dic={}
-
-    #if large file exists then search in large dic
-    # search large path file
-    large_path_file=f"{args.docs_dir}/large_path_file.json"
-    if(os.path.isfile(large_path_file)):
-        large_dic=parse_file_to_dict(large_path_file,ftype='large')
-        match_large=search_archives(args.pattern, large_dic)
-        if match_large:
-            ii=0
-            for file_path, archive_info in match_large:
-                #first check in the split file
-                tmp_match_split=search_archives(match_large[ii][1]['short_path'], split_dic)
-                fname=match_large[ii][1]['short_path'].split('/')[-1]
-                if( tmp_match_split): #This means this is also big file and had to be split
-                    #now look at the split file
-                    tmp_match= search_archives(fname,file_index_dic)
-                    match_large[ii][1]['archive']={'split_dic':tmp_match_split[0],'split_files':tmp_match}
-                else:
-                    match_large[ii][1]['archive'] = search_archives(fname , file_index_dic)
-                ii=ii+1
-    else:
-        match_large=[]
-        
-    #if split file exists then search in split dic
-    # search split file
-    split_file=f"{args.docs_dir}/split_file.json"
-    if(os.path.isfile(split_file)):
-        match_split=search_archives(args.pattern, split_dic)
-        if match_split:
-            ii=0
-            for file_path, archive_info in match_split:
-                tsplit_file=match_split[ii][1]['split_files']
-                for tt,tfile in enumerate(tsplit_file):
-                    fname=tfile.split('/')[-1]
-                    match_split[ii][1]['archive%d'%tt] = search_archives(fname, file_index_dic)
-                ii=ii+1
-    else:
-        match_split=[]
+    #search with the server if one is running, otherwise load the docs here
+    found = query_server(socket_path, args.pattern)
+    if found is None:
+        found = find_matches(args.pattern, load_docs(args.docs_dir))
+    matches, match_large, match_split = found
 
-
-    nmatch=np.array([len(matches),len(match_large),len(match_split)])
+    nmatch=[len(matches),len(match_large),len(match_split)]
     
-    if nmatch.sum()==0:                                                                     
+    if sum(nmatch)==0:                                                                     
         print(f"No files found matching pattern: {args.pattern}")
         return
     else:
         all_comms_dic=[]
-        print(f"Found {nmatch.sum()} matching files: (regular:{nmatch[0]}, large: {nmatch[1]}, split: {nmatch[2]})")
+        print(f"Found {sum(nmatch)} matching files: (regular:{nmatch[0]}, large: {nmatch[1]}, split: {nmatch[2]})")
         if(nmatch[0]>0):
             comms_dic=print_matches(matches,ftype='regular')
             all_comms_dic.append(comms_dic)
@@ -171,33 +371,114 @@ def main():
             
     return 
 
-def print_matches(matches,ftype='regular'):
+def bulk_search(query_file, docs_dir, socket_path, outfile='extract_comms.sh'):
+    '''search for all queries of query_file at once and write a single extraction script grouped by archive'''
+    queries=read_queries(query_file)
+    found=query_server(socket_path, queries=queries)
+    if found is None:
+        found=find_bulk_matches(queries, load_docs(docs_dir))
+    matches, match_large, match_split, unmatched=found
+
+    nmatch=[len(matches),len(match_large),len(match_split)]
+    print(f"{len(queries)-len(unmatched)} of {len(queries)} queries matched {sum(nmatch)} files: (regular:{nmatch[0]}, large: {nmatch[1]}, split: {nmatch[2]})")
+    for query in unmatched[:20]:
+        print(f"\t No files found for: {query}")
+    if len(unmatched)>20:
+        print(f"\t ... and {len(unmatched)-20} more queries without matches")
+    if sum(nmatch)==0:
+        return
+
+    all_comms_dic=[]
+    for tmatches,ftype in zip([matches,match_large,match_split],['regular','large','split']):
+        if tmatches:
+            all_comms_dic.append(print_matches(tmatches,ftype=ftype,verbose=False))
+    write_bulk_script(all_comms_dic,outfile)
+
+def write_bulk_script(comms_dic_list,outfile):
+    '''
+    write the extraction commands as one script: a single htar call per archive, reading its
+    members from a list file, then the commands that rebuild the files, then the clean up
+    '''
+    extracts={}
+    steps={}
+    cleanup={}
+    for tdic in comms_dic_list:
+        for ikey,comms in tdic.items():
+            for comm in comms:
+                for comm_i in ([comm] if isinstance(comm,str) else comm):
+                    if(comm_i.startswith('htar -xvf ')):
+                        archive,member=comm_i[len('htar -xvf '):].split(' ',1)
+                        extracts.setdefault(archive,{})[member]=None
+                    elif(comm_i.startswith('rm ')):
+                        cleanup[comm_i]=None
+                    else:
+                        steps[comm_i]=None
+
+    list_dir=f"{os.path.splitext(outfile)[0]}_lists"
+    os.makedirs(list_dir,exist_ok=True)
+    with open(outfile,'w') as fout:
+        fout.write('#### extract from %d archives ####\n'%(len(extracts)))
+        for archive in sorted(extracts):
+            list_file=os.path.join(list_dir,os.path.basename(archive)+'.list')
+            with open(list_file,'w') as flist:
+                flist.write(''.join(member+'\n' for member in extracts[archive]))
+            fout.write('htar -xvf %s -L %s\n'%(archive,shlex.quote(list_file)))
+        if steps:
+            fout.write('\n#### rebuild split, large path, bundled, compressed and duplicate files ####\n')
+            fout.write(''.join(comm+'\n' for comm in steps))
+        if cleanup:
+            fout.write('\n#### clean up ####\n')
+            fout.write(''.join(comm+'\n' for comm in cleanup))
+    print('\n ****************\nThe commands to extract all found files are written in %s, with the member lists in %s'%(outfile,list_dir))
+    print('You can simply execute this file from this directory to actually extract all the files\n ****************\n')
+
+def print_matches(matches,ftype='regular',verbose=True):
     tag_dic={'regular': 'File:',
              'large': 'File (large path):',
              'split': 'File (split_files):'
              }
-    comms_dic={'regular':[],'large_split':[],'large':[],'split':[]}
+    #per-file details are only printed for single searches
+    say=print if verbose else (lambda *args: None)
+    comms_dic={'regular':[],'large_split':[],'large':[],'split':[],'bundle':[],'duplicate':[],'compressed':[]}
+    bundles={}
     for file_path, archive_info in matches:
-        print(f"\n{tag_dic[ftype]} {file_path}")
+        say(f"\n{tag_dic[ftype]} {file_path}")
         #print('\n\n',archive_info)
 #        print('\n\n',archive_info['archive']['split_dic'][1])
-        if(ftype=='regular'):
-            print(f"Archive: {archive_info['archive']}")
+        if(ftype=='regular' and 'bundle' in archive_info):
+            #small file packed in a tar bundle: extract the bundle once, then the members from it
+            say(f"Archive: {archive_info['archive']}")
+            say(f"\t This small file was packed in the bundle: {archive_info['bundle']}")
+            key=(archive_info['archive'],archive_info['bundle'])
+            bundles.setdefault(key,[]).append(file_path)
+        elif(ftype=='regular' and 'duplicate_of' in archive_info):
+            #identical copy of another archived file: extract that file and copy it here
+            say(f"Archive: {archive_info['archive']}")
+            say(f"\t This file is a duplicate of: {archive_info['duplicate_of']}")
+            comms_dic['duplicate'].append(generate_duplicate_commands(archive_info['archive'],archive_info['duplicate_of'],file_path,
+                                                                      compressed=archive_info.get('compressed')))
+        elif(ftype=='regular' and 'compressed' in archive_info):
+            #stored as a compressed copy: extract the copy and decompress it to the original path
+            say(f"Archive: {archive_info['archive']}")
+            say(f"\t This file was archived {archive_info['compression']}-compressed as: {archive_info['compressed']}")
+            comms_dic['compressed'].append(generate_compressed_commands(archive_info['archive'],archive_info['compressed'],file_path))
+        elif(ftype=='regular'):
+            say(f"Archive: {archive_info['archive']}")
             comms_dic['regular'].append(generate_extract_command(archive_info['archive'],file_path))
         elif(ftype=='large'):
             comm_this=[]
-            print('\t This file has large file_path, given below is shorten_path')
-            print(f"\t short_path: {archive_info['short_path']}")
+            say('\t This file has large file_path, given below is shorten_path')
+            say(f"\t short_path: {archive_info['short_path']}")
             if('split_dic' in archive_info['archive']):
                 sub_file_list=''
-                print(f"\t\t This file was split in {archive_info['archive']['split_dic'][1]['num_chunks']} subfiles due to its size")
+                say(f"\t\t This file was split in {archive_info['archive']['split_dic'][1]['num_chunks']} subfiles due to its size")
                 for tfile_path, tinfo in archive_info['archive']['split_files']:
-                    print(f"\t\t sub_File: {tfile_path}")
-                    print(f"\t\t Archive: {tinfo['archive']}")
+                    say(f"\t\t sub_File: {tfile_path}")
+                    say(f"\t\t Archive: {tinfo['archive']}")
                     comm_this.append(generate_extract_command(tinfo['archive'],tfile_path))
                     abs_file=get_absolute_path(tinfo['archive'],tfile_path)
                     sub_file_list='%s %s'%(sub_file_list,abs_file[1:])
-                print('\t\t Extract each of the subfile, join them and then you can rename it:\n\t\t\t %s'%(file_path))
+                say('\t\t Extract each of the subfile, join them and then you can rename it:\n\t\t\t %s'%(file_path))
                 #create the output directory if doesnot exists along with any parent
                 out_dir='/'.join(file_path[1:].split('/')[:-1])
                 Path(out_dir).mkdir(parents=True, exist_ok=True)
@@ -205,7 +486,7 @@ def print_matches(matches,ftype='regular'):
                 comms_dic['large_split'].append(comm_this)
             else:
                 #print(archive_info)
-                print(f"\t Archive: {archive_info['archive'][0][1]['archive']}")
+                say(f"\t Archive: {archive_info['archive'][0][1]['archive']}")
                 comm_this.append(generate_extract_command(archive_info['archive'][0][1]['archive'],archive_info['short_path']))
                 #create the output directory if doesnot exists along with any parent
                 out_dir='/'.join(file_path[1:].split('/')[:-1])
@@ -213,27 +494,62 @@ def print_matches(matches,ftype='regular'):
                 comm_this.append(f"mv {archive_info['short_path'][1:]} {file_path[1:]}")
                 comms_dic['large'].append(comm_this)
         elif(ftype=='split'):
-            print(f"\t This file was split in {archive_info['num_chunks']} subfiles due to its size")
+            say(f"\t This file was split in {archive_info['num_chunks']} subfiles due to its size")
             sub_file_list=''
-            comm_this
+            comm_this=[]
             for tt in range(0,archive_info['num_chunks']):
                 tfile_path=archive_info['archive%d'%tt][0][0]
                 tinfo=archive_info['archive%d'%tt][0][1]
-                print(f"\t sub_File: {tfile_path}")
-                print(f"\t Archive: {tinfo['archive']}")
+                say(f"\t sub_File: {tfile_path}")
+                say(f"\t Archive: {tinfo['archive']}")
                 abs_file=get_absolute_path(tinfo['archive'],tfile_path)
                 sub_file_list='%s %s'%(sub_file_list,abs_file[1:])
                 comm_this.append(generate_extract_command(tinfo['archive'],tfile_path[1:]))
-            print('\t Extract each of the subfile, join them and then you can rename it:\n\t\t %s'%(file_path))
+            say('\t Extract each of the subfile, join them and then you can rename it:\n\t\t %s'%(file_path))
             #create the output directory if doesnot exists along with any parent
             out_dir='/'.join(file_path[1:].split('/')[:-1])
             Path(out_dir).mkdir(parents=True, exist_ok=True)
             comm_this.append('cat %s | dd of=%s bs=1M'%(sub_file_list,file_path))
             comms_dic['split'].append(comm_this)
-            
+
+    for (archive,bundle),members in bundles.items():
+        comms_dic['bundle'].append(generate_bundle_commands(archive,bundle,members))
     
     return comms_dic
 
+def generate_bundle_commands(archive,bundle,members):
+    '''commands to extract members of a small-file bundle: get the bundle with htar, then untar the members
+    to where htar would have put them'''
+    abs_bundle=get_absolute_path(archive,bundle)
+    root_dir=get_absolute_path(archive,'')
+    comm_this=[generate_extract_command(archive,bundle)]
+    comm_this.append('mkdir -p %s'%(root_dir[1:]))
+    comm_this.append('tar -xvf %s -C %s %s'%(abs_bundle[1:],root_dir[1:],' '.join(shlex.quote(m) for m in members)))
+    comm_this.append('rm %s'%(abs_bundle[1:]))
+    return comm_this
+
+def generate_compressed_commands(archive,member,file):
+    '''commands to restore a compressed file: extract its gzip copy with htar and decompress it in place'''
+    abs_member=get_absolute_path(archive,member)
+    abs_file=get_absolute_path(archive,file)
+    comm_this=[generate_extract_command(archive,member)]
+    comm_this.append('mkdir -p %s'%(shlex.quote(os.path.dirname(abs_file[1:]))))
+    comm_this.append('gunzip -c %s > %s'%(shlex.quote(abs_member[1:]),shlex.quote(abs_file[1:])))
+    comm_this.append('rm %s'%(shlex.quote(abs_member[1:])))
+    return comm_this
+
+def generate_duplicate_commands(archive,original,file,compressed=None):
+    '''commands to restore a duplicate: restore the archived file with the same content and copy it'''
+    abs_original=get_absolute_path(archive,original)
+    abs_file=get_absolute_path(archive,file)
+    if(compressed is not None):
+        comm_this=generate_compressed_commands(archive,compressed,original)
+    else:
+        comm_this=[generate_extract_command(archive,original)]
+    comm_this.append('mkdir -p %s'%(shlex.quote(os.path.dirname(abs_file[1:]))))
+    comm_this.append('cp %s %s'%(shlex.quote(abs_original[1:]),shlex.quote(abs_file[1:])))
+    return comm_this
+
 def generate_extract_command(archive,file):
     abs_file=get_absolute_path(archive,file)
     #command to exract a file
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Scan a very large archive root as several shards, each in its own process or on its own node.
+
+A single node only keeps so many metadata requests in flight against the
+file system, however many threads walk the tree.  Here the planner lists
+the top shard_depth levels of the root itself and deals the directories
+found at that depth out to n tasks.  Each task walks its directories with
+file_table.scan_directories and saves a partial FileTable, rooted at the
+archive root, next to the shard spec; the partial tables are then appended
+to the planner's table in task order, giving the same table a single-node
+scan would, up to the order of its rows.  The tasks run as Slurm tasks of
+the current allocation with srun, spread over its nodes, or as a local
+process pool for testing.
+
+example (task 3 of a spec, as srun runs it): python shard_scan.py docs/scan_shards/shards.json --task 3
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Sequence
+
+from file_table import FileTable, list_directory, scan_directories
+
+SPEC_NAME = 'shards.json'
+
+
+def plan_shards(table: FileTable, n_tasks: int, depth: int = 2, exclude: Sequence[str] = ()) -> List[List[str]]:
+    """
+    List the top depth levels of table.root into table, and deal the
+    directories found at that depth out to n_tasks tasks, round robin
+    """
+    exclude = {path.rstrip('/') for path in exclude}
+    level = [table.root]
+    for _ in range(depth):
+        below = []
+        for path in level:
+            subdirs, names, sizes, mtimes = list_directory(path)
+            dir_id = table.directory_id(path)
+            if names:
+                table.add_files(dir_id, names, sizes, mtimes)
+            children = (f"{path.rstrip('/')}/{name}" for name in sorted(subdirs))
+            below.extend(child for child in children if child not in exclude)
+        level = below
+    return [level[k::n_tasks] for k in range(n_tasks)]
+
+
+def partial_path(spec_file: str, task: int) -> Path:
+    """File the partial table of a task is saved to"""
+    return Path(spec_file).parent / f"table_{task:04d}.npz"
+
+
+def scan_task(spec_file: str, task: int) -> Path:
+    """Walk the directories of one task of a shard spec and save its partial table"""
+    with open(spec_file, 'r') as f:
+        spec = json.load(f)
+    table = FileTable(spec['root'])
+    for shard in spec['tasks'][task]:
+        for path, names, sizes, mtimes in scan_directories(shard, spec['workers'], spec['exclude']):
+            dir_id = table.directory_id(path)
+            if names:
+                table.add_files(dir_id, names, sizes, mtimes)
+    path = partial_path(spec_file, task)
+    table.save(str(path))
+    logging.info(f"Scan task {task}: {len(table)} files in {len(table.dir_names)} directories "
+                 f"below {len(spec['tasks'][task])} shard roots")
+    return path
+
+
+def run_tasks(spec_file: str, n_tasks: int, launcher: str = 'local'):
+    """Run every task of a shard spec, as Slurm tasks (launcher 'srun') or as local processes"""
+    if launcher == 'srun':
+        subprocess.run(['srun', f"--ntasks={n_tasks}", sys.executable, str(Path(__file__).resolve()),
+                        str(spec_file)], check=True)
+    else:
+        with ProcessPoolExecutor(max_workers=n_tasks) as executor:
+            list(executor.map(scan_task, [str(spec_file)] * n_tasks, range(n_tasks)))
+
+
+def sharded_scan(root: str, shard_dir: Path, n_tasks: int, depth: int = 2, exclude: Sequence[str] = (),
+                 num_workers: int = 8, launcher: str = 'local') -> FileTable:
+    """
+    Scan root in n_tasks tasks of num_workers threads each and merge their tables
+    shard_dir: Directory for the spec and the partial tables, visible to every
+               node; it is removed once the tables are merged
+    """
+    table = FileTable(root)
+    tasks = plan_shards(table, n_tasks, depth, exclude)
+    logging.info(f"Scanning {sum(len(t) for t in tasks)} directories at depth {depth} of {root} "
+                 f"in {n_tasks} tasks ({launcher})")
+    if shard_dir.exists():
+        shutil.rmtree(shard_dir)
+    shard_dir.mkdir(parents=True)
+    spec_file = shard_dir / SPEC_NAME
+    with open(spec_file, 'w') as f:
+        json.dump({'root': table.root, 'exclude': list(exclude), 'workers': num_workers, 'tasks': tasks},
+                  f, indent=2)
+    run_tasks(spec_file, n_tasks, launcher)
+
+    missing = [k for k in range(n_tasks) if not partial_path(spec_file, k).exists()]
+    if missing:
+        raise RuntimeError(f"Scan tasks {missing} wrote no table to {shard_dir}")
+    for k in range(n_tasks):
+        table.extend(FileTable.load(str(partial_path(spec_file, k))))
+    shutil.rmtree(shard_dir)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one task of a sharded archive scan')
+    parser.add_argument('spec', help=f"Shard spec ({SPEC_NAME}) written by the archiver")
+    parser.add_argument('--task', type=int, default=int(os.environ.get('SLURM_PROCID', 0)),
+                        help='Task number (default: $SLURM_PROCID)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    scan_task(args.spec, args.task)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the NERSC ``hsi`` and ``htar`` commands with a tape latency model.
+
+Archives are stored on local disk under a simulation store, and every tape
+operation is charged a simulated cost: mounting a cartridge in a drive,
+seeking (locating) to the position of the data and streaming the bytes.
+Jobs that run concurrently at NERSC (one Slurm job per chunk) are simulated
+as independent sessions sharing a fixed number of drives, while a restore
+script is a single session in which operations run one after the other.
+The simulated wall time then tells how archive sizing, the number of
+archives per directory and the retrieval order affect end-to-end time.
+
+Typical use:
+    python tape_simulator.py init --store sim/ --drives 4
+    python tape_simulator.py run-jobs --store sim/ archive_chunk_*.sh
+    python tape_simulator.py reset-clock --store sim/
+    python tape_simulator.py restore --store sim/ extract_comms.sh
+
+The generated jobs and restore scripts run unchanged: ``run-jobs`` and
+``restore`` put ``hsi`` and ``htar`` shims that call this module in front
+of ``PATH``.  The shims can also be installed on their own with ``install``.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import shlex
+import shutil
+import tarfile
+import argparse
+import datetime
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Default latency model, loosely based on the LTO-9 drives behind NERSC HPSS
+DEFAULT_MODEL = {
+    'drives': 4,                       # number of tape drives shared by all sessions
+    'tape_capacity': 18 * 1000**4,     # bytes per cartridge
+    'bandwidth': 300 * 1000**2,        # streaming rate of one drive in bytes/s
+    'mount_time': 60.0,                # robot fetch, load and thread, in s
+    'unmount_time': 30.0,              # rewind and unload, in s
+    'locate_base': 10.0,               # fixed cost of any locate, in s
+    'locate_full': 90.0,               # additional cost of a locate over the full tape length, in s
+    'op_overhead': 2.0,                # per-transaction HPSS overhead, in s
+    'payload': 'tar',                  # 'tar' stores real data, 'sparse' only stores sizes
+}
+
+STORE_ENV = 'TAPE_SIM_STORE'
+SESSION_ENV = 'TAPE_SIM_SESSION'
+
+
+class TapeSimulator:
+    """
+    Simulated HPSS namespace and tape library
+
+    The HPSS namespace lives in ``store/hpss``, the library state (cartridges,
+    file positions, drives, session clocks and counters) in ``store/state.json``.
+    All state updates are serialized with a lock file, so several shims may
+    run at the same time, as they do when chunk jobs run concurrent htar streams.
+    """
+
+    def __init__(self, store: str):
+        self.store = Path(store).resolve()
+        self.namespace = self.store / 'hpss'
+        self.state_file = self.store / 'state.json'
+        self.lock_file = self.store / 'state.lock'
+        if not (self.store / 'model.json').is_file():
+            raise FileNotFoundError(f"{self.store} is not a simulation store, create it with 'init' first")
+        with open(self.store / 'model.json') as f:
+            self.model = json.load(f)
+
+    @classmethod
+    def init(cls, store: str, model: Optional[Dict] = None) -> 'TapeSimulator':
+        """Create an empty simulation store with the given latency model"""
+        store_path = Path(store)
+        (store_path / 'hpss').mkdir(parents=True, exist_ok=True)
+        params = dict(DEFAULT_MODEL)
+        params.update({k: v for k, v in (model or {}).items() if v is not None})
+        with open(store_path / 'model.json', 'w') as f:
+            json.dump(params, f, indent=2)
+        sim = cls(store)
+        with sim.locked() as state:
+            state.clear()
+            state.update(sim.empty_state())
+        return sim
+
+    def empty_state(self) -> Dict:
+        return {
+            'tapes': [],          # bytes used on each cartridge
+            'files': {},          # hpss path -> [tape, offset, size]
+            'drives': [{'tape': None, 'head': 0, 'free_at': 0.0, 'last_used': 0.0}
+                       for _ in range(self.model['drives'])],
+            'sessions': {},       # session name -> simulated clock in s
+            'counters': {'mounts': 0, 'locates': 0, 'mount_s': 0.0, 'locate_s': 0.0,
+                         'stream_s': 0.0, 'bytes_read': 0, 'bytes_written': 0, 'operations': 0},
+        }
+
+    @contextmanager
+    def locked(self):
+        """Load the state under an exclusive lock and save it on exit"""
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self.empty_state()
+                if self.state_file.exists():
+                    with open(self.state_file) as f:
+                        state = json.load(f)
+                yield state
+                tmp = self.state_file.with_suffix('.tmp')
+                with open(tmp, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def local_path(self, hpss_path: str) -> Path:
+        """Location of an HPSS path inside the store"""
+        return self.namespace / hpss_path.lstrip('/')
+
+    # ------------------------------------------------------------------
+    # Latency model
+    # ------------------------------------------------------------------
+    def _charge(self, state: Dict, tape: int, position: int, nbytes: int, write: bool) -> float:
+        """
+        Charge one tape transfer and advance the clocks
+
+        The transfer runs on the drive already holding the cartridge, or else
+        on the least recently used drive, which unmounts whatever it holds.
+        It starts when both the drive and the calling session are free.
+
+        Returns:
+            Simulated duration of the transfer in seconds
+        """
+        model = self.model
+        counters = state['counters']
+        session = os.environ.get(SESSION_ENV, 'default')
+        now = state['sessions'].get(session, 0.0)
+
+        drives = state['drives']
+        drive = next((d for d in drives if d['tape'] == tape), None)
+        cost = model['op_overhead']
+        if drive is None:
+            drive = min(drives, key=lambda d: (max(d['free_at'], now), d['last_used']))
+            if drive['tape'] is not None:
+                cost += model['unmount_time']
+            cost += model['mount_time']
+            counters['mounts'] += 1
+            counters['mount_s'] += model['mount_time']
+            drive['tape'] = tape
+            drive['head'] = 0
+
+        if drive['head'] != position:
+            locate = model['locate_base'] + model['locate_full'] * abs(position - drive['head']) / model['tape_capacity']
+            cost += locate
+            counters['locates'] += 1
+            counters['locate_s'] += locate
+
+        stream = nbytes / model['bandwidth']
+        cost += stream
+        counters['stream_s'] += stream
+        counters['bytes_written' if write else 'bytes_read'] += nbytes
+        counters['operations'] += 1
+
+        start = max(drive['free_at'], now)
+        drive['free_at'] = start + cost
+        drive['last_used'] = drive['free_at']
+        drive['head'] = position + nbytes
+        state['sessions'][session] = drive['free_at']
+        return cost
+
+    def _allocate(self, state: Dict, hpss_path: str, nbytes: int) -> Tuple[int, int]:
+        """Place a new file at the end of the cartridge currently being filled"""
+        tapes = state['tapes']
+        if not tapes or tapes[-1] + nbytes > self.model['tape_capacity']:
+            tapes.append(0)
+        tape, offset = len(tapes) - 1, tapes[-1]
+        tapes[-1] += nbytes
+        state['files'][hpss_path] = [tape, offset, nbytes]
+        return tape, offset
+
+    def record_write(self, hpss_path: str, nbytes: int) -> float:
+        with self.locked() as state:
+            tape, offset = self._allocate(state, hpss_path, nbytes)
+            return self._charge(state, tape, offset, nbytes, write=True)
+
+    def record_reads(self, hpss_path: str, extents: List[Tuple[int, int]]) -> float:
+        """Charge reading (offset, nbytes) extents of an HPSS file, in the given order"""
+        with self.locked() as state:
+            tape, start, _ = state['files'][hpss_path]
+            return sum(self._charge(state, tape, start + offset, nbytes, write=False)
+                       for offset, nbytes in extents)
+
+    def reset_clock(self):
+        """Unmount every cartridge and zero the clocks and counters, keeping the stored data"""
+        with self.locked() as state:
+            fresh = self.empty_state()
+            state['drives'] = fresh['drives']
+            state['sessions'] = fresh['sessions']
+            state['counters'] = fresh['counters']
+
+    def report(self) -> Dict:
+        """Simulated wall time (the latest session end) and the cost breakdown"""
+        with self.locked() as state:
+            sessions = state['sessions']
+            return {
+                'simulated_wall_s': max(sessions.values(), default=0.0),
+                'sessions': sessions,
+                'tapes_used': len(state['tapes']),
+                **state['counters'],
+            }
+
+    # ------------------------------------------------------------------
+    # hsi
+    # ------------------------------------------------------------------
+    def hsi(self, argv: List[str]) -> int:
+        """Emulate the hsi subcommands used by the archiver: ls, mkdir, get, put, rm"""
+        # hsi accepts a whole command line as one argument, as TapeOperations uses it
+        if len(argv) == 1:
+            argv = shlex.split(argv[0])
+        if not argv:
+            return 0
+        cmd, args = argv[0], argv[1:]
+        if cmd == 'ls':
+            return self._hsi_ls([a for a in args if not a.startswith('-')])
+        if cmd == 'mkdir':
+            for a in args:
+                if not a.startswith('-'):
+                    self.local_path(a).mkdir(parents=True, exist_ok=True)
+            return 0
+        if cmd == 'put':
+            local, remote = self._split_transfer(args)
+            target = self.local_path(remote)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(local, target)
+            self.record_write(remote, target.stat().st_size)
+            return 0
+        if cmd == 'get':
+            local, remote = self._split_transfer(args, get=True)
+            source = self.local_path(remote)
+            if not source.is_file():
+                print(f"*** hpss_Open: {remote} not found", file=sys.stderr)
+                return 72
+            shutil.copyfile(source, local)
+            self.record_reads(remote, [(0, source.stat().st_size)])
+            return 0
+        if cmd == 'rm':
+            status = 0
+            for a in args:
+                if a.startswith('-'):
+                    continue
+                local = self.local_path(a)
+                if not local.is_file():
+                    print(f"*** hpss_Unlink: {a} not found", file=sys.stderr)
+                    status = 72
+                    continue
+                local.unlink()
+                # Like a real cartridge, the space is not reclaimed
+                with self.locked() as state:
+                    state['files'].pop(a, None)
+            return status
+        print(f"tape_simulator: unsupported hsi command: {cmd}", file=sys.stderr)
+        return 1
+
+    @staticmethod
+    def _split_transfer(args: List[str], get: bool = False) -> Tuple[str, str]:
+        """Parse 'local : remote' (or just 'remote' for get) transfer arguments"""
+        if ':' in args:
+            i = args.index(':')
+            return args[i - 1], args[i + 1]
+        remote = args[-1]
+        return (Path(remote).name if get else remote), remote
+
+    def _hsi_ls(self, paths: List[str]) -> int:
+        status = 0
+        for p in paths:
+            local = self.local_path(p)
+            if not local.exists():
+                print(f"*** hpss_Lstat: {p} not found", file=sys.stderr)
+                status = 72
+                continue
+            entries = sorted(local.iterdir()) if local.is_dir() else [local]
+            if local.is_dir():
+                print(f"{p}:")
+            for e in entries:
+                st = e.stat()
+                kind = 'd' if e.is_dir() else '-'
+                date = datetime.datetime.fromtimestamp(st.st_mtime).strftime('%b %d %H:%M')
+                print(f"{kind}rw-r-----    1 {os.environ.get('USER', 'desi'):8s} desi {st.st_size:>16d} {date} {e.name}")
+        return status
+
+    # ------------------------------------------------------------------
+    # htar
+    # ------------------------------------------------------------------
+    def htar(self, argv: List[str]) -> int:
+        """Emulate htar -c, -t and -x with -f ARCHIVE and optional -L LISTFILE"""
+        if not argv or not argv[0].startswith('-'):
+            print("tape_simulator: htar needs an action flag", file=sys.stderr)
+            return 1
+        flags, rest = argv[0], argv[1:]
+        archive = rest.pop(0) if 'f' in flags else None
+        if archive is None:
+            print("tape_simulator: htar needs -f ARCHIVE", file=sys.stderr)
+            return 1
+        members = []
+        while rest:
+            a = rest.pop(0)
+            if a == '-L':
+                with open(rest.pop(0)) as f:
+                    members.extend(line.strip() for line in f if line.strip())
+            elif not a.startswith('-'):
+                members.append(a)
+        verbose = 'v' in flags
+        if 'c' in flags:
+            return self._htar_create(archive, members, verbose)
+        if 't' in flags:
+            return self._htar_list(archive)
+        if 'x' in flags:
+            return self._htar_extract(archive, members, verbose)
+        print(f"tape_simulator: unsupported htar action: {flags}", file=sys.stderr)
+        return 1
+
+    def _index_path(self, archive: str) -> Path:
+        return self.local_path(archive + '.idx')
+
+    def _read_index(self, archive: str) -> Optional[List]:
+        idx = self._index_path(archive)
+        if not idx.is_file():
+            return None
+        with open(idx) as f:
+            return json.load(f)
+
+    def _htar_create(self, archive: str, members: List[str], verbose: bool) -> int:
+        files = []
+        for m in members:
+            p = Path(m)
+            if p.is_dir():
+                files.extend(sorted(str(q) for q in p.rglob('*') if q.is_file()))
+            elif p.is_file():
+                files.append(m)
+            else:
+                print(f"HTAR: {m}: No such file or directory", file=sys.stderr)
+                return 70
+        target = self.local_path(archive)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        index, offset = [], 0
+        # Tar members are 512-byte blocks: a header, then the data padded to the block size
+        for f in files:
+            st = Path(f).stat()
+            index.append([f.lstrip('/'), st.st_size, int(st.st_mtime), offset + 512])
+            offset += 512 + -(-st.st_size // 512) * 512
+        if self.model['payload'] == 'tar':
+            with tarfile.open(target, 'w') as tar:
+                for f in files:
+                    tar.add(f, arcname=f.lstrip('/'), recursive=False)
+        else:
+            with open(target, 'wb') as out:
+                out.truncate(offset)
+        with open(self._index_path(archive), 'w') as f:
+            json.dump(index, f)
+        if verbose:
+            for name, *_ in index:
+                print(f"HTAR: a   {name}")
+        cost = self.record_write(archive, offset)
+        print(f"HTAR: HTAR SUCCESSFUL (simulated {cost:.1f} s)")
+        return 0
+
+    def _htar_list(self, archive: str) -> int:
+        index = self._read_index(archive)
+        if index is None:
+            print(f"HTAR: {archive}: archive not found", file=sys.stderr)
+            return 72
+        # Listing only reads the index file, which lives on the disk cache
+        for name, size, mtime, _ in index:
+            date = datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
+            print(f"HTAR: -rw-r--r--  {os.environ.get('USER', 'desi')}/desi {size:>16d} {date}  {name}")
+        print(f"HTAR: Listing complete for {archive}, {len(index)} files 0 directories")
+        print("HTAR: HTAR SUCCESSFUL")
+        return 0
+
+    def _htar_extract(self, archive: str, members: List[str], verbose: bool) -> int:
+        index = self._read_index(archive)
+        if index is None:
+            print(f"HTAR: {archive}: archive not found", file=sys.stderr)
+            return 72
+        wanted = [m.strip('/') for m in members]
+        selected = [e for e in index
+                    if not wanted or any(e[0] == w or e[0].startswith(w + '/') for w in wanted)]
+        if wanted and not selected:
+            print(f"HTAR: no matching members in {archive}", file=sys.stderr)
+            return 1
+        if self.model['payload'] == 'tar':
+            with tarfile.open(self.local_path(archive)) as tar:
+                tar.extractall(members=[tar.getmember(e[0]) for e in selected], filter='tar')
+        else:
+            for name, size, *_ in selected:
+                Path(name).parent.mkdir(parents=True, exist_ok=True)
+                with open(name, 'wb') as out:
+                    out.truncate(size)
+        if verbose:
+            for e in selected:
+                print(f"HTAR: x {e[0]}, {e[1]} bytes")
+        # htar reads members in archive order, whatever the order on the command line
+        extents = [(e[3], e[1]) for e in sorted(selected, key=lambda e: e[3])]
+        cost = self.record_reads(archive, extents)
+        print(f"HTAR: HTAR SUCCESSFUL (simulated {cost:.1f} s)")
+        return 0
+
+
+def install_shims(bin_dir: str, store: str) -> Path:
+    """Write hsi and htar executables that forward to this simulator"""
+    bin_path = Path(bin_dir).resolve()
+    bin_path.mkdir(parents=True, exist_ok=True)
+    me = Path(__file__).resolve()
+    for tool in ('hsi', 'htar'):
+        shim = bin_path / tool
+        with open(shim, 'w') as f:
+            f.write(f"""#!/bin/bash
+export {STORE_ENV}="${{{STORE_ENV}:-{Path(store).resolve()}}}"
+exec {sys.executable} {me} {tool} "$@"
+""")
+        shim.chmod(0o755)
+    return bin_path
+
+
+def run_scripts(store: str, scripts: List[str], concurrent: bool) -> Dict:
+    """
+    Run shell scripts against the simulator and report the simulated time
+
+    Args:
+        store: Simulation store
+        scripts: Scripts to run (archive jobs or restore scripts)
+        concurrent: If True, every script is its own session, as independent
+            Slurm jobs would be; otherwise all scripts share one session
+
+    Returns:
+        The simulator report
+    """
+    bin_dir = install_shims(Path(store) / 'bin', store)
+    env = dict(os.environ)
+    env['PATH'] = f"{bin_dir}{os.pathsep}{env.get('PATH', '')}"
+    env[STORE_ENV] = str(Path(store).resolve())
+    for i, script in enumerate(scripts):
+        env[SESSION_ENV] = f"job{i}:{Path(script).name}" if concurrent else 'restore'
+        t0 = time.perf_counter()
+        result = subprocess.run(['bash', script], env=env, capture_output=True, text=True)
+        status = 'ok' if result.returncode == 0 else f"exit {result.returncode}"
+        print(f"{script}: {status} ({time.perf_counter() - t0:.1f} s real)")
+        if result.returncode != 0:
+            print(result.stderr.strip(), file=sys.stderr)
+    return TapeSimulator(store).report()
+
+
+def print_report(report: Dict):
+    wall = report['simulated_wall_s']
+    print(f"\nSimulated wall time: {wall:.0f} s ({wall / 3600:.2f} h)")
+    print(f"Tapes used: {report['tapes_used']}, mounts: {report['mounts']}, locates: {report['locates']}")
+    print(f"Time mounting: {report['mount_s']:.0f} s, locating: {report['locate_s']:.0f} s, "
+          f"streaming: {report['stream_s']:.0f} s")
+    print(f"Bytes written: {report['bytes_written'] / 1024**4:.3f} TB, read: {report['bytes_read'] / 1024**4:.3f} TB")
+
+
+def main():
+    # hsi/htar arguments look like options, so dispatch them before argparse sees them
+    if len(sys.argv) > 1 and sys.argv[1] in ('hsi', 'htar'):
+        store = os.environ.get(STORE_ENV)
+        if not store:
+            print(f"tape_simulator: set {STORE_ENV} to the simulation store", file=sys.stderr)
+            sys.exit(1)
+        sim = TapeSimulator(store)
+        sys.exit(getattr(sim, sys.argv[1])(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description='Simulated HPSS tape backend with a mount/seek latency model')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_init = sub.add_parser('init', help='Create an empty simulation store')
+    p_init.add_argument('--store', required=True, help='Simulation store directory')
+    p_init.add_argument('--drives', type=int, help=f"Tape drives (default {DEFAULT_MODEL['drives']})")
+    p_init.add_argument('--tape-capacity', type=float, help='Cartridge capacity in TB (default 18)')
+    p_init.add_argument('--bandwidth', type=float, help='Drive streaming rate in MB/s (default 300)')
+    p_init.add_argument('--mount-time', type=float, help=f"Mount time in s (default {DEFAULT_MODEL['mount_time']})")
+    p_init.add_argument('--unmount-time', type=float, help=f"Unmount time in s (default {DEFAULT_MODEL['unmount_time']})")
+    p_init.add_argument('--locate-base', type=float, help=f"Fixed locate cost in s (default {DEFAULT_MODEL['locate_base']})")
+    p_init.add_argument('--locate-full', type=float, help=f"Full-length locate cost in s (default {DEFAULT_MODEL['locate_full']})")
+    p_init.add_argument('--op-overhead', type=float, help=f"Per-transaction overhead in s (default {DEFAULT_MODEL['op_overhead']})")
+    p_init.add_argument('--payload', choices=['tar', 'sparse'],
+                        help="'tar' stores real data, 'sparse' only sizes, for very large synthetic trees (default tar)")
+
+    p_install = sub.add_parser('install', help='Write hsi/htar shims into a directory')
+    p_install.add_argument('bin_dir', help='Directory for the shims; put it first on PATH')
+    p_install.add_argument('--store', required=True, help='Simulation store directory')
+
+    p_jobs = sub.add_parser('run-jobs', help='Run archive job scripts as concurrent sessions')
+    p_jobs.add_argument('scripts', nargs='+', help='Job scripts, e.g. archive_chunk_*.sh')
+    p_jobs.add_argument('--store', required=True, help='Simulation store directory')
+
+    p_restore = sub.add_parser('restore', help='Run restore scripts, e.g. extract_comms.sh, in one session')
+    p_restore.add_argument('scripts', nargs='+', help='Restore scripts')
+    p_restore.add_argument('--store', required=True, help='Simulation store directory')
+
+    p_reset = sub.add_parser('reset-clock', help='Unmount all tapes and zero the clocks, keeping the data')
+    p_reset.add_argument('--store', required=True, help='Simulation store directory')
+
+    p_report = sub.add_parser('report', help='Print the simulated time and cost breakdown')
+    p_report.add_argument('--store', required=True, help='Simulation store directory')
+    p_report.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    args = parser.parse_args()
+    if args.command == 'init':
+        model = {
+            'drives': args.drives,
+            'tape_capacity': int(args.tape_capacity * 1000**4) if args.tape_capacity else None,
+            'bandwidth': args.bandwidth * 1000**2 if args.bandwidth else None,
+            'mount_time': args.mount_time,
+            'unmount_time': args.unmount_time,
+            'locate_base': args.locate_base,
+            'locate_full': args.locate_full,
+            'op_overhead': args.op_overhead,
+            'payload': args.payload,
+        }
+        TapeSimulator.init(args.store, model)
+        print(f"Initialized simulation store {args.store}")
+    elif args.command == 'install':
+        print(f"Installed hsi and htar shims in {install_shims(args.bin_dir, args.store)}")
+    elif args.command in ('run-jobs', 'restore'):
+        print_report(run_scripts(args.store, args.scripts, concurrent=args.command == 'run-jobs'))
+    elif args.command == 'reset-clock':
+        TapeSimulator(args.store).reset_clock()
+        print("Clocks reset and all tapes unmounted")
+    else:
+        report = TapeSimulator(args.store).report()
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""Tests of the compaction of the index journal."""
+import json
+
+import index_journal
+from membership import Membership, shard
+
+
+def record(journal, path, chunk, **extra):
+    with open(journal, 'a') as f:
+        f.write(json.dumps(dict({'path': path, 'archive': f"archive_chunk_{chunk}.tar", 'size': 1,
+                                 'date': '20250101', 'chunk': chunk}, **extra)) + '\n')
+
+
+def test_compact_indexes_originals(tmp_path):
+    root = tmp_path / 'tree'
+    docs = root / 'docs'
+    docs.mkdir(parents=True)
+    long_path = 'a' * 120 + '/' + 'b' * 120 + '/long.dat'
+    with open(docs / 'large_path_file.json', 'w') as f:
+        json.dump({'path': f"{root}/{long_path}", 'short_path': f"{root}/large_path_files/S.dat"}, f, indent=2)
+    with open(docs / 'split_file.json', 'w') as f:
+        json.dump({'original_file': f"{root}/d/big.dat", 'original_size': 300, 'chunk_size': 150,
+                   'num_chunks': 2, 'split_files': [f"{root}/split_files/big.dat.split00",
+                                                    f"{root}/split_files/big.dat.split01"]}, f, indent=2)
+    journal = docs / index_journal.JOURNAL_NAME
+    record(journal, 'large_path_files/S.dat', 1)
+    record(journal, 'split_files/big.dat.split00', 1)
+    record(journal, 'd/small', 1)
+    index_journal.compact(docs)
+
+    membership = Membership.load(docs / index_journal.SHARD_DIR)
+    assert membership.confirm_many([long_path, 'd/small', 'large_path_files/S.dat']).all()
+    # Not every piece of the split file is on tape yet
+    assert not membership.confirm_many(['d/big.dat']).any()
+
+    record(journal, 'split_files/big.dat.split01', 2, part=2)
+    index_journal.compact(docs)
+    membership = Membership.load(docs / index_journal.SHARD_DIR)
+    assert len(membership) == 6
+    assert membership.chunk_of('d/big.dat') == 2
+    index = shard(docs / index_journal.SHARD_DIR, 1)
+    index.update(shard(docs / index_journal.SHARD_DIR, 2))
+    assert index['d/big.dat']['size'] == 300
+    assert 'part' not in index['d/big.dat']
+    assert index[long_path]['short_path'] == 'large_path_files/S.dat'
+    # They are not members to search for and extract
+    assert sorted(index_journal.load_index(str(docs))) == ['d/small', 'large_path_files/S.dat',
+                                                            'split_files/big.dat.split00',
+                                                            'split_files/big.dat.split01']
+
+
+def test_recorded_archives(tmp_path):
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    journal = docs / index_journal.JOURNAL_NAME
+    assert index_journal.recorded_archives(docs, 1) == set()
+    record(journal, 'd/a', 1)
+    record(journal, 'd/b', 2)
+    index_journal.compact(docs)
+    # Compacted records and records added since, but not a partial last line
+    record(journal, 'd/c', 1, archive='archive_chunk_1_part002.tar')
+    with open(journal, 'a') as f:
+        f.write('{"path": "d/d", "archive": "archive_chunk_1_part003.tar"')
+    assert index_journal.recorded_archives(docs, 1) == {'archive_chunk_1.tar', 'archive_chunk_1_part002.tar'}
+    assert index_journal.recorded_archives(docs, 3) == set()
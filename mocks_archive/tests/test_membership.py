@@ -0,0 +1,95 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""Tests of the membership filter of archived paths."""
+import json
+
+import numpy as np
+import pytest
+
+from membership import Membership, path_hashes, shard
+
+
+def paths(n, prefix='a/b'):
+    return [f"{prefix}/file_{i:06d}.fits" for i in range(n)]
+
+
+def test_lookup():
+    archived = paths(5000)
+    m = Membership.build((p, i % 7 + 1) for i, p in enumerate(archived))
+    assert len(m) == 5000
+    assert m.contains_many(archived).all()
+    assert [m.chunk_of(p) for p in archived[:20]] == [i % 7 + 1 for i in range(20)]
+    assert not m.contains_many(paths(5000, 'x/y')).any()
+    assert 'x/y/z' not in m
+    assert m.chunk_of('x/y/z') is None
+
+
+def test_empty():
+    m = Membership.build([])
+    assert len(m) == 0
+    assert not m
+    assert not m.contains_many(['a']).any()
+    assert m.confirm_many(['a']).tolist() == [False]
+
+
+def test_last_entry_wins():
+    m = Membership.build([('a', 1), ('b', 2), ('a', 3)])
+    assert len(m) == 2
+    assert m.chunk_of('a') == 3
+    m = m.add([('b', 4), ('c', 5), ('b', 6)])
+    assert len(m) == 3
+    assert (m.chunk_of('a'), m.chunk_of('b'), m.chunk_of('c')) == (3, 6, 5)
+    assert np.all(np.diff(m.hashes.astype(np.float64)) > 0)
+
+
+def test_add_keeps_members():
+    m = Membership.build((p, 1) for p in paths(500))
+    capacity = m.capacity
+    grown = m.add((p, 2) for p in paths(500, 'c'))
+    assert grown.capacity == capacity
+    assert grown.contains_many(paths(500) + paths(500, 'c')).all()
+    # Past its capacity the filter is rebuilt larger, without losing members
+    big = grown.add((p, 3) for p in paths(5000, 'd'))
+    assert big.capacity > capacity
+    assert big.contains_many(paths(500) + paths(500, 'c') + paths(5000, 'd')).all()
+    assert not big.contains_many(paths(5000, 'e')).any()
+    # The original is not modified
+    assert not m.contains_many(paths(500, 'c')).any()
+
+
+def test_confirm_rejects_hash_collisions():
+    # Simulate another path that has the hash of 'new/file'
+    m = Membership(path_hashes(['new/file']), np.array([3], dtype=np.int32),
+                   chunk_paths=lambda chunk: {'old/file'})
+    assert m.contains_many(['new/file']).tolist() == [True]
+    assert m.confirm_many(['new/file', 'other']).tolist() == [False, False]
+    m = Membership.build([('old/file', 3)], chunk_paths=lambda chunk: {'old/file'} if chunk == 3 else set())
+    assert m.confirm_many(['old/file', 'new/file']).tolist() == [True, False]
+
+
+def test_save_load(tmp_path):
+    index = {p: {'archive': 'x.tar', 'chunk': 2} for p in paths(100)}
+    (tmp_path / 'chunk_00002.json').write_text(json.dumps(index))
+    Membership.build((p, 2) for p in index).save(tmp_path)
+    m = Membership.load(tmp_path)
+    assert len(m) == 100
+    assert m.confirm_many(paths(100)).all()
+    assert shard(tmp_path, 2) == index
+    assert shard(tmp_path, 9) == {}
+
+
+def test_load_rejects_mixed_files(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    Membership.build((p, 1) for p in paths(10)).save(tmp_path / 'a')
+    Membership.build((p, 1) for p in paths(5000)).save(tmp_path / 'b')
+    # A crash after the first array of a save was replaced
+    (tmp_path / 'b' / 'membership_hashes.npy').replace(tmp_path / 'a' / 'membership_hashes.npy')
+    assert Membership.load(tmp_path / 'a') is None
+    assert Membership.load(tmp_path / 'missing') is None
+
+
+@pytest.mark.parametrize('false_positive', [0.01, 0.001])
+def test_bloom_false_positive_rate(false_positive):
+    m = Membership(path_hashes(paths(20000)), np.ones(20000, dtype=np.int32), false_positive=false_positive)
+    assert m._in_bloom(path_hashes(paths(20000))).all()
+    assert m._in_bloom(path_hashes(paths(20000, 'n'))).mean() < 2 * false_positive
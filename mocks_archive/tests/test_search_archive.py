@@ -0,0 +1,114 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""Tests of the bulk query mode of search_archive.py."""
+import json
+import random
+import re
+
+import pytest
+
+import index_journal
+from search_archive import (build_trie, find_bulk_matches, find_matches, generate_extract_command, load_docs,
+                            print_matches, trie_regex)
+
+
+def make_docs(n=400, seed=2):
+    rng = random.Random(seed)
+    words = ['mws', 'galaxia', 'alpha', 'healpix', 'lya', 'qso', 'v0.0.6', 'v1', 'a', 'ab', 'abc']
+    index = {}
+    for i in range(n):
+        path = '/'.join(rng.choice(words) for _ in range(rng.randint(1, 4))) + f"/f{i}.fits"
+        index[path] = {'archive': f"archive_chunk_{i % 5 + 1}.tar", 'size': i, 'date': '20250101', 'chunk': i % 5 + 1}
+    return {'index': index, 'large': {}, 'split': {}}
+
+
+def naive_matches(queries, docs):
+    """Paths of the index matched by any query, one query at a time, and the queries matching nothing"""
+    dics = [docs['index'], docs['large'], docs['split']]
+    matched, unmatched = set(), []
+    for query in queries:
+        if query.startswith('re:'):
+            hits = {p for dic in dics for p in dic if re.search(query[3:], p)}
+        elif any(query in dic for dic in dics):
+            hits = {query}
+        else:
+            hits = {p for dic in dics for p in dic if query in p}
+        if not hits:
+            unmatched.append(query)
+        matched |= hits & set(docs['index'])
+    return matched, unmatched
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bulk_equals_naive(seed):
+    docs = make_docs(seed=seed)
+    rng = random.Random(seed)
+    paths = sorted(docs['index'])
+    queries = rng.sample(paths, 5)
+    # Literal substrings, including literals that are prefixes of each other
+    queries += ['a', 'ab', 'abc', 'abc/', 'galaxia/alpha', 'f1', 'f12', 'f123', 'lya/q', 'nothere', 'v0.0']
+    queries += [path[rng.randrange(len(path)):][:rng.randint(1, 8)] for path in rng.sample(paths, 10)]
+    queries += ['re:^mws/.*\\.fits$', 're:f(7|8)\\d\\.fits', 're:^zzz']
+    matches, match_large, match_split, unmatched = find_bulk_matches(queries, docs)
+    expected, expected_unmatched = naive_matches(queries, docs)
+    assert sorted(p for p, _ in matches) == sorted(expected)
+    assert len(matches) == len(expected)
+    assert unmatched == expected_unmatched
+    assert match_large == [] and match_split == []
+
+
+def test_large_and_split_records():
+    docs = make_docs()
+    docs['large'] = {'very/long/path/x.fits': {'path': 'very/long/path/x.fits', 'short_path': 'large_path_files/Q.fits'}}
+    docs['index']['large_path_files/Q.fits'] = {'archive': 'archive_chunk_1.tar', 'size': 1, 'date': '', 'chunk': 1}
+    matches, match_large, match_split, unmatched = find_bulk_matches(['long/path', 'nothere'], docs)
+    assert matches == []
+    assert [p for p, _ in match_large] == ['very/long/path/x.fits']
+    assert [p for p, _ in match_large[0][1]['archive']] == ['large_path_files/Q.fits']
+    assert unmatched == ['nothere']
+
+
+def test_trie_regex():
+    literals = ['ab', 'abc', 'abd', 'b', 'x.y']
+    regex = re.compile('^' + trie_regex(build_trie(literals)) + '$')
+    for literal in literals:
+        assert regex.match(literal)
+    for other in ['a', 'abcd', 'xzy', '']:
+        assert not regex.match(other)
+
+
+def test_search_compacted_shards(tmp_path, monkeypatch):
+    root = tmp_path / 'tree'
+    docs = root / 'docs'
+    docs.mkdir(parents=True)
+    long_path = f"{root}/{'a' * 120}/{'b' * 120}/long.dat"
+    with open(docs / 'large_path_file.json', 'w') as f:
+        json.dump({'path': long_path, 'short_path': f"{root}/large_path_files/S.dat"}, f, indent=2)
+    with open(docs / 'split_file.json', 'w') as f:
+        json.dump({'original_file': f"{root}/d/big.dat", 'original_size': 300, 'chunk_size': 150, 'num_chunks': 2,
+                   'split_files': [f"{root}/split_files/big.dat.split00", f"{root}/split_files/big.dat.split01"]},
+                  f, indent=2)
+    with open(docs / index_journal.JOURNAL_NAME, 'w') as f:
+        for path in ['large_path_files/S.dat', 'split_files/big.dat.split00', 'split_files/big.dat.split01',
+                     'd/small']:
+            f.write(json.dumps({'path': path, 'archive': '/hpss/archive_chunk_1.tar', 'size': 1,
+                                'date': '20250101', 'chunk': 1}) + '\n')
+    index_journal.compact(docs)
+
+    loaded = load_docs(str(docs))
+    # The originals are for the membership filter, not members to extract
+    assert sorted(loaded['index']) == ['d/small', 'large_path_files/S.dat', 'split_files/big.dat.split00',
+                                       'split_files/big.dat.split01']
+    monkeypatch.chdir(tmp_path)
+    matches, match_large, match_split = find_matches('long.dat', loaded)
+    assert matches == []
+    assert [p for p, _ in match_large] == [long_path]
+    commands = print_matches(match_large, ftype='large', verbose=False)
+    assert commands['regular'] == []
+    extract, move = commands['large'][0]
+    assert extract == generate_extract_command('/hpss/archive_chunk_1.tar', f"{root}/large_path_files/S.dat")
+    assert move.endswith(f" {long_path[1:]}")
+    matches, match_large, match_split = find_matches('big.dat', loaded)
+    assert [p for p, _ in matches] == ['split_files/big.dat.split00', 'split_files/big.dat.split01']
+    assert [p for p, _ in match_split] == [f"{root}/d/big.dat"]
+    assert print_matches(matches, verbose=False)['regular'] == [
+        generate_extract_command('/hpss/archive_chunk_1.tar', p) for p, _ in matches]
@@ -0,0 +1,71 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst.
+"""Tests of the batch path shortener."""
+import json
+import random
+
+import pytest
+
+import String_shorter
+from String_shorter import NameRegistry, _short_codes, shorten_many, string_to_short_code
+
+PATHS = ['', 'a', 'noext', 'dir.v1/file', 'x/y/z.fits', 'x/y/z.fits.gz', 'x/.hidden', 'trailing.',
+         'unicode/ñame.dat', 'a' * 300 + '.extension_longer_than_the_code'] + \
+        [f"mws/galaxia/alpha/v0.0.6/healpix/{i}/mws_{i}.fits" for i in range(200)]
+
+
+@pytest.mark.parametrize('max_length', [8, 16, 32, 64])
+@pytest.mark.parametrize('preserve_extension', [True, False])
+def test_short_codes_equal_string_to_short_code(max_length, preserve_extension):
+    assert _short_codes(PATHS, max_length, preserve_extension) == \
+        [string_to_short_code(p, max_length, preserve_extension) for p in PATHS]
+
+
+def test_shorten_many_without_collisions():
+    paths = PATHS[1:]
+    assert shorten_many(paths, max_length=64, batch_size=7) == [string_to_short_code(p, 64) for p in paths]
+
+
+@pytest.fixture
+def one_char_codes(monkeypatch):
+    """Force collisions: the batch codes keep only their first character"""
+    short_codes = String_shorter._short_codes
+    monkeypatch.setattr(String_shorter, '_short_codes',
+                        lambda strings, max_length, preserve_extension:
+                        [c[:1] for c in short_codes(strings, max_length, preserve_extension)])
+
+
+def test_shorten_many_resolves_collisions(one_char_codes):
+    paths = PATHS[1:]
+    names = shorten_many(paths, max_length=32, batch_size=16)
+    assert len(set(names)) == len(paths)
+    # The result does not depend on the order of the input
+    shuffled = paths[:]
+    random.Random(3).shuffle(shuffled)
+    assert dict(zip(shuffled, shorten_many(shuffled, max_length=32, batch_size=5))) == dict(zip(paths, names))
+    # Repeated paths get the same name
+    assert shorten_many(paths[:3] * 2, max_length=32) == names[:3] * 2
+
+
+def test_shorten_many_registry(tmp_path, one_char_codes):
+    registry = tmp_path / 'short_names.json'
+    first = shorten_many(PATHS[1:50], max_length=32, registry=str(registry))
+    assert json.loads(registry.read_text()) == dict(zip(PATHS[1:50], first))
+    # Registered paths keep their names, new ones avoid them
+    second = shorten_many(PATHS[1:], max_length=32, registry=str(registry))
+    assert second[:49] == first
+    assert len(set(second)) == len(second)
+
+
+def test_shorten_many_name_registry(tmp_path, one_char_codes):
+    registry_file = tmp_path / 'short_names.json'
+    # Calls sharing a NameRegistry give unique names and write the file only when saved
+    registry = NameRegistry(str(registry_file))
+    names = []
+    for start in range(1, len(PATHS), 20):
+        names += shorten_many(PATHS[start:start + 20], max_length=32, registry=registry)
+    assert len(set(names)) == len(names)
+    assert not registry_file.exists()
+    registry.save()
+    assert json.loads(registry_file.read_text()) == dict(zip(PATHS[1:], names))
+    # A new run keeps every registered name
+    assert shorten_many(PATHS[1:], max_length=32, registry=NameRegistry(str(registry_file))) == names
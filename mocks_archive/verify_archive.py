@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Verify every archive of a mocks archive against its planned index.
+
+The archives expected under archive_root, and the members and sizes each
+should hold, come from the searchable index: docs/file_index.json of the
+latest plan, and the shards of every archive chunk jobs verified since the
+first run (index_journal.load_index).  Each archive is listed with
+``htar -tvf``; the listing is parsed as it streams in, so huge archives
+never sit in memory, and names with spaces are handled.  A bounded number
+of archives is checked at once.  The result is a per-archive pass/fail
+report, docs/verify_report.json, and a summary table.
+
+example: python verify_archive.py /global/cfs/cdirs/desicollab/mocks/docs --workers 4
+"""
+import sys
+import json
+import logging
+import argparse
+import datetime
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from index_journal import load_index, parse_htar_listing, relative_member
+
+# Number of example names kept per problem in the report
+MAX_EXAMPLES = 20
+
+
+def load_plan(doc_dir: Path) -> Dict[str, str]:
+    """Root directory and archive root of the archive, from its checkpointed plan"""
+    plan_file = doc_dir / 'archive_plan.json'
+    settings = {}
+    if plan_file.exists():
+        with open(plan_file, 'r') as f:
+            settings = json.load(f).get('settings', {})
+    return {
+        'root_dir': settings.get('root_dir', str(doc_dir.resolve().parent)),
+        'archive_root': settings.get('archive_root'),
+    }
+
+
+def expected_members(doc_dir: Path) -> Dict[str, Dict[str, int]]:
+    """
+    Members each archive should hold, from the planned file index and the
+    compacted shards, which keep the archives of earlier runs
+    Returns {archive path: {member path relative to root: size}}; members of
+    small-file bundles live inside their bundle, compressed files are archived
+    as their compressed copy and duplicates are restored from another member,
+    so none of them is an htar member.
+    """
+    index = load_index(str(doc_dir))
+    archives: Dict[str, Dict[str, int]] = {}
+    for rel_path, info in index.items():
+        if not ('bundle' in info or 'compressed' in info or 'duplicate_of' in info):
+            archives.setdefault(info['archive'], {})[rel_path] = info['size']
+    return archives
+
+
+def archives_on_tape(archive_root: str) -> List[str]:
+    """Paths of the .tar archives in archive_root on tape"""
+    from Folder2Tape_NERSC_wLargeFile import TapeOperations
+    return [f"{archive_root.rstrip('/')}/{entry['name']}" for entry in TapeOperations.list_directory(archive_root)
+            if entry['type'] == 'file' and entry['name'].startswith('archive_chunk_')
+            and entry['name'].endswith('.tar')]
+
+
+def verify_archive(archive: str, expected: Dict[str, int], root: str) -> Dict:
+    """
+    Compare the htar listing of one archive with its expected members
+
+    Args:
+        archive: Archive path on tape
+        expected: {member path relative to root: size}
+        root: Directory that was archived
+
+    Returns:
+        Report with the status ('pass' or 'fail') and the missing,
+        unexpected and wrongly sized members
+    """
+    report = {'archive': archive, 'expected': len(expected), 'found': 0,
+              'missing': [], 'unexpected': [], 'size_mismatch': [], 'error': None}
+    remaining = dict(expected)
+    n_missing = n_unexpected = n_size = 0
+    # stderr goes to a file: a full stderr pipe would block htar while the listing is read
+    errors = tempfile.TemporaryFile(mode='w+', errors='surrogateescape')
+    proc = subprocess.Popen(['htar', '-tvf', archive], stdout=subprocess.PIPE, stderr=errors,
+                            text=True, errors='surrogateescape')
+    for name, size in parse_htar_listing(proc.stdout):
+        report['found'] += 1
+        rel_path = relative_member(name, root)
+        want = remaining.pop(rel_path, None)
+        if want is None:
+            n_unexpected += 1
+            if len(report['unexpected']) < MAX_EXAMPLES:
+                report['unexpected'].append(rel_path)
+        elif want != size:
+            n_size += 1
+            if len(report['size_mismatch']) < MAX_EXAMPLES:
+                report['size_mismatch'].append([rel_path, want, size])
+    proc.stdout.close()
+    returncode = proc.wait()
+    errors.seek(0)
+    stderr = errors.read()
+    errors.close()
+    if returncode != 0:
+        report['error'] = stderr.strip().splitlines()[-1] if stderr.strip() else f"htar exited with {returncode}"
+    n_missing = len(remaining)
+    report['missing'] = sorted(remaining)[:MAX_EXAMPLES]
+    report['n_missing'], report['n_unexpected'], report['n_size_mismatch'] = n_missing, n_unexpected, n_size
+    ok = report['error'] is None and not (n_missing or n_unexpected or n_size)
+    report['status'] = 'pass' if ok else 'fail'
+    return report
+
+
+def verify_all(doc_dir: Path, archive_root: Optional[str] = None, workers: int = 4,
+               report_path: Optional[Path] = None) -> List[Dict]:
+    """
+    Verify every planned archive, plus any other chunk archive found in archive_root
+
+    Args:
+        doc_dir: The docs directory of the archived tree
+        archive_root: Directory of the archives on tape (default: from the plan)
+        workers: Maximum number of htar listings running at once
+        report_path: Where to write the JSON report (default doc_dir/verify_report.json)
+
+    Returns:
+        One report per archive, sorted by archive path
+    """
+    doc_dir = Path(doc_dir)
+    plan = load_plan(doc_dir)
+    archive_root = archive_root or plan['archive_root']
+    expected = expected_members(doc_dir)
+    if archive_root:
+        for archive in archives_on_tape(archive_root):
+            # Archives on tape that are not in the plan fail with every member unexpected
+            expected.setdefault(archive, {})
+
+    logging.info(f"Verifying {len(expected)} archives with {workers} concurrent htar listings")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(verify_archive, archive, members, plan['root_dir'])
+                   for archive, members in sorted(expected.items())]
+        reports = []
+        for future in futures:
+            report = future.result()
+            logging.info(f"{report['status'].upper()} {report['archive']}")
+            reports.append(report)
+
+    report_path = report_path or doc_dir / 'verify_report.json'
+    with open(report_path, 'w') as f:
+        json.dump({'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   'root_dir': plan['root_dir'], 'archive_root': archive_root,
+                   'archives': reports}, f, indent=2)
+    return reports
+
+
+def print_report(reports: List[Dict]):
+    """Print one line per archive and a summary"""
+    print(f"{'status':6s} {'expected':>9s} {'found':>9s} {'missing':>8s} {'extra':>8s} {'size':>8s}  archive")
+    for r in reports:
+        print(f"{r['status']:6s} {r['expected']:>9d} {r['found']:>9d} {r['n_missing']:>8d} "
+              f"{r['n_unexpected']:>8d} {r['n_size_mismatch']:>8d}  {r['archive']}"
+              + (f"  ({r['error']})" if r['error'] else ''))
+    failed = sum(r['status'] != 'pass' for r in reports)
+    print(f"\n{len(reports) - failed} of {len(reports)} archives passed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify all archives of a mocks archive against its planned index')
+    parser.add_argument('doc_dir', help='The docs directory of the archived tree')
+    parser.add_argument('--archive-root', default=None,
+                        help='Directory of the archives on tape (default: from docs/archive_plan.json)')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of concurrent htar listings')
+    parser.add_argument('--report', default=None, help='JSON report file (default: DOC_DIR/verify_report.json)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    reports = verify_all(Path(args.doc_dir), args.archive_root, args.workers,
+                         Path(args.report) if args.report else None)
+    print_report(reports)
+    return 0 if all(r['status'] == 'pass' for r in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())